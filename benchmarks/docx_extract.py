@@ -0,0 +1,176 @@
+"""
+DOCX extraction benchmark: streaming parser vs python-docx.
+
+Generates a corpus of DOCX files of increasing size (paragraphs, schedule
+tables, headers/footers and footnotes), then extracts each one with both
+extractors in fresh interpreters and reports peak memory (RSS growth during
+extraction), throughput and how much text each path recovered.
+
+Usage (from the repo root):
+    python -m benchmarks.docx_extract
+    python -m benchmarks.docx_extract --sizes 200,2000,20000 --runs 5
+    python -m benchmarks.docx_extract --keep corpus/
+
+Needs python-docx to generate the corpus (and for the python-docx path).
+"""
+import os
+import io
+import sys
+import json
+import random
+import argparse
+import tempfile
+import statistics
+import subprocess
+import zipfile
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+EXTRACTORS = {
+    "streaming": "extract_text_from_docx",
+    "python-docx": "extract_text_from_docx_object_model",
+}
+
+_WORDS = (
+    "python course weekly assignment doubt session project variables loops functions "
+    "classes modules testing debugging data structures algorithms web django flask api "
+    "database students mentor certificate practice interview portfolio beginner advanced"
+).split()
+
+# Parsers are imported before the baseline so only extraction itself is
+# measured; peak memory is the high-water RSS minus the RSS just before
+_CHILD = """
+import json, sys, time, resource
+import docx, xml.etree.ElementTree
+from services import document_service
+extractor = getattr(document_service, sys.argv[1])
+def status_kb(field):
+    # VmHWM is per process image; ru_maxrss would include the (large) parent's peak after fork
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith(field + ":"))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+before = status_kb("VmRSS")
+started = time.perf_counter()
+text = extractor(sys.argv[2])
+seconds = time.perf_counter() - started
+after = status_kb("VmHWM")
+print(json.dumps({"seconds": seconds, "peak_kb": after - before, "chars": len(text)}))
+"""
+
+
+def _sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(_WORDS) for _ in range(rng.randint(8, 25))).capitalize() + "."
+
+
+def make_docx(paragraphs: int, seed: int = 0) -> bytes:
+    """A syllabus-like document: headings, text, a table every 50 paragraphs, footnotes."""
+    import docx
+
+    rng = random.Random(seed)
+    doc = docx.Document()
+    doc.sections[0].header.paragraphs[0].text = "CodeKivy Course Handbook"
+    doc.sections[0].footer.paragraphs[0].text = "codekivy.com"
+    for i in range(paragraphs):
+        if i % 50 == 0:
+            doc.add_heading(f"Module {i // 50 + 1}", 1)
+            table = doc.add_table(rows=6, cols=3)
+            for r in range(6):
+                cells = ("Week", "Topic", "Hours") if r == 0 else (str(r), _sentence(rng)[:40], str(rng.randint(2, 6)))
+                for c, value in enumerate(cells):
+                    table.cell(r, c).text = value
+        doc.add_paragraph(" ".join(_sentence(rng) for _ in range(rng.randint(1, 4))))
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return _add_footnotes(buffer.getvalue(), max(1, paragraphs // 100), rng)
+
+
+def _add_footnotes(data: bytes, count: int, rng: random.Random) -> bytes:
+    """python-docx can't write footnotes, so add a footnotes part directly."""
+    w = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+    notes = "".join(
+        f'<w:footnote w:id="{n}"><w:p><w:r><w:t>{_sentence(rng)}</w:t></w:r></w:p></w:footnote>'
+        for n in range(1, count + 1)
+    )
+    out = io.BytesIO()
+    with zipfile.ZipFile(io.BytesIO(data)) as source, zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as target:
+        for name in source.namelist():
+            target.writestr(name, source.read(name))
+        target.writestr("word/footnotes.xml", f"<w:footnotes {w}>{notes}</w:footnotes>")
+    return out.getvalue()
+
+
+def _extract_once(extractor: str, path: str) -> Dict:
+    result = subprocess.run(
+        [sys.executable, "-c", _CHILD, EXTRACTORS[extractor], path],
+        cwd=REPO_ROOT, capture_output=True, text=True, timeout=600
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{extractor} failed on {path}:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def benchmark_file(path: str, runs: int) -> Dict[str, Dict]:
+    """Median time, peak RSS growth and characters per extractor for one file."""
+    size = os.path.getsize(path)
+    results = {}
+    for extractor in EXTRACTORS:
+        samples = [_extract_once(extractor, path) for _ in range(runs)]
+        seconds = statistics.median(s["seconds"] for s in samples)
+        chars = samples[0]["chars"]
+        results[extractor] = {
+            "ms": round(seconds * 1000, 1),
+            "peak_mb": round(max(s["peak_kb"] for s in samples) / 1024, 1),
+            "mb_per_s": round(size / 1024 / 1024 / seconds, 1) if seconds else 0.0,
+            "chars": chars,
+            "chars_per_s": round(chars / seconds) if seconds else 0,
+        }
+    return results
+
+
+def run_benchmark(sizes: List[int], runs: int, keep: Optional[str] = None) -> List[Dict]:
+    directory = keep or tempfile.mkdtemp(prefix="docx_bench_")
+    os.makedirs(directory, exist_ok=True)
+    rows = []
+    for paragraphs in sizes:
+        path = os.path.join(directory, f"handbook_{paragraphs}.docx")
+        with open(path, "wb") as f:
+            f.write(make_docx(paragraphs, seed=paragraphs))
+        rows.append({"paragraphs": paragraphs, "bytes": os.path.getsize(path), "results": benchmark_file(path, runs)})
+        if not keep:
+            os.remove(path)
+    if not keep:
+        os.rmdir(directory)
+    return rows
+
+
+def print_report(rows: List[Dict]):
+    print(f"\n{'paragraphs':>10}{'file KB':>9}  {'extractor':<12}{'ms':>9}{'peak MB':>9}{'MB/s':>8}{'chars':>10}{'chars/s':>11}")
+    for row in rows:
+        for extractor, r in row["results"].items():
+            print(
+                f"{row['paragraphs']:>10}{row['bytes'] / 1024:>9.0f}  {extractor:<12}"
+                f"{r['ms']:>9.1f}{r['peak_mb']:>9.1f}{r['mb_per_s']:>8.1f}{r['chars']:>10}{r['chars_per_s']:>11}"
+            )
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark DOCX text extraction (streaming vs python-docx).")
+    parser.add_argument("--sizes", default="100,1000,10000", help="paragraph counts of the generated documents")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters per extractor and file")
+    parser.add_argument("--keep", help="write the corpus to this directory and keep it")
+    parser.add_argument("--json", dest="json_path", help="also save the results as JSON")
+    args = parser.parse_args(argv)
+
+    rows = run_benchmark([int(s) for s in args.sizes.split(",")], args.runs, args.keep)
+    print_report(rows)
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(rows, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,127 @@
+"""
+Import-time profile of the app's cold start.
+
+Imports main.py in fresh interpreters (as a new serverless instance would)
+with `python -X importtime`, and reports wall-clock import time, the slowest
+modules by cumulative time and the self time spent per top-level package.
+
+Usage (from the repo root):
+    python -m benchmarks.import_profile
+    python -m benchmarks.import_profile --runs 5 --top 30
+    python -m benchmarks.import_profile --budget-ms 1000
+
+With --budget-ms, the exit code is 1 if the median import time is over budget.
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Printed by the child after the import so its stdout can be told apart
+# from whatever the app prints while starting
+_MARKER = "COLD_START_MS"
+
+
+def _import_once(module: str, importtime: bool) -> subprocess.CompletedProcess:
+    code = f"import time; t = time.perf_counter(); import {module}; print('{_MARKER}', (time.perf_counter() - t) * 1000)"
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    result = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True, timeout=120)
+    if result.returncode != 0:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr[-2000:]}")
+    return result
+
+
+def _wall_ms(result: subprocess.CompletedProcess) -> float:
+    for line in reversed(result.stdout.splitlines()):
+        if line.startswith(_MARKER):
+            return float(line.split()[1])
+    raise RuntimeError("child did not report its import time")
+
+
+def measure_cold_start(module: str = "main", runs: int = 3) -> Dict:
+    """Wall-clock time to import the app in `runs` fresh interpreters."""
+    samples = [_wall_ms(_import_once(module, importtime=False)) for _ in range(runs)]
+    return {
+        "runs": runs,
+        "p50_ms": round(statistics.median(samples), 1),
+        "max_ms": round(max(samples), 1),
+    }
+
+
+def _parse_importtime(stderr: str) -> Dict[str, tuple]:
+    """name -> (self microseconds, cumulative microseconds)."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def profile_imports(module: str = "main", runs: int = 3) -> Dict:
+    """Per-module import times (median over runs) plus wall-clock totals."""
+    walls: List[float] = []
+    samples: Dict[str, List[tuple]] = defaultdict(list)
+    for _ in range(runs):
+        result = _import_once(module, importtime=True)
+        walls.append(_wall_ms(result))
+        for name, times in _parse_importtime(result.stderr).items():
+            samples[name].append(times)
+
+    modules = {
+        name: (statistics.median(t[0] for t in times) / 1000, statistics.median(t[1] for t in times) / 1000)
+        for name, times in samples.items()
+    }
+    packages: Dict[str, float] = defaultdict(float)
+    for name, (self_ms, _) in modules.items():
+        packages[name.split(".")[0]] += self_ms
+
+    return {
+        "runs": runs,
+        "wall_p50_ms": round(statistics.median(walls), 1),
+        "modules": modules,  # name -> (self ms, cumulative ms)
+        "packages": dict(packages),  # top-level package -> total self ms
+    }
+
+
+def print_profile(profile: Dict, top: int):
+    print(f"\nImport main: p50 {profile['wall_p50_ms']} ms over {profile['runs']} fresh interpreters (with -X importtime overhead)")
+
+    print(f"\n{'cumulative ms':>14}{'self ms':>10}  module")
+    slowest = sorted(profile["modules"].items(), key=lambda item: item[1][1], reverse=True)[:top]
+    for name, (self_ms, cumulative_ms) in slowest:
+        print(f"{cumulative_ms:>14.1f}{self_ms:>10.1f}  {name}")
+
+    print(f"\n{'self ms':>14}  package")
+    for name, self_ms in sorted(profile["packages"].items(), key=lambda item: item[1], reverse=True)[:top]:
+        print(f"{self_ms:>14.1f}  {name}")
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Import-time profile of the KivyBot API cold start.")
+    parser.add_argument("--module", default="main", help="module to import (default: main)")
+    parser.add_argument("--runs", type=int, default=3, help="fresh interpreters to sample")
+    parser.add_argument("--top", type=int, default=20, help="rows per table")
+    parser.add_argument("--budget-ms", type=float, help="fail if the median plain import time exceeds this")
+    args = parser.parse_args(argv)
+
+    print_profile(profile_imports(args.module, args.runs), args.top)
+
+    if args.budget_ms:
+        cold_start = measure_cold_start(args.module, args.runs)
+        print(f"\nCold start (no profiling): p50 {cold_start['p50_ms']} ms, max {cold_start['max_ms']} ms, budget {args.budget_ms:.0f} ms")
+        if cold_start["p50_ms"] > args.budget_ms:
+            print("❌ Over the cold-start budget")
+            return 1
+        print("✅ Within the cold-start budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
@@ -0,0 +1,519 @@
+"""
+Offline load test for main.py against local mock upstreams.
+
+Boots mock Gemini/Groq/Deepgram servers and the real app (each on its own
+thread and event loop), drives a weighted mix of chat, streaming chat, image,
+document upload, document Q&A and voice traffic with N concurrent virtual
+users, and reports throughput, latency percentiles and the app's event-loop
+lag.
+
+Usage (from the repo root):
+    python -m benchmarks.load_test --users 20 --duration 30
+    python -m benchmarks.load_test --mix chat=1,voice=1 --latency 0.5 --error-rate 0.02
+    python -m benchmarks.load_test --mix voice_stream=1,voice_ws=1
+    python -m benchmarks.load_test --mix doc_qa=4,doc_batch=1
+    python -m benchmarks.load_test --state-backend redis --mix chat=1,doc_qa=1,voice=1
+    python -m benchmarks.load_test --save baseline.json
+    python -m benchmarks.load_test --baseline baseline.json --max-regression 0.25
+
+Before the run, main.py is imported in fresh interpreters to measure the
+cold start (--cold-start-runs 0 skips it).
+
+With --baseline, the exit code is 1 if any scenario's p95 latency grew (or
+overall throughput or cold start got worse) by more than --max-regression.
+With --cold-start-budget-ms, it is 1 if the median cold start is over budget.
+"""
+import os
+import io
+import sys
+import json
+import time
+import uuid
+import base64
+import random
+import asyncio
+import argparse
+import tempfile
+from typing import Dict, List, Optional
+
+import httpx
+
+try:
+    from websockets.asyncio.client import connect as ws_connect
+except ImportError:
+    ws_connect = None
+
+from benchmarks.mock_upstreams import MockConfig, ServerThread, start_mock_upstreams
+from benchmarks.mock_redis import MockRedis
+from benchmarks.import_profile import measure_cold_start
+
+DEFAULT_MIX = "chat=35,chat_stream=15,image=5,upload=5,doc_qa=20,voice=10,voice_stream=10"
+
+QUESTIONS = [
+    "How do I register for a course",
+    "What is a Python decorator",
+    "Explain list comprehensions with an example",
+    "What does the Machine Learning Intern course cover",
+    "How do I fix an IndentationError",
+    "What is the difference between a list and a tuple",
+]
+
+DOCUMENT_QUESTIONS = [
+    "What is this document about",
+    "Summarize the section on functions",
+    "What does it say about error handling",
+    "List the main topics",
+]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def make_document_text(kb: int, seed: int) -> str:
+    """Plausible course-notes text of roughly kb kilobytes (unique per seed)."""
+    rng = random.Random(seed)
+    topics = ["functions", "classes", "error handling", "decorators", "generators", "file IO", "testing", "modules"]
+    words = ["python", "value", "return", "loop", "object", "module", "example", "student", "code", "list", "dict"]
+    paragraphs = []
+    size = 0
+    while size < kb * 1024:
+        topic = rng.choice(topics)
+        body = " ".join(rng.choice(words) for _ in range(80))
+        paragraph = f"Section on {topic} ({seed}-{len(paragraphs)}). {body}."
+        paragraphs.append(paragraph)
+        size += len(paragraph) + 2
+    return "\n\n".join(paragraphs)
+
+
+def make_docx(text: str) -> bytes:
+    import docx
+    document = docx.Document()
+    for paragraph in text.split("\n\n"):
+        document.add_paragraph(paragraph)
+    out = io.BytesIO()
+    document.save(out)
+    return out.getvalue()
+
+
+def make_image(kb: int) -> bytes:
+    """A screenshot-like PNG (text lines on white) when Pillow is installed, else random bytes."""
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return os.urandom(kb * 1024)
+    image = Image.new("RGB", (2560, 1600), "white")
+    draw = ImageDraw.Draw(image)
+    for y in range(0, 1600, 18):
+        draw.text((12, y), f"{y:>5}  def handler(request): return process(request.data)  # line " * 3, fill="black")
+    out = io.BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+class Results:
+    """Latencies and outcomes per scenario."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = {}
+        self.first_byte: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def record(self, scenario: str, seconds: float, ok: bool, first_byte: Optional[float] = None):
+        self.latencies.setdefault(scenario, []).append(seconds)
+        if first_byte is not None:
+            self.first_byte.setdefault(scenario, []).append(first_byte)
+        if not ok:
+            self.errors[scenario] = self.errors.get(scenario, 0) + 1
+
+    def summary(self, duration: float, loop_lag: List[float]) -> Dict:
+        scenarios = {}
+        total = 0
+        for scenario, values in sorted(self.latencies.items()):
+            total += len(values)
+            first = self.first_byte.get(scenario, [])
+            scenarios[scenario] = {
+                "requests": len(values),
+                "errors": self.errors.get(scenario, 0),
+                "rps": round(len(values) / duration, 2),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+                "first_byte_p50_ms": round(percentile(first, 0.50) * 1000, 1) if first else None,
+                "first_byte_p95_ms": round(percentile(first, 0.95) * 1000, 1) if first else None,
+            }
+        return {
+            "duration_s": round(duration, 2),
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "throughput_rps": round(total / duration, 2),
+            "loop_lag_p50_ms": round((percentile(loop_lag, 0.50) or 0) * 1000, 2),
+            "loop_lag_p99_ms": round((percentile(loop_lag, 0.99) or 0) * 1000, 2),
+            "loop_lag_max_ms": round(max(loop_lag, default=0) * 1000, 2),
+            "scenarios": scenarios,
+        }
+
+
+# --- SCENARIOS ---
+# Each returns (ok, first_byte_seconds or None). Latency is timed by the caller.
+
+class Scenarios:
+    def __init__(self, client: httpx.AsyncClient, args):
+        self.client = client
+        self.args = args
+        self.audio_data = os.urandom(args.audio_kb * 1024)
+        self.image_data = "data:image/png;base64," + base64.b64encode(make_image(args.image_kb)).decode()
+        self.uploads = 0
+
+    def question(self, pool: List[str]) -> str:
+        # Unique unless --repeat-ratio says otherwise (repeats exercise the response cache)
+        text = random.choice(pool)
+        if random.random() >= self.args.repeat_ratio:
+            text += f" (variant {uuid.uuid4().hex[:8]})"
+        return text
+
+    @staticmethod
+    def _json_ok(response: httpx.Response) -> bool:
+        if response.status_code != 200:
+            return False
+        body = response.json()
+        return "error" not in body and body.get("mode") != "error"
+
+    async def chat(self, session_id: str):
+        response = await self.client.post("/api/chat", json={"message": self.question(QUESTIONS), "session_id": session_id})
+        return self._json_ok(response), None
+
+    async def chat_stream(self, session_id: str):
+        started = time.perf_counter()
+        first_token = None
+        done = False
+        payload = {"message": self.question(QUESTIONS), "session_id": session_id}
+        async with self.client.stream("POST", "/api/chat/stream", json=payload) as response:
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:])
+                if "token" in event and first_token is None:
+                    first_token = time.perf_counter() - started
+                done = done or event.get("done", False)
+        return response.status_code == 200 and done, first_token
+
+    async def image(self, session_id: str):
+        payload = {"message": "What is wrong with this code?", "image": self.image_data, "session_id": session_id}
+        response = await self.client.post("/api/chat", json=payload)
+        return self._json_ok(response), None
+
+    async def upload(self, session_id: str):
+        self.uploads += 1
+        text = make_document_text(self.args.doc_kb, seed=random.randrange(10 ** 9))
+        if self.uploads % 2:
+            files = {"file": ("notes.txt", text.encode(), "text/plain")}
+        else:
+            files = {"file": ("notes.docx", make_docx(text), "application/vnd.openxmlformats-officedocument.wordprocessingml.document")}
+        response = await self.client.post("/api/document/upload", files=files, data={"session_id": f"{session_id}-upload"})
+        return self._json_ok(response), None
+
+    async def doc_qa(self, session_id: str):
+        payload = {"message": self.question(DOCUMENT_QUESTIONS), "mode": "document", "session_id": f"{session_id}-doc"}
+        response = await self.client.post("/api/chat", json=payload)
+        return self._json_ok(response), None
+
+    async def doc_batch(self, session_id: str):
+        questions = [self.question(DOCUMENT_QUESTIONS) for _ in range(self.args.batch_questions)]
+        response = await self.client.post("/api/document/ask", json={"questions": questions, "session_id": f"{session_id}-doc"})
+        if response.status_code != 200:
+            return False, None
+        answers = response.json().get("answers") or []
+        return len(answers) == len(questions) and all(answer["response"] for answer in answers), None
+
+    async def voice(self, session_id: str):
+        files = {"file": ("voice.webm", self.audio_data, "audio/webm")}
+        response = await self.client.post("/api/voice", files=files, data={"session_id": session_id, "audio_format": self.args.audio_format})
+        return self._json_ok(response), None
+
+    async def voice_stream(self, session_id: str):
+        started = time.perf_counter()
+        first_audio = None
+        done = False
+        files = {"file": ("voice.webm", self.audio_data, "audio/webm")}
+        async with self.client.stream("POST", "/api/voice/stream", files=files, data={"session_id": session_id, "audio_format": self.args.audio_format}) as response:
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event["type"] == "audio" and first_audio is None:
+                    first_audio = time.perf_counter() - started
+                done = done or event["type"] == "done"
+        return response.status_code == 200 and done, first_audio
+
+    async def voice_ws(self, session_id: str):
+        # Audio is streamed in 4 KB frames as if recorded live, so "first
+        # byte" here is the time from the end of speech to the first audio
+        if ws_connect is None:
+            raise RuntimeError("websockets is not installed")
+        url = str(self.client.base_url).replace("http", "ws", 1) + f"/ws/voice?session_id={session_id}&audio_format={self.args.audio_format}"
+        first_audio = None
+        done = False
+        async with ws_connect(url, max_size=None) as ws:
+            if json.loads(await ws.recv())["type"] != "ready":
+                return False, None
+            for offset in range(0, len(self.audio_data), 4096):
+                await ws.send(self.audio_data[offset:offset + 4096])
+                await asyncio.sleep(0.01)
+            await ws.send(json.dumps({"type": "stop"}))
+            stopped = time.perf_counter()
+            while not done:
+                event = json.loads(await ws.recv())
+                if event["type"] == "error":
+                    return False, None
+                if event["type"] == "audio" and first_audio is None:
+                    first_audio = time.perf_counter() - stopped
+                done = event["type"] == "done"
+            await ws.send(json.dumps({"type": "close"}))
+        return done, first_audio
+
+    async def preload_document(self, session_id: str):
+        """Give a virtual user's doc_qa session a document to ask about."""
+        text = make_document_text(self.args.doc_kb, seed=hash(session_id) % 10 ** 9)
+        files = {"file": ("course.txt", text.encode(), "text/plain")}
+        await self.client.post("/api/document/upload", files=files, data={"session_id": f"{session_id}-doc"})
+
+
+def parse_mix(spec: str) -> Dict[str, float]:
+    mix = {}
+    for item in spec.split(","):
+        name, _, weight = item.partition("=")
+        name = name.strip()
+        if not hasattr(Scenarios, name) or name.startswith("_"):
+            raise SystemExit(f"Unknown scenario in --mix: {name}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def virtual_user(user: int, scenarios: Scenarios, mix: Dict[str, float], deadline: float, results: Results, args):
+    session_id = f"bench-{user}"
+    names, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        scenario = random.choices(names, weights)[0]
+        started = time.perf_counter()
+        try:
+            ok, first_byte = await getattr(scenarios, scenario)(session_id)
+        except Exception as e:
+            if args.verbose:
+                print(f"⚠️ {scenario} failed: {e!r}")
+            ok, first_byte = False, None
+            await asyncio.sleep(0.05)  # don't spin if the app is unreachable
+        results.record(scenario, time.perf_counter() - started, ok, first_byte)
+        if args.think_time:
+            await asyncio.sleep(random.uniform(0, 2 * args.think_time))
+
+
+async def monitor_loop_lag(samples: List[float], interval: float = 0.01):
+    """Runs on the app's loop: how late each short sleep wakes up."""
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - started - interval))
+
+
+def configure_app_env(upstreams: Dict[str, ServerThread], args):
+    """Point the app at the mocks. Must run before main is imported."""
+    for provider, server in upstreams.items():
+        prefix = provider.upper()
+        os.environ[f"{prefix}_BASE_URL"] = server.url
+        os.environ.setdefault(f"{prefix}_API_KEY", "bench")
+        # Benchmark the app, not our client-side quotas
+        os.environ.setdefault(f"{prefix}_RATE_LIMIT", "100000")
+        os.environ.setdefault(f"{prefix}_RATE_BURST", "100000")
+    os.environ.setdefault("RESPONSE_CACHE", "1" if args.repeat_ratio else "0")
+    os.environ.setdefault("DOC_DISK_CACHE", "0")
+
+
+def configure_state_env(backend: str) -> Optional[MockRedis]:
+    """Select the session state backend (before main is imported); redis gets a local stand-in."""
+    os.environ["STATE_BACKEND"] = backend
+    if backend == "sqlite":
+        path = os.path.join(tempfile.mkdtemp(prefix="codekivy-bench-"), "state.sqlite3")
+        os.environ.setdefault("STATE_SQLITE_PATH", path)
+    elif backend == "redis":
+        server = MockRedis().start()
+        os.environ["STATE_REDIS_URL"] = server.url
+        return server
+    return None
+
+
+async def run(args) -> Dict:
+    mock = dict(
+        latency=args.latency,
+        jitter=args.jitter,
+        token_interval=args.token_interval,
+        tokens=args.tokens,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+    )
+    configs = {
+        "gemini": MockConfig(**mock),
+        "groq": MockConfig(**dict(mock, latency=args.latency / 2, token_interval=args.token_interval / 2)),
+        "deepgram": MockConfig(**dict(mock, tokens=0)),
+    }
+    cold_start = None
+    if args.cold_start_runs:
+        print(f"⏳ Measuring cold start ({args.cold_start_runs} fresh imports)...")
+        cold_start = await asyncio.to_thread(measure_cold_start, "main", args.cold_start_runs)
+
+    upstreams = await start_mock_upstreams(configs)
+    configure_app_env(upstreams, args)
+    state_server = configure_state_env(args.state_backend)
+
+    import main  # imported after the environment points at the mocks
+
+    loop_lag: List[float] = []
+    app_server = ServerThread(main.app, on_loop=lambda: monitor_loop_lag(loop_lag))
+    await app_server.start()
+    print(f"✓ App on {app_server.url}; mocks: " + ", ".join(f"{p}={s.url}" for p, s in upstreams.items()))
+
+    mix = parse_mix(args.mix)
+    limits = httpx.Limits(max_connections=args.users * 2, max_keepalive_connections=args.users * 2)
+    results = Results()
+    try:
+        async with httpx.AsyncClient(base_url=app_server.url, timeout=120, limits=limits) as client:
+            scenarios = Scenarios(client, args)
+            if "doc_qa" in mix or "doc_batch" in mix:
+                await asyncio.gather(*[scenarios.preload_document(f"bench-{u}") for u in range(args.users)])
+
+            if args.warmup:
+                print(f"⏳ Warm-up {args.warmup}s...")
+                warm_deadline = time.perf_counter() + args.warmup
+                await asyncio.gather(*[
+                    virtual_user(u, scenarios, mix, warm_deadline, Results(), args) for u in range(args.users)
+                ])
+                loop_lag.clear()
+
+            print(f"🚀 {args.users} users for {args.duration}s, mix: {args.mix}")
+            started = time.perf_counter()
+            deadline = started + args.duration
+            await asyncio.gather(*[
+                virtual_user(u, scenarios, mix, deadline, results, args) for u in range(args.users)
+            ])
+            elapsed = time.perf_counter() - started
+    finally:
+        await app_server.stop()
+        for server in upstreams.values():
+            await server.stop()
+        if state_server is not None:
+            state_server.stop()
+
+    summary = results.summary(elapsed, list(loop_lag))
+    summary["state"] = main.session_store.stats()["state"]
+    summary["config"] = {key: value for key, value in vars(args).items() if key not in ("save", "baseline")}
+    summary["upstream_requests"] = {provider: config.requests for provider, config in configs.items()}
+    summary["cold_start"] = cold_start
+    return summary
+
+
+def print_report(summary: Dict):
+    header = f"{'scenario':<14}{'reqs':>7}{'errs':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'ttfb50':>9}{'ttfb95':>9}"
+    print()
+    print(header)
+    print("-" * len(header))
+    for name, row in summary["scenarios"].items():
+        ttfb50 = row["first_byte_p50_ms"] if row["first_byte_p50_ms"] is not None else "-"
+        ttfb95 = row["first_byte_p95_ms"] if row["first_byte_p95_ms"] is not None else "-"
+        print(f"{name:<14}{row['requests']:>7}{row['errors']:>6}{row['rps']:>8}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{ttfb50:>9}{ttfb95:>9}")
+    print("-" * len(header))
+    print(f"Total: {summary['requests']} requests, {summary['errors']} errors, {summary['throughput_rps']} req/s over {summary['duration_s']}s")
+    print(f"Event-loop lag: p50 {summary['loop_lag_p50_ms']} ms, p99 {summary['loop_lag_p99_ms']} ms, max {summary['loop_lag_max_ms']} ms")
+    print(f"Upstream requests: {summary['upstream_requests']}")
+    state = summary.get("state") or {}
+    if state.get("backend", "memory") != "memory":
+        print(
+            f"Session state ({state['backend']}): {state['reads']} reads, {state['writes']} writes, "
+            f"avg {state['avg_ms']} ms, max {state['max_ms']} ms, "
+            f"{state['over_budget']} over the {state['latency_budget_ms']:.0f} ms budget, {state['errors']} errors"
+        )
+    if summary.get("cold_start"):
+        cold_start = summary["cold_start"]
+        budget = summary["config"].get("cold_start_budget_ms")
+        budget_note = f", budget {budget:.0f} ms" if budget else ""
+        print(f"Cold start (import main): p50 {cold_start['p50_ms']} ms, max {cold_start['max_ms']} ms over {cold_start['runs']} runs{budget_note}")
+
+
+def compare_to_baseline(summary: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Human-readable regressions beyond the allowed fraction."""
+    problems = []
+    if summary["throughput_rps"] < baseline["throughput_rps"] * (1 - max_regression):
+        problems.append(f"throughput {baseline['throughput_rps']} -> {summary['throughput_rps']} req/s")
+    for name, row in summary["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if before and row["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            problems.append(f"{name} p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+    before, after = baseline.get("cold_start"), summary.get("cold_start")
+    if before and after and after["p50_ms"] > before["p50_ms"] * (1 + max_regression):
+        problems.append(f"cold start p50 {before['p50_ms']} -> {after['p50_ms']} ms")
+    return problems
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline load test for the KivyBot API with mock upstreams.")
+    parser.add_argument("--users", type=int, default=20, help="concurrent virtual users")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured warm-up seconds")
+    parser.add_argument("--think-time", type=float, default=0.0, help="mean pause between a user's requests (s)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"weighted scenarios (default: {DEFAULT_MIX})")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="fraction of questions repeated verbatim (response cache hits)")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock Gemini time to first token (Groq gets half)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="+/- uniform jitter on mock latency")
+    parser.add_argument("--token-interval", type=float, default=0.02, help="mock delay between streamed tokens")
+    parser.add_argument("--tokens", type=int, default=40, help="tokens per mock answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of mock responses that are 503s")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of mock responses that are 429s")
+    parser.add_argument("--doc-kb", type=int, default=40, help="size of generated documents")
+    parser.add_argument("--image-kb", type=int, default=200, help="size of the image payload without Pillow")
+    parser.add_argument("--batch-questions", type=int, default=4, help="questions per doc_batch request")
+    parser.add_argument("--audio-kb", type=int, default=32, help="size of the voice payload")
+    parser.add_argument("--audio-format", default="wav", help="reply audio format for voice scenarios (wav, mp3, opus, flac)")
+    parser.add_argument("--cold-start-runs", type=int, default=3, help="fresh interpreters used to time importing main (0 = skip)")
+    parser.add_argument("--cold-start-budget-ms", type=float, help="fail if the median cold start exceeds this")
+    parser.add_argument("--state-backend", default="memory", choices=("memory", "sqlite", "redis"), help="session state backend (redis uses a local stand-in)")
+    parser.add_argument("--save", help="write the JSON summary to this file")
+    parser.add_argument("--baseline", help="compare against a previously saved summary")
+    parser.add_argument("--max-regression", type=float, default=0.25, help="allowed p95/throughput regression vs baseline")
+    parser.add_argument("--verbose", action="store_true", help="print individual request failures")
+    return parser
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    args = build_parser().parse_args(argv)
+    summary = asyncio.run(run(args))
+    print_report(summary)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"✓ Saved summary to {args.save}")
+
+    status = 0
+    cold_start = summary.get("cold_start")
+    if args.cold_start_budget_ms and cold_start and cold_start["p50_ms"] > args.cold_start_budget_ms:
+        print(f"❌ Cold start {cold_start['p50_ms']} ms is over the {args.cold_start_budget_ms:.0f} ms budget")
+        status = 1
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        problems = compare_to_baseline(summary, baseline, args.max_regression)
+        if problems:
+            print(f"❌ Regressions beyond {args.max_regression:.0%}:")
+            for problem in problems:
+                print(f"   - {problem}")
+            return 1
+        print(f"✅ No regressions beyond {args.max_regression:.0%} vs {args.baseline}")
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
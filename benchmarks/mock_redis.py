@@ -0,0 +1,155 @@
+import time
+import asyncio
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.mock_upstreams import free_port
+
+# --- LOCAL REDIS-PROTOCOL STAND-IN ---
+# Speaks enough RESP2 for the shared session state (STATE_BACKEND=redis):
+# PING, AUTH, SELECT, GET, MGET, SET [PX|EX], PEXPIRE, EXPIRE, DEL, EXISTS,
+# DBSIZE, FLUSHDB. Keys expire lazily on access. An optional latency per
+# round trip (a pipelined batch is answered at once) models the network
+# between the app and a real server.
+
+
+class MockRedis:
+    """In-memory Redis-protocol server on its own thread and event loop."""
+
+    def __init__(self, port: Optional[int] = None, latency: float = 0.0):
+        self.port = port or free_port()
+        self.latency = latency  # seconds added to every batch of commands read
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}  # key -> (value, expires at)
+        self.commands = 0
+        self.connections = 0
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._ready = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"redis://127.0.0.1:{self.port}/0"
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self._server = self.loop.run_until_complete(asyncio.start_server(self._serve, "127.0.0.1", self.port))
+        self._ready.set()
+        try:
+            self.loop.run_forever()
+        finally:
+            self._server.close()
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks:
+                task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+
+    def start(self, timeout: float = 10.0) -> "MockRedis":
+        self.thread.start()
+        if not self._ready.wait(timeout):
+            raise RuntimeError(f"mock redis on port {self.port} failed to start")
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join(10)
+
+    def _live(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= time.monotonic():
+            del self.data[key]
+            return None
+        return entry[0]
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b"*"):
+            return line.strip().split()  # inline command (e.g. redis-cli ping)
+        args = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    @staticmethod
+    def _bulk(value: Optional[bytes]) -> bytes:
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+
+    def _execute(self, args: List[bytes]) -> bytes:
+        self.commands += 1
+        name = args[0].upper()
+        if name == b"PING":
+            return b"+PONG\r\n"
+        if name in (b"AUTH", b"SELECT"):
+            return b"+OK\r\n"
+        if name == b"GET":
+            return self._bulk(self._live(args[1]))
+        if name == b"MGET":
+            return b"*%d\r\n" % (len(args) - 1) + b"".join(self._bulk(self._live(key)) for key in args[1:])
+        if name == b"SET":
+            expires = None
+            options = [arg.upper() for arg in args[3:]]
+            if b"PX" in options:
+                expires = time.monotonic() + int(args[3 + options.index(b"PX") + 1]) / 1000
+            elif b"EX" in options:
+                expires = time.monotonic() + int(args[3 + options.index(b"EX") + 1])
+            self.data[args[1]] = (args[2], expires)
+            return b"+OK\r\n"
+        if name in (b"PEXPIRE", b"EXPIRE"):
+            value = self._live(args[1])
+            if value is None:
+                return b":0\r\n"
+            seconds = int(args[2]) / (1000 if name == b"PEXPIRE" else 1)
+            self.data[args[1]] = (value, time.monotonic() + seconds)
+            return b":1\r\n"
+        if name in (b"DEL", b"EXISTS"):
+            keys = [key for key in args[1:] if self._live(key) is not None]
+            if name == b"DEL":
+                for key in keys:
+                    del self.data[key]
+            return b":%d\r\n" % len(keys)
+        if name == b"DBSIZE":
+            return b":%d\r\n" % len(self.data)
+        if name == b"FLUSHDB":
+            self.data.clear()
+            return b"+OK\r\n"
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                replies = [self._execute(args)]
+                # Answer a pipelined batch together, like one network round trip
+                while reader._buffer:  # already-received commands
+                    args = await self._read_command(reader)
+                    if args is None:
+                        break
+                    replies.append(self._execute(args))
+                if self.latency:
+                    await asyncio.sleep(self.latency)
+                writer.write(b"".join(replies))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass  # client gone, or server shutting down
+        finally:
+            writer.close()
+
+
+if __name__ == "__main__":
+    server = MockRedis(port=6379).start()
+    print(f"Mock Redis listening on {server.url} (Ctrl+C to stop)")
+    try:
+        server.thread.join()
+    except KeyboardInterrupt:
+        server.stop()
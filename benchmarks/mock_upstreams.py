@@ -0,0 +1,278 @@
+import re
+import json
+import random
+import socket
+import asyncio
+import threading
+from typing import Dict, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# --- LOCAL STAND-INS FOR GEMINI, GROQ AND DEEPGRAM ---
+# Each provider gets its own small HTTP server speaking just enough of the
+# real API for our services: same paths, same JSON/SSE shapes. Latency,
+# jitter, token streaming speed and error rates are configurable so the
+# benchmark can model a healthy day or a bad one.
+
+REPLY_TEXT = (
+    "Great question! Python is a beginner-friendly language. "
+    "At CodeKivy you can start with Python Basic and move on to Python Advance. "
+    "Weekly assignments and doubt sessions help you practice. "
+    "Let me know if you want a study plan!"
+)
+
+
+class MockConfig:
+    """Behaviour of one mock provider."""
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        token_interval: float = 0.02,
+        tokens: int = 40,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0
+    ):
+        self.latency = latency  # time to first byte / first token (seconds)
+        self.jitter = jitter  # +/- uniform jitter added to latency
+        self.token_interval = token_interval  # delay between streamed tokens
+        self.tokens = tokens  # tokens per streamed answer
+        self.error_rate = error_rate  # fraction of requests answered with 503
+        self.rate_limit_rate = rate_limit_rate  # fraction answered with 429 + Retry-After
+        self.requests = 0
+        self.errors = 0
+
+    async def delay(self):
+        await asyncio.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+
+    def injected_error(self) -> Optional[Response]:
+        """A 503/429 response for this request, or None to answer normally."""
+        self.requests += 1
+        roll = random.random()
+        if roll < self.error_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"message": "mock overloaded"}}, status_code=503)
+        if roll < self.error_rate + self.rate_limit_rate:
+            self.errors += 1
+            return JSONResponse({"error": {"message": "mock rate limit"}}, status_code=429, headers={"Retry-After": "1"})
+        return None
+
+    def reply_tokens(self):
+        words = REPLY_TEXT.split(" ")
+        return [(" " if i else "") + words[i % len(words)] for i in range(self.tokens)]
+
+
+def create_gemini_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1beta/models/{model_action}")
+    async def generate(model_action: str, request: Request):
+        await request.body()
+        error = config.injected_error()
+        await config.delay()
+        if error:
+            return error
+        tokens = config.reply_tokens()
+
+        if model_action.endswith(":streamGenerateContent"):
+            async def events():
+                for token in tokens:
+                    chunk = {"candidates": [{"content": {"role": "model", "parts": [{"text": token}]}}]}
+                    yield f"data: {json.dumps(chunk)}\r\n\r\n"
+                    await asyncio.sleep(config.token_interval)
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(config.token_interval * len(tokens))
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": "".join(tokens)}]}}]}
+
+    return app
+
+
+def create_groq_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/openai/v1/chat/completions")
+    async def completions(request: Request):
+        body = await request.json()
+        error = config.injected_error()
+        await config.delay()
+        if error:
+            return error
+        tokens = config.reply_tokens()
+        # Packed document questions: answer each under its [Answer N] label
+        labels = re.findall(r"\[Answer \d+\]", body["messages"][-1]["content"])
+        if labels:
+            tokens = [f"{label} " + "".join(tokens).strip() + "\n" for label in labels]
+
+        if body.get("stream"):
+            async def events():
+                for token in tokens:
+                    chunk = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(config.token_interval)
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        await asyncio.sleep(config.token_interval * len(tokens))
+        return {"choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}}]}
+
+    return app
+
+
+def _fake_wav(seconds: float) -> bytes:
+    # 16 kHz, 16-bit mono silence with a minimal WAV header
+    data_size = int(16000 * 2 * seconds)
+    header = (
+        b"RIFF" + (36 + data_size).to_bytes(4, "little") + b"WAVEfmt "
+        + (16).to_bytes(4, "little") + (1).to_bytes(2, "little") + (1).to_bytes(2, "little")
+        + (16000).to_bytes(4, "little") + (32000).to_bytes(4, "little")
+        + (2).to_bytes(2, "little") + (16).to_bytes(2, "little")
+        + b"data" + data_size.to_bytes(4, "little")
+    )
+    return header + bytes(data_size)
+
+
+def create_deepgram_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/listen")
+    async def listen(request: Request):
+        await request.body()
+        error = config.injected_error()
+        await config.delay()
+        if error:
+            return error
+        transcript = "what courses does codekivy offer for beginners"
+        return {"results": {"channels": [{"alternatives": [{"transcript": transcript, "confidence": 0.98}]}]}}
+
+    @app.websocket("/v1/listen")
+    async def listen_live(websocket: WebSocket):
+        # Live STT: interim words while audio flows, a speech_final result
+        # after `endpointing` ms without audio, on Finalize or on CloseStream
+        await websocket.accept()
+        config.requests += 1
+        endpointing = float(websocket.query_params.get("endpointing", 300)) / 1000
+        words = "what courses does codekivy offer for beginners".split()
+        received = 0
+
+        def result(final: bool, **flags) -> Dict:
+            count = len(words) if final else min(len(words), 1 + received // 4096)
+            text = " ".join(words[:count])
+            return {
+                "type": "Results",
+                "is_final": final,
+                "channel": {"alternatives": [{"transcript": text, "confidence": 0.98}]},
+                **flags,
+            }
+
+        try:
+            while True:
+                try:
+                    timeout = endpointing if received else None
+                    message = await asyncio.wait_for(websocket.receive(), timeout)
+                except asyncio.TimeoutError:
+                    await asyncio.sleep(random.uniform(0, config.jitter / 2))
+                    await websocket.send_json(result(True, speech_final=True))
+                    received = 0
+                    continue
+                if message["type"] == "websocket.disconnect":
+                    return
+                if message.get("bytes"):
+                    if not received:
+                        await websocket.send_json({"type": "SpeechStarted"})
+                    received += len(message["bytes"])
+                    await websocket.send_json(result(False))
+                elif message.get("text"):
+                    command = json.loads(message["text"]).get("type")
+                    if command in ("Finalize", "CloseStream") and received:
+                        await websocket.send_json(result(True, from_finalize=True))
+                        received = 0
+                    if command == "CloseStream":
+                        await websocket.close()
+                        return
+        except WebSocketDisconnect:
+            pass
+
+    @app.post("/v1/speak")
+    async def speak(request: Request):
+        body = await request.json()
+        error = config.injected_error()
+        await config.delay()
+        if error:
+            return error
+        # Roughly 15 characters of speech per second of audio
+        seconds = len(body.get("text", "")) / 15
+        encoding = request.query_params.get("encoding", "linear16")
+        if encoding == "linear16":
+            return Response(_fake_wav(seconds), media_type="audio/wav")
+        # Compressed encodings: ~32 kbit/s for mp3/opus, lossless flac about half of WAV
+        rate = 16000 if encoding == "flac" else 4000
+        media_types = {"mp3": "audio/mpeg", "opus": "audio/ogg", "flac": "audio/flac"}
+        return Response(bytes(int(rate * seconds)), media_type=media_types.get(encoding, "application/octet-stream"))
+
+    return app
+
+
+APP_FACTORIES = {
+    "gemini": create_gemini_app,
+    "groq": create_groq_app,
+    "deepgram": create_deepgram_app,
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Runs an ASGI app under uvicorn on its own thread and event loop."""
+
+    def __init__(self, app, port: Optional[int] = None, on_loop=None):
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="on"))
+        self.on_loop = on_loop  # coroutine factory started on the server's loop
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def _run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        if self.on_loop is not None:
+            self.loop.create_task(self.on_loop())
+        try:
+            self.loop.run_until_complete(self.server.serve())
+        finally:
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+            self.loop.run_until_complete(asyncio.sleep(0))
+            self.loop.close()
+
+    async def start(self, timeout: float = 10.0):
+        self.thread.start()
+        waited = 0.0
+        while not self.server.started:
+            if not self.thread.is_alive() or waited > timeout:
+                raise RuntimeError(f"server on port {self.port} failed to start")
+            await asyncio.sleep(0.05)
+            waited += 0.05
+
+    async def stop(self):
+        self.server.should_exit = True
+        await asyncio.to_thread(self.thread.join, 10)
+
+
+async def start_mock_upstreams(configs: Dict[str, MockConfig]) -> Dict[str, ServerThread]:
+    """Start one mock server per provider; returns them keyed by provider."""
+    servers = {provider: ServerThread(APP_FACTORIES[provider](config)) for provider, config in configs.items()}
+    for server in servers.values():
+        await server.start()
+    return servers
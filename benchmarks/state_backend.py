@@ -0,0 +1,152 @@
+"""
+Shared session state benchmark (STATE_BACKEND=sqlite/redis).
+
+Two SessionStores over the same backend stand in for two uvicorn workers.
+Simulated requests alternate between them, so every request has to pick up
+what the other worker wrote. Each request re-reads its session, adds a
+chat or voice turn (sometimes a document) and saves. The report shows the
+state overhead per request and per backend round trip, and the bytes
+stored per session.
+
+Usage (from the repo root):
+    python -m benchmarks.state_backend
+    python -m benchmarks.state_backend --backends redis --rtt-ms 0.5
+    python -m benchmarks.state_backend --redis-url redis://127.0.0.1:6379/0 --budget-ms 5
+
+Redis runs against benchmarks/mock_redis.py unless --redis-url is given.
+With --budget-ms, the exit code is 1 if any backend's p95 round trip is
+over budget.
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+from typing import Dict, List, Optional
+
+from benchmarks.load_test import make_document_text, percentile
+from benchmarks.mock_redis import MockRedis
+from services.retrieval_service import build_index
+from services.session_store import SessionStore
+from services.state_backend import SQLiteStateBackend, RedisStateBackend, STATE_LATENCY_BUDGET_MS
+
+ANSWER = "Decorators wrap a function to add behaviour before or after it runs. " * 6
+
+
+class TimedBackend:
+    """Wraps a backend to record the latency of every round trip."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.samples: List[float] = []
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def read(self, keys):
+        started = time.perf_counter()
+        try:
+            return self.backend.read(keys)
+        finally:
+            self.samples.append((time.perf_counter() - started) * 1000)
+
+    def write(self, items, touch=(), ttl=0, delete=()):
+        started = time.perf_counter()
+        try:
+            return self.backend.write(items, touch, ttl, delete)
+        finally:
+            self.samples.append((time.perf_counter() - started) * 1000)
+
+
+def simulate(make_backend, sessions: int, requests: int, doc_kb: int, seed: int = 0) -> Dict:
+    rng = random.Random(seed)
+    workers = [SessionStore(backend=TimedBackend(make_backend())) for _ in range(2)]
+    document = make_document_text(doc_kb, seed)
+    index = build_index(document)
+    request_ms: List[float] = []
+
+    for number in range(requests):
+        store = workers[number % 2]  # the next request lands on the other worker
+        session_id = f"student-{rng.randrange(sessions)}"
+        started = time.perf_counter()
+        store.begin_request()
+        session = store.get_or_create(session_id)
+        if not session.has_documents and rng.random() < 0.3:
+            session.add_document("handbook.txt", document, index)
+        elif rng.random() < 0.5:
+            session.chat_history.append({"role": "user", "parts": [{"text": f"Question {number} about decorators"}]})
+            session.chat_history.append({"role": "model", "parts": [{"text": ANSWER}]})
+        else:
+            session.voice_history.append({"role": "user", "content": f"Question {number} about loops"})
+            session.voice_history.append({"role": "assistant", "content": ANSWER})
+        store.update(session)
+        request_ms.append((time.perf_counter() - started) * 1000)
+
+    round_trips = workers[0].backend.samples + workers[1].backend.samples
+    stats = [worker.backend.stats() for worker in workers]
+    bytes_written = sum(s["bytes_written"] for s in stats)
+    for worker in workers:
+        worker.close()
+    return {
+        "requests": requests,
+        "request_p50_ms": round(percentile(request_ms, 0.5), 3),
+        "request_p95_ms": round(percentile(request_ms, 0.95), 3),
+        "round_trips_per_request": round(len(round_trips) / requests, 2),
+        "round_trip_p50_ms": round(percentile(round_trips, 0.5), 3),
+        "round_trip_p95_ms": round(percentile(round_trips, 0.95), 3),
+        "round_trip_p99_ms": round(percentile(round_trips, 0.99), 3),
+        "bytes_written_per_request": round(bytes_written / requests),
+        "errors": sum(s["errors"] for s in stats),
+    }
+
+
+def main_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the shared session state backends.")
+    parser.add_argument("--backends", default="sqlite,redis", help="backends to run")
+    parser.add_argument("--sessions", type=int, default=50, help="distinct sessions")
+    parser.add_argument("--requests", type=int, default=2000, help="simulated requests per backend")
+    parser.add_argument("--doc-kb", type=int, default=40, help="size of the documents added to sessions")
+    parser.add_argument("--redis-url", help="use this Redis-protocol server instead of the local stand-in")
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="network round trip added by the stand-in")
+    parser.add_argument("--budget-ms", type=float, default=STATE_LATENCY_BUDGET_MS, help="p95 round-trip budget")
+    args = parser.parse_args(argv)
+
+    mock = None
+    results = {}
+    directory = tempfile.mkdtemp(prefix="codekivy-state-")
+    try:
+        for name in args.backends.split(","):
+            if name == "sqlite":
+                path = os.path.join(directory, "state.sqlite3")
+                results[name] = simulate(lambda: SQLiteStateBackend(path), args.sessions, args.requests, args.doc_kb)
+            elif name == "redis":
+                url = args.redis_url
+                if url is None:
+                    mock = MockRedis(latency=args.rtt_ms / 1000).start()
+                    url = mock.url
+                results[name] = simulate(lambda: RedisStateBackend(url), args.sessions, args.requests, args.doc_kb)
+            else:
+                parser.error(f"unknown backend {name}")
+    finally:
+        if mock is not None:
+            mock.stop()
+
+    print(f"\n{'backend':<9}{'req p50':>9}{'req p95':>9}{'trips/req':>10}{'rt p50':>9}{'rt p95':>9}{'rt p99':>9}{'B/req':>8}{'errs':>6}")
+    for name, r in results.items():
+        print(
+            f"{name:<9}{r['request_p50_ms']:>9}{r['request_p95_ms']:>9}{r['round_trips_per_request']:>10}"
+            f"{r['round_trip_p50_ms']:>9}{r['round_trip_p95_ms']:>9}{r['round_trip_p99_ms']:>9}"
+            f"{r['bytes_written_per_request']:>8}{r['errors']:>6}"
+        )
+
+    over = [name for name, r in results.items() if r["round_trip_p95_ms"] > args.budget_ms]
+    if over:
+        print(f"\n❌ p95 round trip over the {args.budget_ms:.1f} ms budget: {', '.join(over)}")
+        return 1
+    print(f"\n✅ p95 round trip within the {args.budget_ms:.1f} ms budget")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
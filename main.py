@@ -1,25 +1,112 @@
+import time
+_import_started = time.perf_counter()  # cold-start profile origin (services/startup.py)
 import base64
-from fastapi import FastAPI, UploadFile, File
+import json
+from urllib.parse import quote
+from contextlib import asynccontextmanager, aclosing
+import asyncio
+from fastapi import FastAPI, UploadFile, File, Form, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.routing import Match
+from fastapi.responses import StreamingResponse, JSONResponse, PlainTextResponse, Response
 from pydantic import BaseModel
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 # Import Gemini for image support (NOW WITH HISTORY)
 from services.gemini_service import (
     get_gemini_response, 
+    stream_gemini_response,
     clear_chat_history as clear_gemini_history
 )
 
 # Import Groq for fast responses
-from services.groq_service import get_groq_response, get_groq_voice_response
+from services.groq_service import (
+    get_groq_response,
+    get_groq_voice_response,
+    stream_groq_response,
+    stream_groq_voice_response
+)
 
 # Import Voice service
-from services.voice_service import transcribe_audio, speak_text
+from services.voice_service import (
+    transcribe_audio,
+    speak_text,
+    process_voice_fast,
+    speak_response,
+    resolve_audio_format,
+    audio_mime_type,
+    get_tts_stats
+)
+from services.live_stt import LiveTranscriber
 
 # Import Document service
-from services.document_service import process_document, summarize_document
+from services.document_service import (
+    process_document_async,
+    process_upload_async,
+    spool_multipart,
+    shutdown_extraction_pool,
+    get_document_cache_stats,
+    UploadTooLarge,
+    UploadInvalid,
+    PdfRemainder,
+    PROGRESSIVE_PDF,
+    MAX_UPLOAD_BYTES
+)
+
+# Document Q&A context (whole text, retrieved chunks or summary) and batches
+from services.document_qa import document_context, answer_questions, BATCH_MAX_QUESTIONS
+
+# Background document jobs (queued processing with progress polling)
+from services.document_jobs import DocumentJobQueue, DocumentJob, QueueFull, JobFailed
+
+# Unified per-session state (documents, chat and voice history)
+from services.session_store import session_store, Session
+from services.history_manager import history_stats
+from services.response_cache import get_response_cache_stats
+from services.single_flight import get_single_flight_stats
+from services.resilience import get_resilience_stats
+from services.hedging import get_hedging_stats
+from services.image_service import get_image_stats
+
+# Prometheus metrics (per-stage latency histograms, sizes, in-flight gauges)
+from services.metrics import (
+    render_metrics,
+    start_request,
+    set_mode,
+    stage,
+    observe_stage,
+    payload_size,
+    http_request_duration,
+    http_requests_in_flight,
+    http_request_size,
+    http_response_size
+)
+
+# Shared pooled HTTP clients for all upstream providers
+from services.http_client import startup_clients, shutdown_clients, get_pool_stats
+
+# Cold-start phase timings
+from services.startup import mark as mark_startup, get_startup_profile
+
+mark_startup("imports", since=_import_started)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Open keep-alive connection pools once for the app lifetime
+    await startup_clients()
+    session_store.start_sweeper()
+    mark_startup("lifespan")
+    yield
+    await document_jobs.stop()
+    await cancel_background_extractions()
+    await session_store.stop_sweeper()
+    session_store.close()
+    await shutdown_clients()
+    shutdown_extraction_pool()
+
+
+app = FastAPI(lifespan=lifespan)
 
 origins = [
     # "http://localhost:5173",
@@ -32,11 +119,75 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Transcript", "X-Response-Text"],  # binary voice responses
 )
 
-# Store current document context (in production, use Redis or database)
-# Key: session_id, Value: document_text
-active_documents: Dict[str, str] = {}
+@app.middleware("http")
+async def limit_upload_size(request: Request, call_next):
+    """Reject oversized document uploads before the body is read."""
+    if request.url.path in ("/api/document/upload", "/api/document/jobs"):
+        content_length = request.headers.get("content-length")
+        # Allow some headroom for the multipart envelope
+        if content_length and content_length.isdigit() and int(content_length) > MAX_UPLOAD_BYTES + 64 * 1024:
+            return JSONResponse(
+                {"response": f"[Error: File exceeds {MAX_UPLOAD_BYTES / (1024 * 1024):.1f} MB limit]", "mode": "error"},
+                status_code=413
+            )
+    return await call_next(request)
+
+def _endpoint_label(scope: Dict) -> str:
+    """
+    Route template for metrics labels (e.g. /api/document/jobs/{job_id}),
+    resolved the way the router will; unknown paths share one label.
+    """
+    partial = None
+    for route in app.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path  # path matches, method doesn't (405)
+    return partial or "unmatched"
+
+@app.middleware("http")
+async def collect_metrics(request: Request, call_next):
+    """Time every request until its (possibly streamed) body is fully sent."""
+    endpoint = _endpoint_label(request.scope)
+    labels = start_request(endpoint)
+    session_store.begin_request()
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit():
+        http_request_size.observe(int(content_length), endpoint)
+    
+    mark_startup("first_request")
+    http_requests_in_flight.inc(endpoint)
+    started = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        http_requests_in_flight.dec(endpoint)
+        http_request_duration.observe(time.perf_counter() - started, endpoint, labels["mode"], "500")
+        raise
+    
+    body = response.body_iterator
+    status = str(response.status_code)
+    
+    async def timed_body():
+        sent = 0
+        try:
+            async for chunk in body:
+                sent += len(chunk)
+                yield chunk
+        finally:
+            http_requests_in_flight.dec(endpoint)
+            http_request_duration.observe(time.perf_counter() - started, endpoint, labels["mode"], status)
+            http_response_size.observe(sent, endpoint, labels["mode"])
+    
+    response.body_iterator = timed_body()
+    return response
+
+# Document text, retrieval index and histories live in session_store
+# (idle TTL, memory caps, background sweeping)
 
 # --- ENHANCED CHAT ENDPOINT (Text + Images + Documents) WITH HISTORY ---
 class ChatRequest(BaseModel):
@@ -46,6 +197,110 @@ class ChatRequest(BaseModel):
     mode: Optional[str] = "chat"  # "chat" or "document"
     session_id: Optional[str] = "default"  # For tracking conversation & document context
 
+def get_document_session(session_id: str) -> Optional[Session]:
+    """The session if it currently holds any documents, else None."""
+    session = session_store.get(session_id)
+    if session is None or not session.has_documents:
+        return None
+    return session
+
+def get_document_context(session_id: str, question: str) -> str:
+    """Document text to send with a question for this session."""
+    return document_context(get_document_session(session_id), question)
+
+def load_document_into_session(
+    session_id: str,
+    file_name: str,
+    document_text: str,
+    document_index,
+    processing_stats: Dict,
+    remainder: Optional[PdfRemainder] = None,
+    replace: Optional[str] = None
+) -> Dict:
+    """
+    Add a processed document to the session and build the upload reply.
+    With a remainder, the rest of the PDF keeps extracting in the background;
+    replace is the document_id of an earlier document this one supersedes.
+    """
+    session = session_store.get_or_create(session_id)
+    if remainder is not None:
+        document = session.add_document(
+            file_name or "document", document_text, document_index, remainder.pages_done, remainder.page_count, replace
+        )
+    else:
+        document = session.add_document(file_name or "document", document_text, document_index, replace=replace)
+    session_store.update(session)
+    
+    print(f"✓ Document processed: {len(document_text)} chars ({len(session.documents)} in session)")
+    
+    # Initial response about the document
+    if len(session.documents) > 1:
+        ready_line = f"- Ready for questions across {len(session.documents)} documents: {', '.join(session.document_names)}"
+        closing = "Ask me anything about these documents, or compare them!"
+    else:
+        ready_line = "- Ready for questions!"
+        closing = "Ask me anything about this document!"
+    if remainder is not None:
+        ready_line += f"\n- Read pages 1-{remainder.pages_done} of {remainder.page_count} so far; the rest are loading in the background"
+        start_background_extraction(session_id, document, remainder)
+    initial_response = f"""✅ Document loaded successfully! 
+
+📊 **Stats:**
+- File: {file_name}
+- Size: {len(document_text)} characters
+{ready_line}
+
+{closing}"""
+    
+    return {
+        "response": initial_response,
+        "mode": "document",
+        "document_loaded": True,
+        "document_id": document.document_id,
+        "documents": [doc.info() for doc in session.documents.values()],
+        "processing": processing_stats,
+        "session_id": session_id
+    }
+
+# --- PROGRESSIVE PDF INGESTION ---
+# Background tasks that grow a session document as the rest of its PDF is
+# extracted; questions asked meanwhile are answered from the pages ready.
+
+_background_extractions = set()
+
+async def extract_remaining_pages(session_id: str, document, remainder: PdfRemainder):
+    """Swap each newly extracted page range into the session document."""
+    try:
+        async with aclosing(remainder.pages()) as pages:
+            async for text, index in pages:
+                session_store.begin_request()  # re-read: another worker may have changed it
+                session = await session_store.load(session_id)
+                if session is None or not session.update_document(document, text, index, remainder.pages_done):
+                    print(f"⚠️ Stopped extracting '{document.name}': no longer in session {session_id}")
+                    return
+                session_store.update(session)
+        print(f"✓ '{document.name}' fully loaded: {remainder.pages_done} pages [Session: {session_id}]")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        # Keep answering from the pages already loaded
+        print(f"❌ Background extraction error for '{document.name}': {e}")
+        session_store.begin_request()
+        session = await session_store.load(session_id)
+        if session is not None and session.documents.get(document.document_id) is document:
+            document.pages_total = document.pages_ready
+            session_store.update(session)  # so no worker reports it as still extracting
+
+def start_background_extraction(session_id: str, document, remainder: PdfRemainder):
+    task = asyncio.create_task(extract_remaining_pages(session_id, document, remainder))
+    _background_extractions.add(task)
+    task.add_done_callback(_background_extractions.discard)
+
+async def cancel_background_extractions():
+    for task in list(_background_extractions):
+        task.cancel()
+    await asyncio.gather(*_background_extractions, return_exceptions=True)
+
 @app.post("/api/chat")
 async def handle_chat(request: ChatRequest):
     """
@@ -63,9 +318,13 @@ async def handle_chat(request: ChatRequest):
     print(f"📝 Chat request: {user_message[:50]}... [Session: {session_id}]")
     
     try:
+        await session_store.load(session_id)
+        
         # --- SCENARIO 1: Image Analysis (use Gemini with history) ---
         if image_base64:
             print("🖼️ Processing with image...")
+            set_mode("image")
+            payload_size.observe(len(image_base64), "image")
             # Use Gemini with full conversation history for context-aware image analysis
             response = await get_gemini_response(
                 user_message, 
@@ -78,50 +337,26 @@ async def handle_chat(request: ChatRequest):
         # --- SCENARIO 2: Document Upload (process and store) ---
         if document and mode == "document":
             print(f"📄 Processing document: {document.get('name')}")
+            set_mode("upload")
             
-            # Extract text from document
-            document_text = process_document(document)
+            # Extract text (in the worker pool) and build its retrieval index
+            document_text, document_index, processing_stats, remainder = await process_document_async(
+                document, progressive=PROGRESSIVE_PDF
+            )
             
             if document_text.startswith("[Error"):
                 return {"response": document_text, "mode": "error"}
             
-            # Store in session
-            active_documents[session_id] = document_text
-            
-            # Create a summary for quick response
-            doc_summary = summarize_document(document_text, max_chars=3000)
-            
-            print(f"✓ Document processed: {len(document_text)} chars")
-            
-            # Initial response about the document
-            initial_response = f"""✅ Document loaded successfully! 
-
-📊 **Stats:**
-- File: {document.get('name')}
-- Size: {len(document_text)} characters
-- Ready for questions!
-
-Ask me anything about this document!"""
-            
-            return {
-                "response": initial_response,
-                "mode": "document",
-                "document_loaded": True,
-                "session_id": session_id
-            }
+            return load_document_into_session(
+                session_id, document.get('name'), document_text, document_index, processing_stats, remainder
+            )
         
         # --- SCENARIO 3: Document Q&A (use stored document context) ---
-        if mode == "document" and session_id in active_documents:
+        if mode == "document" and get_document_session(session_id):
             print(f"📖 Answering from document context...")
+            set_mode("document")
             
-            document_context = active_documents[session_id]
-            
-            # For long documents, create a smart summary
-            if len(document_context) > 8000:
-                # Use a more aggressive summary for very long docs
-                context_summary = summarize_document(document_context, max_chars=6000)
-            else:
-                context_summary = document_context
+            context_summary = get_document_context(session_id, user_message)
             
             # Use Groq with document context (FAST + ACCURATE)
             response = await get_groq_response(user_message, context_summary)
@@ -134,11 +369,13 @@ Ask me anything about this document!"""
         
         # --- SCENARIO 4: Regular Chat (use Gemini with history) ---
         print("💬 Regular chat mode with conversation history...")
+        set_mode("chat")
         # Use Gemini for chat with full conversation context
         response = await get_gemini_response(
             user_message,
             session_id=session_id,
-            use_history=True
+            use_history=True,
+            hedge=True  # race Groq if Gemini is slow/failing (CHAT_HEDGING=1)
         )
         return {"response": response, "mode": "chat", "session_id": session_id}
     
@@ -149,78 +386,567 @@ Ask me anything about this document!"""
             "mode": "error"
         }
 
-chat_history = [] 
+def _sse(data: Dict) -> str:
+    """Format one Server-Sent Events message."""
+    return f"data: {json.dumps(data)}\n\n"
+
+@app.post("/api/chat/stream")
+async def handle_chat_stream(request: ChatRequest):
+    """
+    Streaming variant of /api/chat using Server-Sent Events.
+    
+    Emits `{"token": ...}` events as the model generates text, then a final
+    `{"done": true, "mode": ..., "session_id": ...}` event. Chat and image
+    answers are added to the session history when the stream ends, including
+    when the client disconnects early.
+    """
+    user_message = request.message
+    session_id = request.session_id or "default"
+    
+    print(f"📝 Stream request: {user_message[:50]}... [Session: {session_id}]")
+    await session_store.load(session_id)
+    
+    # Document uploads have nothing to stream - reuse the regular handler
+    if request.document and request.mode == "document" and not request.image:
+        result = await handle_chat(request)
+        
+        async def upload_stream():
+            yield _sse({"token": result.pop("response")})
+            yield _sse({"done": True, **result})
+        
+        return StreamingResponse(upload_stream(), media_type="text/event-stream")
+    
+    if request.image:
+        mode = "image"
+        tokens = stream_gemini_response(
+            user_message,
+            image_base64=request.image,
+            session_id=session_id,
+            use_history=True
+        )
+    elif request.mode == "document" and get_document_session(session_id):
+        mode = "document"
+        tokens = stream_groq_response(user_message, get_document_context(session_id, user_message))
+    else:
+        mode = "chat"
+        tokens = stream_gemini_response(user_message, session_id=session_id, use_history=True)
+    set_mode(mode)
+    
+    async def event_stream():
+        # aclosing() guarantees the service generator's cleanup (history
+        # update) runs right away if the client disconnects mid-stream
+        async with aclosing(tokens) as stream:
+            async for token in stream:
+                yield _sse({"token": token})
+        yield _sse({"done": True, "mode": mode, "session_id": session_id})
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 # --- VOICE ENDPOINT (Uses Groq for speed) ---
 @app.post("/api/voice")
-async def handle_voice(file: UploadFile = File(...)):
-    """Handle voice input. Uses Groq for ultra-fast responses."""
+async def handle_voice(
+    file: UploadFile = File(...),
+    session_id: str = Form("default"),
+    audio_format: str = Form("wav"),
+    response_mode: str = Form("json")
+):
+    """
+    Handle voice input. Uses Groq for ultra-fast responses.
+    
+    audio_format: wav (16 kHz linear16), mp3, opus (ogg) or flac.
+    response_mode: "json" returns base64 audio in JSON; "binary" returns the
+    raw audio bytes, with the URL-encoded transcript and reply text in the
+    X-Transcript and X-Response-Text headers (no base64 overhead).
+    """
+    audio_format = resolve_audio_format(audio_format)
     try:
         # 1. Read audio
         audio_data = await file.read()
         print(f"🎤 Received: {len(audio_data)} bytes")
+        payload_size.observe(len(audio_data), "voice_input")
 
         # 2. Transcribe
         print("📝 Transcribing...")
-        transcript = await transcribe_audio(audio_data)
+        with stage("stt"):
+            transcript = await transcribe_audio(audio_data)
         if transcript.startswith("[Error"):
             print(f"❌ Transcription failed: {transcript}")
             return {"error": transcript}
         print(f"✅ Transcript: {transcript}")
 
-        # <<< NEW: Add user's message to history >>>
-        chat_history.append({"role": "user", "content": transcript})
+        # Add user's message to this session's voice history
+        session = await session_store.load_or_create(session_id)
+        session.voice_history.append({"role": "user", "content": transcript})
 
         # 3. Get response from Groq (FASTEST) - Voice optimized
         print("🚀 Getting Groq response...")
-        # <<< MODIFIED: Pass the entire history list to Groq >>>
-        text_response = await get_groq_voice_response(chat_history)
+        # Pass the session's (trimmed) history list to Groq
+        with stage("llm"):
+            text_response = await get_groq_voice_response(list(session.voice_history))
         print(f"✅ Response: {text_response[:50]}...")
 
-        # <<< NEW: Add assistant's response to history >>>
-        chat_history.append({"role": "assistant", "content": text_response})
+        # Add assistant's response to history
+        session.voice_history.append({"role": "assistant", "content": text_response})
+        session_store.update(session)
 
         # 4. Generate speech
         print("🔊 Generating speech...")
-        audio_response_bytes = await speak_text(text_response)
+        with stage("tts"):
+            audio_response_bytes = await speak_text(text_response, audio_format)
         if not audio_response_bytes or audio_response_bytes.startswith(b"[Error"):
             print(f"❌ TTS failed")
             return {"error": "TTS generation failed"}
         print(f"✅ Audio: {len(audio_response_bytes)} bytes")
 
         # 5. Return everything
-        audio_response_b64 = base64.b64encode(audio_response_bytes).decode('utf-8')
+        payload_size.observe(len(audio_response_bytes), "voice_output")
+        if response_mode == "binary":
+            return Response(
+                audio_response_bytes,
+                media_type=audio_mime_type(audio_format),
+                headers={
+                    "X-Transcript": quote(transcript),
+                    "X-Response-Text": quote(text_response)
+                }
+            )
+
+        with stage("base64_encode"):
+            audio_response_b64 = base64.b64encode(audio_response_bytes).decode('utf-8')
         
         return {
             "transcript": transcript,
             "text_response": text_response,
-            "audio_response_b64": audio_response_b64
+            "audio_response_b64": audio_response_b64,
+            "audio_mime_type": audio_mime_type(audio_format)
         }
         
     except Exception as e:
         print(f"❌ Voice error: {e}")
         return {"error": str(e)}
 
+# --- PIPELINED VOICE ENDPOINT (streams audio sentence by sentence) ---
+@app.post("/api/voice/stream")
+async def handle_voice_stream(
+    file: UploadFile = File(...),
+    session_id: str = Form("default"),
+    audio_format: str = Form("wav")
+):
+    """
+    Pipelined voice mode. Groq tokens are cut into sentences and each
+    sentence is synthesized while the rest is still generating.
+    
+    Streams newline-delimited JSON events:
+    - {"type": "transcript", "text": ...}
+    - {"type": "sentence", "index": i, "text": ...}
+    - {"type": "audio", "index": i, "audio_b64": ...}  (in order, as audio_format)
+    - {"type": "error", ...}
+    - {"type": "done", "text": full_response}
+    """
+    audio_data = await file.read()
+    print(f"🎤 Received (pipelined): {len(audio_data)} bytes")
+    audio_format = resolve_audio_format(audio_format)
+
+    session = await session_store.load_or_create(session_id)
+
+    def llm_stream(transcript: str):
+        session.voice_history.append({"role": "user", "content": transcript})
+        return stream_groq_voice_response(list(session.voice_history))
+
+    async def event_stream():
+        spoken = []
+        transcript_added = False
+        try:
+            async with aclosing(process_voice_fast(audio_data, llm_stream, audio_format=audio_format)) as events:
+                async for event in events:
+                    if event["type"] == "transcript":
+                        transcript_added = True
+                    elif event["type"] == "sentence":
+                        spoken.append(event["text"])
+                    elif event["type"] == "audio":
+                        payload_size.observe(len(event["audio"]), "voice_output")
+                        with stage("base64_encode"):
+                            audio_b64 = base64.b64encode(event["audio"]).decode('utf-8')
+                        event = {"type": "audio", "index": event["index"], "audio_b64": audio_b64}
+                    yield json.dumps(event) + "\n"
+        except Exception as e:
+            print(f"❌ Voice pipeline error: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}) + "\n"
+        finally:
+            # Keep the history consistent even if the client disconnected
+            if transcript_added:
+                reply = " ".join(spoken) or "Sorry, something went wrong."
+                session.voice_history.append({"role": "assistant", "content": reply})
+                session_store.update(session)
+
+    return StreamingResponse(event_stream(), media_type="application/x-ndjson")
+
+# --- LIVE VOICE (WebSocket, streaming transcription) ---
+@app.websocket("/ws/voice")
+async def voice_websocket(
+    websocket: WebSocket,
+    session_id: str = "default",
+    audio_format: str = "wav",
+    binary_audio: bool = False
+):
+    """
+    Live voice mode. The client streams audio frames while recording; they
+    are relayed to streaming STT, and the Groq + TTS pipeline starts the
+    moment an utterance's final transcript arrives.
+    
+    Client -> server:
+    - binary frames: audio as recorded (webm/opus, or raw PCM with
+      ?encoding=linear16&sample_rate=16000)
+    - {"type": "stop"}: end the current utterance now (push-to-talk release)
+    - {"type": "close"}: finish the session
+    
+    Server -> client (JSON text frames):
+    - {"type": "ready"} once transcription is connected
+    - {"type": "partial", "text": ...} live captions
+    - {"type": "transcript", "text": ...} final text of an utterance
+    - then the sentence / audio / error / done events of /api/voice/stream
+    
+    ?audio_format= picks the reply audio format (wav, mp3, opus, flac). With
+    ?binary_audio=true each audio event carries {"bytes": n, "mime_type": ...}
+    instead of audio_b64 and is followed by one binary frame with the audio.
+    """
+    await websocket.accept()
+    start_request("/ws/voice")
+    session_store.begin_request()  # no HTTP middleware here: one shared-state read per connection
+    session = await session_store.load_or_create(session_id)
+    transcriber = LiveTranscriber(dict(websocket.query_params))
+    audio_format = resolve_audio_format(audio_format)
+    try:
+        await transcriber.connect()
+    except Exception as e:
+        print(f"❌ Live STT connect failed: {e}")
+        await websocket.send_json({"type": "error", "error": "[Error: Live transcription unavailable]"})
+        await websocket.close()
+        return
+    await websocket.send_json({"type": "ready"})
+    print(f"🎙️ Live voice connected [Session: {session_id}]")
+
+    send_lock = asyncio.Lock()
+    utterances: asyncio.Queue = asyncio.Queue()
+
+    async def send_event(event: Dict, audio: Optional[bytes] = None):
+        # An audio header and its binary frame must not be interleaved
+        async with send_lock:
+            await websocket.send_json(event)
+            if audio is not None:
+                await websocket.send_bytes(audio)
+
+    async def relay_audio():
+        # client -> STT, until the client closes or disconnects
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes"):
+                    payload_size.observe(len(message["bytes"]), "voice_frame")
+                    await transcriber.send_audio(message["bytes"])
+                elif message.get("text"):
+                    try:
+                        payload = json.loads(message["text"])
+                    except ValueError:
+                        payload = None
+                    if not isinstance(payload, dict):
+                        # A bad control frame must not end the session
+                        await send_event({"type": "error", "error": "[Error: Control messages must be JSON objects]"})
+                        continue
+                    command = payload.get("type")
+                    if command == "stop":
+                        await transcriber.finalize()
+                    elif command == "close":
+                        break
+        finally:
+            await transcriber.finish()
+
+    async def relay_transcripts():
+        # STT -> client captions; finished utterances are queued for replies
+        try:
+            async for event in transcriber.events():
+                if event["type"] == "utterance":
+                    utterances.put_nowait((event["text"], time.perf_counter()))
+                else:
+                    await send_event(event)
+        finally:
+            utterances.put_nowait(None)
+
+    async def reply():
+        # One turn at a time, in the order the utterances were spoken
+        while True:
+            item = await utterances.get()
+            if item is None:
+                return
+            transcript, detected_at = item
+            await send_event({"type": "transcript", "text": transcript})
+            session.voice_history.append({"role": "user", "content": transcript})
+            spoken = []
+            first_audio = True
+            try:
+                events = speak_response(
+                    transcript,
+                    lambda text: stream_groq_voice_response(list(session.voice_history)),
+                    audio_format=audio_format
+                )
+                async with aclosing(events) as stream:
+                    async for event in stream:
+                        if event["type"] == "sentence":
+                            spoken.append(event["text"])
+                        elif event["type"] == "audio":
+                            if first_audio:
+                                # End of speech -> first audio out: the turn latency students feel
+                                observe_stage("voice_turn", time.perf_counter() - detected_at)
+                                first_audio = False
+                            payload_size.observe(len(event["audio"]), "voice_output")
+                            if binary_audio:
+                                header = {
+                                    "type": "audio",
+                                    "index": event["index"],
+                                    "bytes": len(event["audio"]),
+                                    "mime_type": audio_mime_type(audio_format)
+                                }
+                                await send_event(header, event["audio"])
+                                continue
+                            with stage("base64_encode"):
+                                audio_b64 = base64.b64encode(event["audio"]).decode('utf-8')
+                            event = {"type": "audio", "index": event["index"], "audio_b64": audio_b64}
+                        await send_event(event)
+            finally:
+                session.voice_history.append({"role": "assistant", "content": " ".join(spoken) or "Sorry, something went wrong."})
+                session_store.update(session)
+
+    tasks = [asyncio.create_task(job()) for job in (relay_audio, relay_transcripts, reply)]
+    try:
+        # reply() ends once audio and transcripts are drained; any failure
+        # (e.g. the client went away mid-reply) tears the whole turn down
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if task.exception() is not None:
+                print(f"❌ Live voice error: {task.exception()!r}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        await transcriber.close()
+        print(f"🎙️ Live voice closed [Session: {session_id}]")
+
 # --- DOCUMENT MANAGEMENT ENDPOINTS ---
 
+class DocumentQuestionsRequest(BaseModel):
+    questions: List[str]
+    session_id: Optional[str] = "default"
+
+@app.post("/api/document/ask")
+async def ask_document_questions(request: DocumentQuestionsRequest):
+    """
+    Answer several questions about the session's document in one request.
+    
+    Each question gets its own retrieved context; questions that share most
+    of it are answered by one Groq call and the rest run concurrently.
+    Answers are returned in question order with per-question timings.
+    """
+    session_id = request.session_id or "default"
+    questions = [question.strip() for question in request.questions if question.strip()]
+    set_mode("document_batch")
+    
+    if not questions:
+        return JSONResponse({"response": "[Error: No questions provided]", "mode": "error"}, status_code=400)
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return JSONResponse(
+            {"response": f"[Error: At most {BATCH_MAX_QUESTIONS} questions per request]", "mode": "error"},
+            status_code=400
+        )
+    await session_store.load(session_id)
+    session = get_document_session(session_id)
+    if session is None:
+        return JSONResponse({"response": "[Error: No document loaded for this session]", "mode": "error"}, status_code=404)
+    
+    print(f"📖 Batch document Q&A: {len(questions)} questions [Session: {session_id}]")
+    try:
+        result = await answer_questions(session, questions)
+    except Exception as e:
+        print(f"❌ Batch Q&A error: {e}")
+        return {"response": "Sorry, something went wrong. Please try again.", "mode": "error"}
+    
+    return {**result, "mode": "document", "session_id": session_id}
+
+
+def _upload_form_schema(**fields: Dict) -> Dict:
+    """OpenAPI request body for the streamed multipart endpoints (parsed by hand, not by FastAPI)."""
+    properties = {"file": {"type": "string", "format": "binary"}, "session_id": {"type": "string", "default": "default"}}
+    return {"requestBody": {"required": True, "content": {"multipart/form-data": {"schema": {
+        "type": "object", "required": ["file"], "properties": {**properties, **fields}
+    }}}}}
+
+def _form_flag(value: Optional[str]) -> Optional[bool]:
+    if value is None or not value.strip():
+        return None
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+async def receive_upload(request: Request):
+    """
+    Stream a multipart upload straight into a hashed DocumentBuffer.
+    Returns (form, None), or (None, error response).
+    """
+    try:
+        with stage("document_upload"):
+            form = await spool_multipart(request.headers.get("content-type", ""), request.stream())
+    except UploadTooLarge as e:
+        return None, JSONResponse({"response": f"[Error: {e}]", "mode": "error"}, status_code=413)
+    except UploadInvalid as e:
+        return None, JSONResponse({"response": f"[Error: {e}]", "mode": "error"}, status_code=400)
+    return form, None
+
+@app.post(
+    "/api/document/upload",
+    openapi_extra=_upload_form_schema(progressive={"type": "boolean"}, replace={"type": "string"})
+)
+async def upload_document(request: Request):
+    """
+    Upload a document as a binary multipart file (no base64 JSON), with
+    form fields session_id, progressive and replace (the document_id of an
+    earlier upload to swap out; otherwise documents are only replaced by
+    identical content).
+    The body is parsed as it arrives and the file goes straight into a
+    hashed buffer (no intermediate copy); extraction reads from that buffer.
+    
+    Long PDFs reply after their first pages (progressive, default
+    DOC_PROGRESSIVE); the rest load in the background and their progress
+    shows in /api/document/status.
+    """
+    form, error = await receive_upload(request)
+    if error is not None:
+        return error
+    buffer = form.buffer
+    session_id = form.fields.get("session_id") or "default"
+    progressive = _form_flag(form.fields.get("progressive"))
+    print(f"📄 Upload: {form.file_name} [Session: {session_id}]")
+    
+    remainder = None
+    try:
+        document_text, document_index, processing_stats, remainder = await process_upload_async(
+            buffer, form.file_name, form.content_type,
+            progressive=PROGRESSIVE_PDF if progressive is None else progressive
+        )
+    finally:
+        if remainder is None:
+            buffer.close()  # otherwise the background extraction closes it
+    
+    if document_text.startswith("[Error"):
+        return {"response": document_text, "mode": "error"}
+    
+    processing_stats["upload_bytes"] = buffer.size
+    await session_store.load(session_id)
+    return load_document_into_session(
+        session_id, form.file_name, document_text, document_index, processing_stats, remainder,
+        replace=form.fields.get("replace") or None
+    )
+
+# --- BACKGROUND DOCUMENT JOBS ---
+# Upload now, poll later: the job queue processes documents with bounded
+# concurrency, and the same file uploaded again while queued or running
+# joins the existing job.
+
+document_jobs = DocumentJobQueue(backend=session_store.backend)
+
+async def run_document_job(job: DocumentJob, buffer, file_name: str, content_type: str):
+    """Process a queued upload and load it into every session waiting for it."""
+    document_text, document_index, processing_stats, _ = await process_upload_async(
+        buffer, file_name, content_type, on_progress=job.report
+    )
+    if document_text.startswith("[Error"):
+        raise JobFailed(document_text)
+    
+    processing_stats["upload_bytes"] = buffer.size
+    job.report("load")
+    session_store.begin_request()  # sessions may have changed on another worker meanwhile
+    # Sessions can still join while we await a load: go round until none is left
+    pending = [session_id for session_id in job.session_ids if session_id not in job.results]
+    while pending:
+        for session_id in pending:
+            await session_store.load(session_id)
+            job.results[session_id] = load_document_into_session(
+                session_id, job.file_names.get(session_id, file_name), document_text, document_index, processing_stats
+            )
+        pending = [session_id for session_id in job.session_ids if session_id not in job.results]
+
+@app.post("/api/document/jobs", status_code=202, openapi_extra=_upload_form_schema())
+async def submit_document_job(request: Request):
+    """
+    Queue a document upload (multipart: file, session_id) and return its
+    job id at once. Poll /api/document/jobs/{job_id} for state, progress
+    and the upload reply.
+    """
+    form, error = await receive_upload(request)
+    if error is not None:
+        return error
+    buffer = form.buffer
+    session_id = form.fields.get("session_id") or "default"
+    file_name = form.file_name
+    content_type = form.content_type
+    try:
+        job, _ = document_jobs.submit(
+            buffer.hash, file_name or "document", session_id,
+            lambda job: run_document_job(job, buffer, file_name, content_type),
+            cleanup=buffer.close
+        )
+    except QueueFull as e:
+        buffer.close()
+        return JSONResponse(
+            {"response": f"[Error: Too many documents queued ({e}), please try again shortly]", "mode": "error"},
+            status_code=503
+        )
+    
+    print(f"📄 Upload job {job.job_id}: {file_name} [Session: {session_id}]")
+    return {**job.info(session_id), "position": document_jobs.position(job)}
+
+@app.get("/api/document/jobs/{job_id}")
+async def document_job_status(job_id: str, session_id: str):
+    """
+    State (queued, running, done, failed), progress and result of a document
+    job. Only sessions that submitted the file can see the job.
+    """
+    info = await document_jobs.get(job_id, session_id)
+    if info is None:
+        return JSONResponse({"response": "[Error: Unknown or expired job]", "mode": "error"}, status_code=404)
+    return info
+
+@app.get("/api/document/jobs")
+async def list_document_jobs(session_id: str = "default"):
+    """Document jobs for the session on this worker, newest first."""
+    return {"jobs": document_jobs.for_session(session_id), "session_id": session_id}
+
 @app.post("/api/document/clear")
-async def clear_document(session_id: str = "default"):
-    """Clear document from session."""
-    if session_id in active_documents:
-        del active_documents[session_id]
-        return {"status": "cleared", "session_id": session_id}
+async def clear_document(session_id: str = "default", document_id: Optional[str] = None):
+    """Remove one document (document_id) or all documents from the session."""
+    await session_store.load(session_id)
+    session = get_document_session(session_id)
+    if session and session.remove_document(document_id):
+        session_store.update(session)
+        return {"status": "cleared", "session_id": session_id, "documents": len(session.documents)}
     return {"status": "not_found", "session_id": session_id}
 
 
 @app.get("/api/document/status")
 async def document_status(session_id: str = "default"):
-    """Check if document is loaded in session."""
-    has_document = session_id in active_documents
-    doc_length = len(active_documents.get(session_id, "")) if has_document else 0
+    """Check which documents are loaded in the session."""
+    await session_store.load(session_id)
+    session = get_document_session(session_id)
+    has_document = session is not None
+    doc_length = session.document_chars if has_document else 0
     
     return {
         "has_document": has_document,
         "document_length": doc_length,
+        "documents": [doc.info() for doc in session.documents.values()] if has_document else [],
+        "extracting": has_document and any(doc.extracting for doc in session.documents.values()),
+        "jobs": [job for job in document_jobs.for_session(session_id) if job["state"] in ("queued", "running")],
+        "session_bytes": session.bytes if has_document else 0,
         "session_id": session_id
     }
 
@@ -230,6 +956,7 @@ async def document_status(session_id: str = "default"):
 @app.post("/api/chat/clear")
 async def clear_chat(session_id: str = "default"):
     """Clear chat history for a session."""
+    await session_store.load(session_id)
     clear_gemini_history(session_id)
     return {
         "status": "cleared",
@@ -241,12 +968,8 @@ async def clear_chat(session_id: str = "default"):
 @app.post("/api/session/reset")
 async def reset_session(session_id: str = "default"):
     """Reset both chat history and document for a session."""
-    # Clear chat history
-    clear_gemini_history(session_id)
-    
-    # Clear document
-    if session_id in active_documents:
-        del active_documents[session_id]
+    # Clear chat history, voice history and document
+    session_store.delete(session_id)
     
     return {
         "status": "reset",
@@ -265,7 +988,7 @@ def read_root():
             "documents": "PDF/DOCX/TXT analysis",
             "voice": "Groq + Deepgram"
         },
-        "active_sessions": len(active_documents),
+        "active_sessions": len(session_store),
         "new_features": [
             "Conversation history maintained per session",
             "Context-aware responses",
@@ -276,7 +999,39 @@ def read_root():
 
 @app.get("/health")
 def health_check():
+    session_stats = session_store.stats()
     return {
         "status": "healthy",
-        "active_documents": len(active_documents)
+        "active_documents": session_stats["sessions_with_documents"],
+        "sessions": session_stats,
+        "chat_history": history_stats,
+        "document_cache": get_document_cache_stats(),
+        "response_cache": get_response_cache_stats(),
+        "single_flight": get_single_flight_stats(),
+        "resilience": get_resilience_stats(),
+        "hedging": get_hedging_stats(),
+        "images": get_image_stats(),
+        "document_jobs": document_jobs.stats(),
+        "tts": get_tts_stats()
     }
+
+
+@app.get("/metrics")
+def metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/api/pool/stats")
+def pool_stats():
+    """Upstream connection pool statistics per provider."""
+    return get_pool_stats()
+
+
+@app.get("/api/startup")
+def startup_profile():
+    """Cold-start phase timings and which heavy modules have been loaded."""
+    return get_startup_profile()
+
+
+mark_startup("app_setup")
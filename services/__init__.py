@@ -0,0 +1,6 @@
+# --- CONFIGURATION ---
+# .env is loaded exactly once, here: importing any services.* module runs
+# this first, so every module-level os.getenv() below sees the same values.
+from dotenv import load_dotenv
+
+load_dotenv()
@@ -0,0 +1,306 @@
+import os
+import time
+import uuid
+import hashlib
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from services.state_backend import StateBackend, encode_value, decode_value, STATE_KEY_PREFIX
+
+# --- BACKGROUND DOCUMENT JOBS ---
+# Uploads sent to /api/document/jobs return a job id at once. The document
+# is processed by a small pool of worker tasks (bounded concurrency), and
+# clients poll the job for its state (queued -> running -> done | failed),
+# progress and result. A file that is already queued or running (same
+# content hash) joins that job instead of being processed twice, and the
+# finished document is loaded into every session that asked for it.
+# Finished jobs are kept for DOC_JOB_TTL. With a shared state backend, job
+# records are published there too, so any worker can answer a poll.
+
+DOC_JOB_WORKERS = int(os.getenv("DOC_JOB_WORKERS", "2"))  # documents processed at once
+DOC_JOB_MAX_PENDING = int(os.getenv("DOC_JOB_MAX_PENDING", "50"))  # queued + running
+DOC_JOB_TTL = float(os.getenv("DOC_JOB_TTL", "900"))  # seconds finished jobs stay pollable
+
+# Rough share of the work done at each stage, for progress without page counts
+_STAGE_PROGRESS = {"queued": 0.0, "extract": 0.1, "index": 0.9, "load": 0.95}
+
+
+class QueueFull(Exception):
+    """Raised when DOC_JOB_MAX_PENDING jobs are already queued or running."""
+
+
+class JobFailed(Exception):
+    """Raised by a job's run function with the message to report."""
+
+
+class DocumentJob:
+    """One queued document and everything a poll reports about it."""
+
+    def __init__(self, key: str, name: str, run: Callable[["DocumentJob"], Awaitable[None]], cleanup: Optional[Callable[[], None]] = None):
+        self.job_id = uuid.uuid4().hex[:16]
+        self.key = key  # content hash used for deduplication
+        self.name = name
+        self.state = "queued"
+        self.stage = "queued"
+        self.pages_done = 0
+        self.pages_total = 0
+        self.session_ids: List[str] = []  # sessions to load the document into
+        self.file_names: Dict[str, str] = {}  # session_id -> name it uploaded the file as
+        self.results: Dict[str, Dict] = {}  # session_id -> upload reply
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.run = run
+        self.cleanup = cleanup
+        self.on_change: Optional[Callable[["DocumentJob"], None]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.state in ("done", "failed")
+
+    @property
+    def progress(self) -> float:
+        if self.state == "done":
+            return 1.0
+        if self.stage == "extract" and self.pages_total:
+            return round(0.05 + 0.85 * self.pages_done / self.pages_total, 3)
+        return _STAGE_PROGRESS.get(self.stage, 0.0)
+
+    def report(self, stage: str, pages_done: int = 0, pages_total: int = 0):
+        """Progress callback handed to the document pipeline."""
+        self.stage = stage
+        if pages_total:
+            self.pages_done = pages_done
+            self.pages_total = pages_total
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def info(self, session_id: str) -> Dict:
+        """
+        Poll response for one of the job's sessions. Only that session's
+        upload reply is included; the other sessions on a shared job are
+        never revealed (a session id is the key to its documents).
+        """
+        elapsed_from = self.started_at or self.created_at
+        return {
+            "job_id": self.job_id,
+            "name": self.file_names.get(session_id, self.name),
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "pages_done": self.pages_done,
+            "pages_total": self.pages_total,
+            "result": self.results.get(session_id),
+            "error": self.error,
+            "created_at": self.created_at,
+            "elapsed_ms": round(((self.finished_at or time.time()) - elapsed_from) * 1000, 1),
+            "session_id": session_id,
+        }
+
+
+class DocumentJobQueue:
+    """Bounded-concurrency queue of DocumentJobs with content-hash deduplication."""
+
+    def __init__(
+        self,
+        workers: int = DOC_JOB_WORKERS,
+        max_pending: int = DOC_JOB_MAX_PENDING,
+        ttl: float = DOC_JOB_TTL,
+        backend: Optional[StateBackend] = None
+    ):
+        self.workers = max(1, workers)
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.backend = backend
+        self.jobs: Dict[str, DocumentJob] = {}  # job_id -> job (insertion = creation order)
+        self._active: Dict[str, DocumentJob] = {}  # content key -> queued/running job
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self.submitted = 0
+        self.deduplicated = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+
+    def submit(
+        self,
+        key: str,
+        name: str,
+        session_id: str,
+        run: Callable[[DocumentJob], Awaitable[None]],
+        cleanup: Optional[Callable[[], None]] = None
+    ) -> Tuple[DocumentJob, bool]:
+        """
+        Queue a document, or join the queued/running job for the same content.
+
+        Returns:
+            (job, created) - created is False when an existing job was joined
+            (the new upload's cleanup runs immediately)
+        """
+        self._prune()
+        job = self._active.get(key)
+        if job is not None:
+            if session_id not in job.session_ids:
+                job.session_ids.append(session_id)
+                job.file_names[session_id] = name
+            self.deduplicated += 1
+            if cleanup is not None:
+                cleanup()
+            print(f"🔁 Document job {job.job_id} already {job.state}, joined by session {session_id}")
+            self._publish(job)
+            return job, False
+
+        if len(self._active) >= self.max_pending:
+            self.rejected += 1
+            raise QueueFull(f"{len(self._active)} documents are already being processed")
+
+        job = DocumentJob(key, name, run, cleanup)
+        job.session_ids.append(session_id)
+        job.file_names[session_id] = name
+        job.on_change = self._publish
+        self.jobs[job.job_id] = job
+        self._active[key] = job
+        self.submitted += 1
+        self._start_workers()
+        self._queue.put_nowait(job)
+        print(f"📥 Document job {job.job_id} queued: {name} ({self.queued} waiting)")
+        self._publish(job)
+        return job, True
+
+    def _start_workers(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        self._tasks = [task for task in self._tasks if not task.done()]
+        while len(self._tasks) < self.workers:
+            self._tasks.append(asyncio.create_task(self._work()))
+
+    async def _work(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: DocumentJob):
+        job.state = "running"
+        job.stage = "extract"
+        job.started_at = time.time()
+        self._publish(job)
+        try:
+            await job.run(job)
+            job.state = "done"
+            job.stage = "done"
+            self.completed += 1
+            print(f"✓ Document job {job.job_id} done in {(time.time() - job.started_at) * 1000:.1f} ms ({len(job.session_ids)} sessions)")
+        except asyncio.CancelledError:
+            job.state = "failed"
+            job.error = "[Error: Processing was cancelled]"
+            self.failed += 1
+            raise
+        except Exception as e:
+            job.state = "failed"
+            job.error = str(e) if isinstance(e, JobFailed) else f"[Error: Failed to process document - {e}]"
+            self.failed += 1
+            print(f"❌ Document job {job.job_id} failed: {job.error}")
+        finally:
+            job.finished_at = time.time()
+            if self._active.get(job.key) is job:
+                del self._active[job.key]
+            if job.cleanup is not None:
+                job.cleanup()
+                job.cleanup = None
+            self._publish(job)
+
+    def _job_key(self, job_id: str, session_id: str) -> str:
+        # One record per session on the job, keyed by a digest of the session id
+        digest = hashlib.sha1(session_id.encode("utf-8")).hexdigest()[:20]
+        return f"{STATE_KEY_PREFIX}job:{job_id}:{digest}"
+
+    def _publish(self, job: DocumentJob):
+        """Share the job records so a poll reaching another worker can answer it."""
+        if self.backend is None:
+            return
+        records = {
+            self._job_key(job.job_id, session_id): encode_value(job.info(session_id))
+            for session_id in job.session_ids
+        }
+        self.backend.submit(self._write_records, job.job_id, records)  # state I/O thread, not the loop
+
+    def _write_records(self, job_id: str, records: Dict[str, bytes]):
+        try:
+            self.backend.write(records, ttl=self.ttl)
+        except Exception as e:
+            print(f"⚠️ Could not publish document job {job_id}: {e}")
+
+    async def get(self, job_id: str, session_id: str) -> Optional[Dict]:
+        """
+        The poll response for a job, from this worker or the shared state.
+        None if the job is unknown or session_id is not one of its sessions.
+        """
+        job = self.jobs.get(job_id)
+        if job is not None:
+            if session_id not in job.session_ids:
+                return None
+            return {**job.info(session_id), "position": self.position(job)}
+        if self.backend is None:
+            return None
+        key = self._job_key(job_id, session_id)
+        try:
+            blob = (await self.backend.run(self.backend.read, [key])).get(key)
+        except Exception as e:
+            print(f"⚠️ Could not read document job {job_id}: {e}")
+            return None
+        if blob is None:
+            return None
+        return {**decode_value(blob), "position": None}
+
+    def for_session(self, session_id: str) -> List[Dict]:
+        """Jobs on this worker that load into a session, newest first."""
+        self._prune()
+        jobs = [job for job in self.jobs.values() if session_id in job.session_ids]
+        return [{**job.info(session_id), "position": self.position(job)} for job in reversed(jobs)]
+
+    def position(self, job: DocumentJob) -> Optional[int]:
+        """1-based place in the queue while queued, else None."""
+        if job.state != "queued":
+            return None
+        queued = [other for other in self.jobs.values() if other.state == "queued"]
+        return queued.index(job) + 1
+
+    @property
+    def queued(self) -> int:
+        return sum(1 for job in self._active.values() if job.state == "queued")
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        expired = [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self.jobs[job_id]
+
+    async def stop(self):
+        """Cancel the workers and release queued uploads (called on app shutdown)."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for job in list(self._active.values()):
+            if job.cleanup is not None:
+                job.cleanup()
+                job.cleanup = None
+        self._queue = None
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.workers,
+            "queued": self.queued,
+            "running": sum(1 for job in self._active.values() if job.state == "running"),
+            "max_pending": self.max_pending,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "completed": self.completed,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "jobs_kept": len(self.jobs),
+        }
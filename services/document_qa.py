@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional
+
+from services.document_service import summarize_document
+from services.groq_service import get_groq_response, get_groq_multi_response
+from services.retrieval_service import DEFAULT_CONTEXT_CHARS
+from services.session_store import Session
+from services.metrics import stage
+
+# --- DOCUMENT Q&A CONTEXT AND BATCHES ---
+# Questions about short documents are sent with the whole text (of every
+# document in the session); otherwise with the chunks retrieved for that
+# question across all documents, each labelled with its source (or a summary
+# when there is no index).
+#
+# Batches: each question gets its own retrieved chunks. Questions whose
+# chunks mostly overlap (and any questions sharing the whole document) are
+# packed into a single Groq call; the remaining calls run concurrently with
+# bounded parallelism. Answers come back in question order.
+
+# Documents (all of a session's together) longer than this are answered from retrieved chunks
+FULL_CONTEXT_MAX_CHARS = 8000
+
+BATCH_MAX_QUESTIONS = int(os.getenv("DOC_BATCH_MAX_QUESTIONS", "10"))
+BATCH_CONCURRENCY = int(os.getenv("DOC_BATCH_CONCURRENCY", "3"))  # Groq calls in flight per batch
+
+# Pack a question into a call when its chunks overlap that call's chunks by
+# at least this Jaccard ratio (set above 1 to never pack retrieved contexts)
+PACK_MIN_OVERLAP = float(os.getenv("DOC_BATCH_PACK_OVERLAP", "0.5"))
+PACK_MAX_QUESTIONS = int(os.getenv("DOC_BATCH_PACK_MAX", "4"))  # 1 disables packing
+PACK_MAX_CONTEXT_CHARS = int(os.getenv("DOC_BATCH_PACK_CONTEXT_CHARS", str(DEFAULT_CONTEXT_CHARS * 3 // 2)))
+
+
+def _shared_context(session: Session) -> Optional[str]:
+    """The context every question gets, or None if it depends on the question."""
+    if session.document_chars <= FULL_CONTEXT_MAX_CHARS:
+        return session.document_text
+    if session.document_index is None:
+        with stage("document_summarize"):
+            return summarize_document(session.document_text, max_chars=6000)
+    return None
+
+
+def document_context(session: Session, question: str) -> str:
+    """Document text to send with a question about the session's document."""
+    context = _shared_context(session)
+    if context is not None:
+        return context
+    with stage("retrieval"):
+        return session.document_index.build_context(question)
+
+
+def _pack(items: List[Dict], session: Session) -> List[Dict]:
+    """Greedily group questions into calls; each call is {items, chunks}."""
+    index = session.document_index
+    calls: List[Dict] = []
+    for item in items:
+        for call in calls:
+            if len(call["items"]) >= PACK_MAX_QUESTIONS:
+                continue
+            if item["chunks"] is None or call["chunks"] is None:
+                if item["chunks"] is None and call["chunks"] is None:  # same shared context
+                    call["items"].append(item)
+                    break
+                continue
+            union = call["chunks"] | item["chunks"]
+            overlap = len(call["chunks"] & item["chunks"]) / len(union)
+            union_chars = sum(index.chunk_chars(key) for key in union)
+            if overlap >= PACK_MIN_OVERLAP and union_chars <= PACK_MAX_CONTEXT_CHARS:
+                call["items"].append(item)
+                call["chunks"] = union
+                break
+        else:
+            calls.append({"items": [item], "chunks": item["chunks"]})
+    return calls
+
+
+async def answer_questions(session: Session, questions: List[str]) -> Dict:
+    """
+    Answer several questions about the session's document.
+
+    Returns {"answers": [...], "upstream_calls": n, "total_ms": ...}, where
+    each answer is {"question", "response", "call", "packed", "sources",
+    "retrieval_ms", "answer_ms"} in question order; answers with the same
+    "call" came from one Groq request, and "sources" names the documents
+    its context was taken from.
+    """
+    started = time.perf_counter()
+    shared = _shared_context(session)
+    index = session.document_index
+
+    items = []
+    for position, question in enumerate(questions):
+        retrieval_started = time.perf_counter()
+        chunks = None
+        if shared is None:
+            with stage("retrieval"):
+                chunks = frozenset(index.select_chunks(question))
+        items.append({
+            "position": position,
+            "question": question,
+            "chunks": chunks,
+            "retrieval_ms": round((time.perf_counter() - retrieval_started) * 1000, 1),
+        })
+
+    def context_for(chunks) -> str:
+        return shared if chunks is None else index.format_chunks(chunks, DEFAULT_CONTEXT_CHARS)
+
+    def sources_for(chunks) -> List[str]:
+        if chunks is None or not hasattr(index, "sources"):
+            return session.document_names
+        return index.sources(chunks)
+
+    calls = _pack(items, session)
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    answers: List[Optional[Dict]] = [None] * len(items)
+    upstream_calls = 0
+
+    async def answer_one(item: Dict) -> str:
+        nonlocal upstream_calls
+        async with semaphore:  # each fallback call takes its own slot
+            upstream_calls += 1
+            return await get_groq_response(item["question"], context_for(item["chunks"]))
+
+    async def run(number: int, call: Dict):
+        nonlocal upstream_calls
+        group = call["items"]
+        call_started = time.perf_counter()
+        responses = None
+        if len(group) > 1:
+            async with semaphore:
+                upstream_calls += 1
+                responses = await get_groq_multi_response(
+                    [item["question"] for item in group], context_for(call["chunks"])
+                )
+        packed = responses is not None
+        if responses is None:
+            # Single question, or the packed reply couldn't be split
+            responses = await asyncio.gather(*[answer_one(item) for item in group])
+        answer_ms = round((time.perf_counter() - call_started) * 1000, 1)
+
+        for item, response in zip(group, responses):
+            answers[item["position"]] = {
+                "question": item["question"],
+                "response": response,
+                "call": number,
+                "packed": packed,
+                "sources": sources_for(item["chunks"]),
+                "retrieval_ms": item["retrieval_ms"],
+                "answer_ms": answer_ms,
+            }
+
+    await asyncio.gather(*[run(number, call) for number, call in enumerate(calls)])
+    print(f"📚 Batch: {len(questions)} questions in {len(calls)} calls")
+    return {
+        "answers": answers,
+        "upstream_calls": upstream_calls,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
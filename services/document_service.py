@@ -1,37 +1,124 @@
 import os
+import time
 import base64
+import asyncio
 import hashlib
-from typing import Optional, Dict
+import tempfile
+import zipfile
+from contextlib import aclosing
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Optional, Dict, List, Tuple, Union
 from io import BytesIO
-import PyPDF2
-import docx
-from dotenv import load_dotenv
+from services.retrieval_service import DocumentIndex, build_index
+from services.cache import LRUCache, SQLiteTextStore
+from services.metrics import stage, payload_size
 
-load_dotenv()
+# PyPDF2 and python-docx are imported inside the extractors, so a cold start
+# (e.g. a serverless instance answering a chat message) doesn't pay for them
+# until a document of that type actually arrives.
 
-# In-memory cache for parsed documents (faster than re-parsing)
-document_cache: Dict[str, str] = {}
+# In-memory LRU cache for parsed documents (faster than re-parsing),
+# bounded by total size and age
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DOC_CACHE_TTL = float(os.getenv("DOC_CACHE_TTL", "3600"))
+document_cache = LRUCache(DOC_CACHE_MAX_BYTES, ttl=DOC_CACHE_TTL, name="documents")
+
+# Retrieval indexes for cached documents, keyed by the same hash
+document_indexes = LRUCache(
+    DOC_CACHE_MAX_BYTES, ttl=DOC_CACHE_TTL, sizeof=lambda index: index.approx_bytes, name="indexes"
+)
+
+# On-disk tier: compressed extracted text in SQLite, keyed by content hash, so
+# it survives restarts and is shared by all workers on this host.
+# Set DOC_DISK_CACHE=0 to disable.
+DOC_DISK_CACHE_PATH = os.getenv(
+    "DOC_DISK_CACHE_PATH", os.path.join(tempfile.gettempdir(), "codekivy-cache", "documents.sqlite3")
+)
+DOC_DISK_CACHE_MAX_BYTES = int(os.getenv("DOC_DISK_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+DOC_DISK_CACHE_TTL = float(os.getenv("DOC_DISK_CACHE_TTL", str(7 * 24 * 3600)))
+
+document_disk_cache: Optional[SQLiteTextStore] = None
+if os.getenv("DOC_DISK_CACHE", "1") != "0":
+    try:
+        document_disk_cache = SQLiteTextStore(DOC_DISK_CACHE_PATH, DOC_DISK_CACHE_MAX_BYTES, DOC_DISK_CACHE_TTL)
+    except Exception as e:
+        print(f"⚠️ Disk document cache unavailable: {e}")
+
+# Maximum PDF pages to extract (was a hard-coded 50)
+MAX_PDF_PAGES = int(os.getenv("DOC_MAX_PAGES", "50"))
+
+# Pages handed to each extraction worker task
+PAGES_PER_TASK = int(os.getenv("DOC_PAGES_PER_TASK", "5"))
+
+# Progressive PDF ingestion: reply once the first pages are extracted and
+# read the rest in the background (DOC_PROGRESSIVE=0 waits for every page)
+PROGRESSIVE_PDF = os.getenv("DOC_PROGRESSIVE", "1") != "0"
+PROGRESSIVE_FIRST_PAGES = int(os.getenv("DOC_PROGRESSIVE_PAGES", str(PAGES_PER_TASK)))
+
+# Extraction worker processes (0 = use threads, e.g. where multiprocessing
+# isn't available such as serverless runtimes)
+EXTRACT_WORKERS = int(os.getenv("DOC_EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PDF_MIME = 'application/pdf'
+DOCX_MIME = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+TXT_MIME = 'text/plain'
+
+# Binary uploads (/api/document/upload)
+MAX_UPLOAD_BYTES = int(os.getenv("DOC_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+SPOOL_MEMORY_BYTES = 1024 * 1024  # uploads larger than this spill to a temp file
+UPLOAD_CHUNK_BYTES = 64 * 1024
+
+_extraction_pool: Optional[Executor] = None
+
+# File contents: raw bytes, or a path to a spooled temp file that extraction
+# workers open themselves (no copy sent between processes)
+DocumentSource = Union[bytes, str]
 
 def get_document_hash(document_data: str) -> str:
     """Generate a hash for caching purposes."""
     return hashlib.md5(document_data.encode()).hexdigest()
 
-def extract_text_from_pdf(file_data: bytes) -> str:
+def _open_source(source: DocumentSource):
+    if isinstance(source, str):
+        return open(source, "rb")
+    return BytesIO(source)
+
+def _spill_bytes(data: bytes) -> str:
+    """Write decoded upload bytes to a temp file and return its path."""
+    with tempfile.NamedTemporaryFile(prefix="codekivy-upload-", delete=False) as f:
+        f.write(data)
+        return f.name
+
+def _remove_spilled(path: str):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+def _read_source(source: DocumentSource) -> bytes:
+    if isinstance(source, str):
+        with open(source, "rb") as f:
+            return f.read()
+    return source
+
+def extract_text_from_pdf(file_data: DocumentSource, max_pages: int = MAX_PDF_PAGES) -> str:
     """
     Extract text from PDF file.
     Optimized for speed - uses PyPDF2 for fast extraction.
     """
     try:
-        pdf_file = BytesIO(file_data)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        text_parts = []
-        # Limit to first 50 pages for speed (can be adjusted)
-        max_pages = min(len(pdf_reader.pages), 50)
-        
-        for page_num in range(max_pages):
-            page = pdf_reader.pages[page_num]
-            text_parts.append(page.extract_text())
+        import PyPDF2
+
+        with _open_source(file_data) as pdf_file:
+            pdf_reader = PyPDF2.PdfReader(pdf_file)
+            
+            text_parts = []
+            # Limit to the first max_pages pages for speed (DOC_MAX_PAGES)
+            max_pages = min(len(pdf_reader.pages), max_pages)
+            
+            for page_num in range(max_pages):
+                page = pdf_reader.pages[page_num]
+                text_parts.append(page.extract_text())
         
         full_text = "\n".join(text_parts)
         print(f"✓ Extracted {len(full_text)} characters from {max_pages} pages")
@@ -41,14 +128,147 @@ def extract_text_from_pdf(file_data: bytes) -> str:
         print(f"❌ PDF extraction error: {e}")
         return f"[Error: Could not read PDF - {str(e)}]"
 
-def extract_text_from_docx(file_data: bytes) -> str:
+# --- STREAMING DOCX EXTRACTION ---
+# A .docx is a zip of XML parts. Rather than building python-docx's whole
+# object model, the parts are streamed out of the zip through an incremental
+# XML parser and each paragraph is released as soon as its text is taken.
+# Unlike doc.paragraphs this also keeps tables (course schedules live there),
+# headers, footers, footnotes and endnotes.
+
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+_W_P, _W_T, _W_TAB, _W_BR, _W_CR = W_NS + "p", W_NS + "t", W_NS + "tab", W_NS + "br", W_NS + "cr"
+_W_TBL, _W_TR, _W_TC = W_NS + "tbl", W_NS + "tr", W_NS + "tc"
+_W_NOTE_REF = (W_NS + "footnoteReference", W_NS + "endnoteReference")
+_W_NOTES = (W_NS + "footnote", W_NS + "endnote")
+_W_ID, _W_TYPE = W_NS + "id", W_NS + "type"
+
+# Bump when extraction output changes so stale disk-cached text isn't reused
+EXTRACTION_VERSION = "2"
+
+
+def _docx_part_text(part) -> List[str]:
+    """
+    Lines of one WordprocessingML part, in reading order: one per paragraph,
+    one per table row (cells joined with " | "), one per footnote/endnote.
+    """
+    from xml.etree.ElementTree import iterparse
+
+    lines: List[str] = []
+    paragraphs: List[List[str]] = []  # text of open paragraphs (text boxes nest them)
+    tables: List[Dict] = []  # open tables: {"row": [cells], "cell": [paragraph texts]}
+    note: Optional[List[str]] = None  # paragraphs of the current footnote/endnote
+    note_label = ""
+
+    for event, elem in iterparse(part, events=("start", "end")):
+        tag = elem.tag
+        if event == "start":
+            if tag == _W_P:
+                paragraphs.append([])
+            elif tag == _W_TBL:
+                tables.append({"row": [], "cell": []})
+            elif tag in _W_NOTES:
+                kind = elem.get(_W_TYPE)
+                note = None if kind in ("separator", "continuationSeparator", "continuationNotice") else []
+                note_label = f"[{'Footnote' if tag == _W_NOTES[0] else 'Endnote'} {elem.get(_W_ID)}]"
+            continue
+
+        if tag == _W_T:
+            if paragraphs and elem.text:
+                paragraphs[-1].append(elem.text)
+        elif tag == _W_TAB:
+            if paragraphs:
+                paragraphs[-1].append("\t")
+        elif tag in (_W_BR, _W_CR):
+            if paragraphs:
+                paragraphs[-1].append("\n")
+        elif tag in _W_NOTE_REF:
+            if paragraphs:
+                paragraphs[-1].append(f"[{elem.get(_W_ID)}]")
+        elif tag == _W_P:
+            text = "".join(paragraphs.pop())
+            if text.strip():
+                if tables:
+                    tables[-1]["cell"].append(text.strip())
+                elif note is not None:
+                    note.append(text)
+                else:
+                    lines.append(text)
+            elem.clear()
+        elif tag == _W_TC and tables:
+            tables[-1]["row"].append(" ".join(tables[-1]["cell"]))
+            tables[-1]["cell"] = []
+        elif tag == _W_TR and tables:
+            row = tables[-1]["row"]
+            tables[-1]["row"] = []
+            if any(cell for cell in row):
+                line = " | ".join(row)
+                if len(tables) > 1:
+                    tables[-2]["cell"].append(line)  # nested table stays in its cell
+                elif note is not None:
+                    note.append(line)
+                else:
+                    lines.append(line)
+            elem.clear()
+        elif tag == _W_TBL and tables:
+            tables.pop()
+            elem.clear()
+        elif tag in _W_NOTES:
+            if note:
+                lines.append(f"{note_label} " + " ".join(note))
+            note = None
+            elem.clear()
+    return lines
+
+
+def _docx_part_order(names: List[str]) -> List[str]:
+    """Headers, body, footnotes, endnotes, footers; numbered parts in order."""
+    def numbered(prefix: str) -> List[str]:
+        parts = [n for n in names if n.startswith(f"word/{prefix}") and n.endswith(".xml")]
+        return sorted(parts, key=lambda n: (len(n), n))
+    body = ["word/document.xml"] if "word/document.xml" in names else []
+    notes = [n for n in ("word/footnotes.xml", "word/endnotes.xml") if n in names]
+    return numbered("header") + body + notes + numbered("footer")
+
+
+def extract_text_from_docx(file_data: DocumentSource) -> str:
     """
     Extract text from DOCX file.
-    Fast extraction using python-docx.
+    Streams the XML parts out of the zip (low memory, includes tables,
+    headers, footnotes); falls back to python-docx if that fails.
+    """
+    try:
+        with _open_source(file_data) as docx_file, zipfile.ZipFile(docx_file) as archive:
+            text_parts = []
+            seen_repeats = set()
+            for name in _docx_part_order(archive.namelist()):
+                with archive.open(name) as part:
+                    lines = _docx_part_text(part)
+                if name.startswith(("word/header", "word/footer")):
+                    # The same header/footer is often defined for first/even/odd pages
+                    key = "\n".join(lines)
+                    if key in seen_repeats:
+                        continue
+                    seen_repeats.add(key)
+                text_parts.extend(lines)
+        
+        full_text = "\n".join(text_parts)
+        print(f"✓ Extracted {len(full_text)} characters from DOCX")
+        return full_text
+        
+    except Exception as e:
+        print(f"⚠️ Streaming DOCX extraction failed ({e}), trying python-docx")
+        return extract_text_from_docx_object_model(file_data)
+
+def extract_text_from_docx_object_model(file_data: DocumentSource) -> str:
+    """
+    Extract body paragraphs with python-docx (the original extractor; loads
+    the whole document model and skips tables, headers and footnotes).
     """
     try:
-        docx_file = BytesIO(file_data)
-        doc = docx.Document(docx_file)
+        import docx
+
+        with _open_source(file_data) as docx_file:
+            doc = docx.Document(docx_file)
         
         text_parts = []
         for paragraph in doc.paragraphs:
@@ -63,12 +283,13 @@ def extract_text_from_docx(file_data: bytes) -> str:
         print(f"❌ DOCX extraction error: {e}")
         return f"[Error: Could not read DOCX - {str(e)}]"
 
-def extract_text_from_txt(file_data: bytes) -> str:
+def extract_text_from_txt(file_data: DocumentSource) -> str:
     """
     Extract text from TXT file.
     Handles multiple encodings.
     """
     try:
+        file_data = _read_source(file_data)
         # Try UTF-8 first (most common)
         try:
             text = file_data.decode('utf-8')
@@ -83,6 +304,311 @@ def extract_text_from_txt(file_data: bytes) -> str:
         print(f"❌ TXT extraction error: {e}")
         return f"[Error: Could not read TXT - {str(e)}]"
 
+# --- PARALLEL EXTRACTION OFF THE EVENT LOOP ---
+
+def get_extraction_pool() -> Executor:
+    """Shared extraction pool: processes when available, threads otherwise."""
+    global _extraction_pool
+    if _extraction_pool is None:
+        if EXTRACT_WORKERS > 0:
+            try:
+                _extraction_pool = ProcessPoolExecutor(max_workers=EXTRACT_WORKERS)
+                print(f"✓ Extraction pool: {EXTRACT_WORKERS} processes")
+            except (OSError, NotImplementedError) as e:
+                # e.g. no /dev/shm semaphores on serverless runtimes
+                print(f"⚠️ Process pool unavailable ({e}), using threads")
+        if _extraction_pool is None:
+            _extraction_pool = ThreadPoolExecutor(max_workers=max(EXTRACT_WORKERS, 2))
+    return _extraction_pool
+
+def shutdown_extraction_pool():
+    """Stop extraction workers (called on app shutdown)."""
+    global _extraction_pool
+    if _extraction_pool is not None:
+        _extraction_pool.shutdown(wait=False, cancel_futures=True)
+        _extraction_pool = None
+
+def _count_pdf_pages(file_data: DocumentSource) -> Tuple[int, float]:
+    """Worker task: number of pages in a PDF and CPU seconds spent."""
+    import PyPDF2
+
+    cpu_start = time.process_time()
+    with _open_source(file_data) as pdf_file:
+        pages = len(PyPDF2.PdfReader(pdf_file).pages)
+    return pages, time.process_time() - cpu_start
+
+def _extract_pdf_page_range(file_data: DocumentSource, start: int, end: int) -> Tuple[List[str], float]:
+    """Worker task: extract pages [start, end) of a PDF, plus CPU seconds spent."""
+    import PyPDF2
+
+    cpu_start = time.process_time()
+    texts = []
+    with _open_source(file_data) as pdf_file:
+        reader = PyPDF2.PdfReader(pdf_file)
+        for page_num in range(start, end):
+            try:
+                texts.append(reader.pages[page_num].extract_text() or "")
+            except Exception as e:
+                print(f"⚠️ Page {page_num + 1} extraction error: {e}")
+                texts.append("")
+    return texts, time.process_time() - cpu_start
+
+def _extract_timed(extractor, file_data: DocumentSource) -> Tuple[str, float]:
+    """Worker task: run a single-shot extractor and measure its CPU time."""
+    cpu_start = time.process_time()
+    text = extractor(file_data)
+    return text, time.process_time() - cpu_start
+
+# Progress callback: on_progress(stage, pages_done, pages_total) with stage
+# "extract" (pages counted as their ranges finish) or "index"
+ProgressCallback = Callable[[str, int, int], None]
+
+async def extract_text_from_pdf_parallel(
+    file_data: DocumentSource,
+    max_pages: int = MAX_PDF_PAGES,
+    on_progress: Optional[ProgressCallback] = None
+) -> Tuple[str, Dict]:
+    """
+    Extract a PDF in the worker pool, split into page ranges that run in
+    parallel and are reassembled in page order.
+    
+    Returns:
+        (text, stats) where stats has pages, tasks and cpu_time_ms
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    try:
+        total_pages, cpu_time = await loop.run_in_executor(pool, _count_pdf_pages, file_data)
+        page_count = min(total_pages, max_pages)
+        
+        ranges = [
+            (start, min(start + PAGES_PER_TASK, page_count))
+            for start in range(0, page_count, PAGES_PER_TASK)
+        ]
+        futures = [
+            loop.run_in_executor(pool, _extract_pdf_page_range, file_data, start, end)
+            for start, end in ranges
+        ]
+        if on_progress is not None:
+            pages_done = 0
+            on_progress("extract", 0, page_count)
+            
+            def range_done(future, pages: int):
+                nonlocal pages_done
+                if not future.cancelled() and future.exception() is None:
+                    pages_done += pages
+                    on_progress("extract", pages_done, page_count)
+            
+            for future, (start, end) in zip(futures, ranges):
+                future.add_done_callback(lambda future, pages=end - start: range_done(future, pages))
+        results = await asyncio.gather(*futures)
+    except Exception as e:
+        print(f"❌ PDF extraction error: {e}")
+        return f"[Error: Could not read PDF - {str(e)}]", {}
+    
+    text_parts = []
+    for texts, task_cpu in results:  # gather preserves range order
+        text_parts.extend(texts)
+        cpu_time += task_cpu
+    
+    full_text = "\n".join(text_parts)
+    print(f"✓ Extracted {len(full_text)} characters from {page_count}/{total_pages} pages ({len(ranges)} tasks)")
+    return full_text, {
+        "pages": page_count,
+        "total_pages": total_pages,
+        "tasks": len(ranges),
+        "cpu_time_ms": round(cpu_time * 1000, 1)
+    }
+
+# --- PROGRESSIVE PDF INGESTION ---
+# Only the first PROGRESSIVE_FIRST_PAGES pages are extracted before the
+# upload replies. A PdfRemainder then extracts the remaining page ranges (in
+# parallel, handed over in page order) from a background task, which swaps
+# the growing text and a rebuilt index into the session after each range.
+# The full text is cached only once every page is in.
+
+class PdfRemainder:
+    """The pages of a progressively ingested PDF that are still to be extracted."""
+
+    def __init__(self, doc_hash: str, source: DocumentSource, page_count: int, total_pages: int, cleanup: Optional[Callable[[], None]] = None):
+        self.doc_hash = doc_hash
+        self.source = source
+        self.page_count = page_count  # pages that will be extracted (at most MAX_PDF_PAGES)
+        self.total_pages = total_pages
+        self.cleanup = cleanup  # called once extraction ends (e.g. delete the spooled upload)
+        self.texts: List[str] = []  # page texts extracted so far, in page order
+        self.cpu_time = 0.0
+
+    @property
+    def pages_done(self) -> int:
+        return len(self.texts)
+
+    @property
+    def text(self) -> str:
+        return "\n".join(self.texts)
+
+    def close(self):
+        if self.cleanup is not None:
+            self.cleanup()
+            self.cleanup = None
+
+    async def pages(self) -> AsyncIterator[Tuple[str, Optional[DocumentIndex]]]:
+        """
+        Extract the remaining pages, yielding (text so far, its index) after
+        each page range. The last text is validated and cached like any
+        processed document. Use with aclosing() so stopping early cancels
+        the ranges not yet started.
+        """
+        loop = asyncio.get_running_loop()
+        pool = get_extraction_pool()
+        ranges = [
+            (start, min(start + PAGES_PER_TASK, self.page_count))
+            for start in range(self.pages_done, self.page_count, PAGES_PER_TASK)
+        ]
+        futures = [
+            loop.run_in_executor(pool, _extract_pdf_page_range, self.source, start, end)
+            for start, end in ranges
+        ]
+        try:
+            for number, future in enumerate(futures, 1):
+                texts, task_cpu = await future
+                self.texts.extend(texts)
+                self.cpu_time += task_cpu
+                if number < len(futures):
+                    text = self.text
+                    yield text, await asyncio.to_thread(build_index, text)
+            text, index = await asyncio.to_thread(_store_result, self.doc_hash, self.text)
+            print(f"✓ Extracted {len(text)} characters from {self.page_count}/{self.total_pages} pages (background)")
+            yield text, index
+        finally:
+            for future in futures:
+                future.cancel()
+            self.close()
+
+async def extract_pdf_first_pages(
+    doc_hash: str,
+    source: DocumentSource,
+    first_pages: int = PROGRESSIVE_FIRST_PAGES,
+    max_pages: int = MAX_PDF_PAGES,
+    cleanup: Optional[Callable[[], None]] = None
+) -> Tuple[str, Dict, Optional[PdfRemainder]]:
+    """
+    Extract only the first pages of a PDF in the worker pool.
+    
+    Returns:
+        (text, stats, remainder) - remainder is None when no pages are left
+        (it then holds the whole document, not yet cached)
+    """
+    loop = asyncio.get_running_loop()
+    pool = get_extraction_pool()
+    try:
+        total_pages, cpu_time = await loop.run_in_executor(pool, _count_pdf_pages, source)
+        remainder = PdfRemainder(doc_hash, source, min(total_pages, max_pages), total_pages, cleanup)
+        ready = min(first_pages, remainder.page_count)
+        ranges = [(start, min(start + PAGES_PER_TASK, ready)) for start in range(0, ready, PAGES_PER_TASK)]
+        results = await asyncio.gather(*[
+            loop.run_in_executor(pool, _extract_pdf_page_range, source, start, end)
+            for start, end in ranges
+        ])
+    except Exception as e:
+        print(f"❌ PDF extraction error: {e}")
+        return f"[Error: Could not read PDF - {str(e)}]", {}, None
+    
+    for texts, task_cpu in results:
+        remainder.texts.extend(texts)
+        cpu_time += task_cpu
+    
+    text = remainder.text
+    pending = remainder.page_count - ready
+    print(f"✓ Extracted {len(text)} characters from {ready}/{remainder.total_pages} pages ({pending} more in background)")
+    stats = {
+        "pages": ready,
+        "total_pages": remainder.total_pages,
+        "pages_pending": pending,
+        "tasks": len(ranges),
+        "cpu_time_ms": round(cpu_time * 1000, 1)
+    }
+    return text, stats, remainder if pending else None
+
+# --- DOCUMENT PROCESSING ---
+
+def _decode_document(document: Dict) -> bytes:
+    # Remove "data:application/pdf;base64," prefix if present
+    base64_data = document['data']
+    if ',' in base64_data:
+        base64_data = base64_data.split(',')[1]
+    return base64.b64decode(base64_data)
+
+def _document_kind(file_type: str, file_name: str) -> Optional[str]:
+    file_type = file_type or ""
+    file_name = (file_name or "").lower()
+    if file_type == PDF_MIME or file_name.endswith('.pdf'):
+        return "pdf"
+    if file_type == DOCX_MIME or file_name.endswith('.docx'):
+        return "docx"
+    if file_type == TXT_MIME or file_name.endswith('.txt'):
+        return "txt"
+    return None
+
+def _get_cached_text(doc_hash: str) -> Optional[str]:
+    """Look up extracted text in memory, then on disk (promoting disk hits)."""
+    text = document_cache.get(doc_hash)
+    if text is None and document_disk_cache is not None:
+        try:
+            text = document_disk_cache.get(f"v{EXTRACTION_VERSION}:{doc_hash}")
+        except Exception as e:
+            print(f"⚠️ Disk cache read error: {e}")
+        if text is not None:
+            print("✓ Loaded document from disk cache")
+            document_cache.set(doc_hash, text)
+    return text
+
+def _cached_result(doc_hash: str) -> Optional[Tuple[str, DocumentIndex]]:
+    text = _get_cached_text(doc_hash)
+    if text is None:
+        return None
+    print("✓ Using cached document")
+    index = document_indexes.get(doc_hash)
+    if index is None:
+        index = build_index(text)
+        document_indexes.set(doc_hash, index)
+    return text, index
+
+async def _cached_result_async(doc_hash: str) -> Optional[Tuple[str, DocumentIndex]]:
+    """
+    _cached_result for async callers. Memory hits return directly; a disk
+    lookup (and rebuilding the index of a disk hit) runs in a thread.
+    """
+    text = document_cache.get(doc_hash)
+    index = document_indexes.get(doc_hash)
+    if text is not None and index is not None:
+        print("✓ Using cached document")
+        return text, index
+    if text is None and document_disk_cache is None:
+        return None
+    return await asyncio.to_thread(_cached_result, doc_hash)
+
+def _store_result(doc_hash: str, text: str) -> Tuple[str, Optional[DocumentIndex]]:
+    """Validate extracted text, cache it and build its retrieval index."""
+    # Validate extraction
+    if not text or text.startswith("[Error"):
+        return text, None
+    
+    if len(text.strip()) < 10:
+        return "[Error: Document appears to be empty or unreadable]", None
+    
+    # Cache the result (memory + disk) and build the retrieval index once
+    document_cache.set(doc_hash, text)
+    if document_disk_cache is not None:
+        try:
+            document_disk_cache.set(f"v{EXTRACTION_VERSION}:{doc_hash}", text)
+        except Exception as e:
+            print(f"⚠️ Disk cache write error: {e}")
+    index = build_index(text)
+    document_indexes.set(doc_hash, index)
+    
+    return text, index
+
 def process_document(document: Dict) -> str:
     """
     Main function to process uploaded document.
@@ -94,58 +620,345 @@ def process_document(document: Dict) -> str:
     Returns:
         Extracted text content
     """
+    text, _ = process_document_with_index(document)
+    return text
+
+def process_document_with_index(document: Dict) -> Tuple[str, Optional[DocumentIndex]]:
+    """
+    Like process_document, but also returns the document's retrieval index.
+    
+    The index is built once per unique document (at upload) and cached with
+    the extracted text. The index is None when extraction failed.
+    """
     try:
         # Get document hash for caching
         doc_hash = get_document_hash(document['data'])
         
         # Check cache first
-        if doc_hash in document_cache:
-            print("✓ Using cached document")
-            return document_cache[doc_hash]
+        cached = _cached_result(doc_hash)
+        if cached:
+            return cached
         
         print(f"📄 Processing: {document['name']} ({document['size']} bytes)")
         
-        # Decode base64 data
-        # Remove "data:application/pdf;base64," prefix if present
-        base64_data = document['data']
-        if ',' in base64_data:
-            base64_data = base64_data.split(',')[1]
-        
-        file_data = base64.b64decode(base64_data)
+        file_data = _decode_document(document)
         
         # Extract text based on file type
-        file_type = document['type']
-        file_name = document['name'].lower()
-        
-        if file_type == 'application/pdf' or file_name.endswith('.pdf'):
+        kind = _document_kind(document['type'], document['name'])
+        if kind == "pdf":
             text = extract_text_from_pdf(file_data)
-        elif file_type == 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' or file_name.endswith('.docx'):
+        elif kind == "docx":
             text = extract_text_from_docx(file_data)
-        elif file_type == 'text/plain' or file_name.endswith('.txt'):
+        elif kind == "txt":
             text = extract_text_from_txt(file_data)
         else:
-            return f"[Error: Unsupported file type - {file_type}]"
+            return f"[Error: Unsupported file type - {document['type']}]", None
         
-        # Validate extraction
-        if not text or text.startswith("[Error"):
-            return text
+        return _store_result(doc_hash, text)
         
-        if len(text.strip()) < 10:
-            return "[Error: Document appears to be empty or unreadable]"
+    except Exception as e:
+        print(f"❌ Document processing error: {e}")
+        return f"[Error: Failed to process document - {str(e)}]", None
+
+async def _extract_async(kind: str, source: DocumentSource, on_progress: Optional[ProgressCallback] = None) -> Tuple[str, Dict]:
+    """Run the right extractor for a document kind in the worker pool."""
+    if kind == "pdf":
+        return await extract_text_from_pdf_parallel(source, on_progress=on_progress)
+    if on_progress is not None:
+        on_progress("extract", 0, 0)
+    extractor = extract_text_from_docx if kind == "docx" else extract_text_from_txt
+    loop = asyncio.get_running_loop()
+    text, cpu_time = await loop.run_in_executor(get_extraction_pool(), _extract_timed, extractor, source)
+    return text, {"cpu_time_ms": round(cpu_time * 1000, 1)}
+
+async def _process_source_async(
+    doc_hash: str,
+    kind: Optional[str],
+    source: DocumentSource,
+    file_type: str,
+    wall_start: float,
+    progressive: bool = False,
+    cleanup: Optional[Callable[[], None]] = None,
+    on_progress: Optional[ProgressCallback] = None
+) -> Tuple[str, Optional[DocumentIndex], Dict, Optional[PdfRemainder]]:
+    if kind is None:
+        return f"[Error: Unsupported file type - {file_type}]", None, {}, None
+    
+    remainder = None
+    if kind == "pdf" and progressive:
+        with stage("document_extract"):
+            text, stats, remainder = await extract_pdf_first_pages(doc_hash, source, cleanup=cleanup)
+        if remainder is not None and len(text.strip()) < 10:
+            # Nothing to answer from yet (e.g. a scanned cover page): read on
+            with stage("document_extract"):
+                async with aclosing(remainder.pages()) as pages:
+                    async for text, index in pages:
+                        pass
+            stats.update(pages=remainder.page_count, pages_pending=0)
+            remainder = None
+        elif remainder is not None:
+            with stage("document_index"):
+                index = await asyncio.to_thread(build_index, text)
+        else:
+            with stage("document_index"):
+                text, index = await asyncio.to_thread(_store_result, doc_hash, text)
+    else:
+        with stage("document_extract"):
+            text, stats = await _extract_async(kind, source, on_progress)
+        if on_progress is not None:
+            on_progress("index", stats.get("pages", 0), stats.get("pages", 0))
+        with stage("document_index"):
+            text, index = await asyncio.to_thread(_store_result, doc_hash, text)
+    stats["wall_time_ms"] = round((time.perf_counter() - wall_start) * 1000, 1)
+    print(f"✓ Document CPU time: {stats.get('cpu_time_ms')} ms, wall: {stats['wall_time_ms']} ms")
+    return text, index, stats, remainder
+
+async def process_document_async(
+    document: Dict,
+    progressive: bool = False,
+    on_progress: Optional[ProgressCallback] = None
+) -> Tuple[str, Optional[DocumentIndex], Dict, Optional[PdfRemainder]]:
+    """
+    Non-blocking process_document_with_index for async endpoints.
+    
+    Extraction runs in the worker pool (PDF pages in parallel) and indexing
+    in a thread, so the event loop keeps serving other requests.
+    
+    Args:
+        progressive: for PDFs, return after the first pages and leave the
+            rest to the returned PdfRemainder
+        on_progress: called as extraction advances (see ProgressCallback)
+    
+    Returns:
+        (text, index, stats, remainder) - stats reports pages, cpu_time_ms
+        and wall_time_ms; remainder is None unless pages are still pending
+    """
+    wall_start = time.perf_counter()
+    spilled = None
+    remainder = None
+    try:
+        doc_hash = get_document_hash(document['data'])
         
-        # Cache the result
-        document_cache[doc_hash] = text
+        cached = await _cached_result_async(doc_hash)
+        if cached:
+            return cached[0], cached[1], {"cached": True}, None
         
-        # Limit cache size (keep last 10 documents)
-        if len(document_cache) > 10:
-            oldest_key = next(iter(document_cache))
-            del document_cache[oldest_key]
+        print(f"📄 Processing: {document['name']} ({document['size']} bytes)")
         
-        return text
+        with stage("document_decode"):
+            file_data = _decode_document(document)
+        payload_size.observe(len(file_data), "document")
+        kind = _document_kind(document['type'], document['name'])
+        source: DocumentSource = file_data
+        if kind == "pdf" and len(file_data) > SPOOL_MEMORY_BYTES:
+            # Every page-range task would otherwise get its own pickled copy
+            # of the PDF; spill it once and hand the workers the path, as
+            # for large multipart uploads
+            spilled = await asyncio.to_thread(_spill_bytes, file_data)
+            source = spilled
+        text, index, stats, remainder = await _process_source_async(
+            doc_hash, kind, source, document['type'], wall_start, progressive,
+            cleanup=(lambda: _remove_spilled(spilled)) if spilled else None,
+            on_progress=on_progress
+        )
+        return text, index, stats, remainder
         
     except Exception as e:
         print(f"❌ Document processing error: {e}")
-        return f"[Error: Failed to process document - {str(e)}]"
+        return f"[Error: Failed to process document - {str(e)}]", None, {}, None
+    finally:
+        if spilled is not None and remainder is None:
+            _remove_spilled(spilled)  # otherwise the PdfRemainder removes it
+
+# --- BINARY UPLOADS (multipart, no base64) ---
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds MAX_UPLOAD_BYTES."""
+
+class DocumentBuffer:
+    """
+    Uploaded file spooled to memory, spilling to a temp file once it grows
+    past SPOOL_MEMORY_BYTES. The content hash is computed as chunks arrive.
+    """
+
+    def __init__(self, max_bytes: int = MAX_UPLOAD_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._memory = bytearray()
+        self._file = None
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise UploadTooLarge(f"File exceeds {self.max_bytes / (1024 * 1024):.1f} MB limit")
+        self._md5.update(chunk)
+        if self._file is None and self.size > SPOOL_MEMORY_BYTES:
+            self._file = tempfile.NamedTemporaryFile(prefix="codekivy-upload-", delete=False)
+            self._file.write(self._memory)
+            self._memory = bytearray()
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._memory += chunk
+
+    @property
+    def hash(self) -> str:
+        return self._md5.hexdigest()
+
+    @property
+    def source(self) -> DocumentSource:
+        """Bytes for small uploads, the temp file path for large ones."""
+        if self._file is not None:
+            self._file.flush()
+            return self._file.name
+        return bytes(self._memory)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            try:
+                os.unlink(self._file.name)
+            except OSError:
+                pass
+            self._file = None
+        self._memory = bytearray()
+
+class UploadInvalid(Exception):
+    """Raised when an upload body is not a usable multipart form."""
+
+# Text fields sent alongside the file (session_id, flags) are tiny
+UPLOAD_MAX_FIELD_BYTES = 64 * 1024
+
+class SpooledForm:
+    """A multipart upload: the file, spooled and hashed, plus the text fields."""
+
+    def __init__(self, max_bytes: int):
+        self.buffer = DocumentBuffer(max_bytes)
+        self.file_name = ""
+        self.content_type = ""
+        self.fields: Dict[str, str] = {}
+        self.has_file = False
+
+async def spool_multipart(
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+    file_field: str = "file",
+    max_bytes: int = MAX_UPLOAD_BYTES
+) -> SpooledForm:
+    """
+    Parse a multipart/form-data body as it arrives (e.g. Starlette's
+    request.stream()). The file part's bytes go straight into a
+    DocumentBuffer, hashed chunk by chunk, so there is no intermediate copy
+    of the whole body, and UploadTooLarge is raised the moment the file
+    passes max_bytes even without a Content-Length.
+    """
+    from python_multipart.multipart import MultipartParser, parse_options_header
+
+    mime, params = parse_options_header(content_type or "")
+    if mime != b"multipart/form-data" or b"boundary" not in params:
+        raise UploadInvalid("Expected a multipart/form-data upload")
+
+    form = SpooledForm(max_bytes)
+    part = {}  # current part: header bytes, then name / filename / data
+
+    def on_part_begin():
+        part.clear()
+        part["headers"] = {}
+        part["field"] = part["value"] = b""
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        part["headers"][part["field"].lower()] = part["value"]
+        part["field"] = part["value"] = b""
+
+    def on_headers_finished():
+        _, options = parse_options_header(part["headers"].get(b"content-disposition", b""))
+        part["name"] = options.get(b"name", b"").decode("utf-8", "replace")
+        if b"filename" in options:
+            if part["name"] != file_field or form.has_file:
+                raise UploadInvalid(f"Unexpected file field '{part['name']}'")
+            form.has_file = True
+            form.file_name = options[b"filename"].decode("utf-8", "replace")
+            form.content_type = part["headers"].get(b"content-type", b"").decode("latin-1")
+            part["file"] = True
+        else:
+            part["data"] = bytearray()
+
+    def on_part_data(data, start, end):
+        if part.get("file"):
+            form.buffer.write(data[start:end])
+            return
+        part["data"] += data[start:end]
+        if len(part["data"]) > UPLOAD_MAX_FIELD_BYTES:
+            raise UploadInvalid(f"Form field '{part['name']}' is too large")
+
+    def on_part_end():
+        if not part.get("file"):
+            form.fields[part["name"]] = part["data"].decode("utf-8", "replace")
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+    try:
+        async for chunk in chunks:
+            parser.write(chunk)
+        parser.finalize()
+    except (UploadTooLarge, UploadInvalid):
+        form.buffer.close()
+        raise
+    except BaseException as e:
+        form.buffer.close()
+        if isinstance(e, Exception):
+            raise UploadInvalid(f"Malformed multipart upload ({e})") from e
+        raise
+    if not form.has_file:
+        form.buffer.close()
+        raise UploadInvalid(f"No '{file_field}' file in the upload")
+    return form
+
+async def process_upload_async(
+    buffer: DocumentBuffer,
+    file_name: str,
+    file_type: str,
+    progressive: bool = False,
+    on_progress: Optional[ProgressCallback] = None
+) -> Tuple[str, Optional[DocumentIndex], Dict, Optional[PdfRemainder]]:
+    """
+    process_document_async for a spooled binary upload. A returned
+    PdfRemainder still reads from the buffer and closes it when done.
+    """
+    wall_start = time.perf_counter()
+    try:
+        # Namespaced so raw-byte hashes never collide with base64-text hashes
+        doc_hash = f"raw:{buffer.hash}"
+        
+        cached = await _cached_result_async(doc_hash)
+        if cached:
+            return cached[0], cached[1], {"cached": True}, None
+        
+        print(f"📄 Processing upload: {file_name} ({buffer.size} bytes)")
+        
+        payload_size.observe(buffer.size, "document")
+        kind = _document_kind(file_type, file_name)
+        return await _process_source_async(
+            doc_hash, kind, buffer.source, file_type, wall_start, progressive, cleanup=buffer.close, on_progress=on_progress
+        )
+        
+    except Exception as e:
+        print(f"❌ Document processing error: {e}")
+        return f"[Error: Failed to process document - {str(e)}]", None, {}, None
 
 def summarize_document(text: str, max_chars: int = 2000) -> str:
     """
@@ -165,8 +978,18 @@ def summarize_document(text: str, max_chars: int = 2000) -> str:
     summary = f"{beginning}\n\n[...middle section...]\n\n{middle}\n\n[...end section...]\n\n{end}"
     return summary
 
-def clear_document_cache():
+def clear_document_cache(include_disk: bool = False):
     """Clear the document cache (can be called periodically)."""
-    global document_cache
     document_cache.clear()
-    print("✓ Document cache cleared")
\ No newline at end of file
+    document_indexes.clear()
+    if include_disk and document_disk_cache is not None:
+        document_disk_cache.clear()
+    print("✓ Document cache cleared")
+
+def get_document_cache_stats() -> Dict:
+    """Hit/miss/eviction counters for every document cache tier."""
+    return {
+        "memory": document_cache.stats(),
+        "indexes": document_indexes.stats(),
+        "disk": document_disk_cache.stats() if document_disk_cache is not None else None
+    }
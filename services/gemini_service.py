@@ -2,10 +2,22 @@ import httpx
 import json
 import os
 import asyncio
-from dotenv import load_dotenv
-from typing import List, Dict, Optional
-
-load_dotenv()
+from typing import AsyncIterator, List, Dict, Optional
+from services.http_client import get_client
+from services.session_store import session_store
+from services.history_manager import (
+    split_history,
+    message_tokens,
+    format_for_summary,
+    history_stats,
+    SUMMARY_TRIGGER_TOKENS
+)
+from services.single_flight import gemini_flight
+from services.resilience import get_guard, UpstreamUnavailable
+from services.hedging import hedged_call, ProviderFailed, HEDGING_ENABLED
+from services.groq_service import get_groq_failover_response
+from services.image_service import prepare_image, parse_image_data
+from services.response_cache import make_key, fingerprint, get_cached_response, store_response
 
 # Strict XML-tagged system prompt to define the bot's persona and prevent hallucinations
 CODEKIVY_SYSTEM_PROMPT = """
@@ -40,63 +52,143 @@ If the user says "Hi", "Hello", or greets you, you MUST reply with this EXACT st
 </GREETING_TEMPLATE>
 """
 
-# Store chat history per session
-chat_histories: Dict[str, List[Dict]] = {}
+# Chat history lives in the shared per-session store (idle TTL + memory caps).
+# Once the history outgrows CHAT_HISTORY_TOKEN_BUDGET, the older turns are
+# folded into session.chat_summary by a background task. Until a fold has
+# absorbed them they are still sent verbatim, so no turn is ever in neither.
+
+SUMMARY_PROMPT = """You maintain a running summary of a tutoring chat between a student and KivyBot (CodeKivy's assistant).
+Update the summary with the new messages. Keep facts the student shared, their goals, questions asked,
+code/topics discussed and any answers they relied on. Be concise (under 150 words). Output only the summary."""
 
 def get_chat_history(session_id: str) -> List[Dict]:
-    """Retrieve chat history for a session."""
-    return chat_histories.get(session_id, [])
+    """
+    Chat history to send verbatim: every turn not yet folded into the
+    summary (folding trims the overflow back to the token budget).
+    """
+    session = session_store.get(session_id)
+    if not session:
+        return []
+    return list(session.chat_history)
+
+def get_chat_summary(session_id: str) -> str:
+    """Rolling summary of older turns that no longer fit the budget."""
+    session = session_store.get(session_id)
+    return session.chat_summary if session else ""
 
 def add_to_history(session_id: str, role: str, content: str):
     """Add a message to chat history."""
-    if session_id not in chat_histories:
-        chat_histories[session_id] = []
-    
-    chat_histories[session_id].append({
+    session = session_store.get_or_create(session_id)
+    session.chat_history.append({
         "role": role,
         "parts": [{"text": content}]
     })
     
-    # Keep only last 10 exchanges (20 messages) to avoid token limits
-    if len(chat_histories[session_id]) > 20:
-        chat_histories[session_id] = chat_histories[session_id][-20:]
+    # Re-accounts memory (and applies the hard history cap)
+    session_store.update(session)
+    
+    if role == "model":
+        schedule_history_compaction(session_id)
 
 def clear_chat_history(session_id: str):
     """Clear chat history for a session. (Required for Vercel main.py import)"""
-    if session_id in chat_histories:
-        chat_histories[session_id] = []
+    session = session_store.get(session_id)
+    if session:
+        session.chat_history = []
+        session.chat_summary = ""
+        session_store.update(session)
     return {"status": "success", "message": f"History cleared for session {session_id}."}
 
-async def get_gemini_response(
-    user_message: str, 
-    image_base64: Optional[str] = None,
-    session_id: str = "default",
-    use_history: bool = True
-):
-    """Get response from Gemini with chat history and deployment safety."""
+def schedule_history_compaction(session_id: str):
+    """Fold overflowing turns into the summary in the background, off the request path."""
+    session = session_store.get(session_id)
+    if session is None or (session.summary_task and not session.summary_task.done()):
+        return
+    split, overflow = split_history(session.chat_history)
+    if split == 0 or overflow < SUMMARY_TRIGGER_TOKENS:
+        return
+    try:
+        session.summary_task = asyncio.get_running_loop().create_task(
+            _fold_history(session_id, session.chat_history[:split])
+        )
+    except RuntimeError:
+        pass  # no running loop (sync caller); try again on the next turn
+
+async def _fold_history(session_id: str, older: List[Dict]):
+    summary = await summarize_history(get_chat_summary(session_id), older)
+    if summary is None:
+        history_stats["summary_failures"] += 1
+        return
     
-    # Securely fetch and clean the API key for deployment environments
-    raw_key = os.getenv("GEMINI_API_KEY", "")
-    api_key = raw_key.strip().replace('"', '').replace("'", "")
+    session = session_store.get(session_id)
+    # Only apply if those turns are still at the head of the history (not cleared meanwhile)
+    if session is None or session.chat_history[:len(older)] != older:
+        return
+    del session.chat_history[:len(older)]
+    session.chat_summary = summary
+    session_store.update(session)
+    
+    history_stats["summaries"] += 1
+    history_stats["messages_folded"] += len(older)
+    history_stats["tokens_folded"] += sum(message_tokens(m) for m in older)
+    print(f"🗜️ Folded {len(older)} messages into summary [Session: {session_id}]")
 
+async def summarize_history(previous_summary: str, messages: List[Dict]) -> Optional[str]:
+    """Ask Gemini for an updated rolling summary. Returns None on failure."""
+    api_key = _get_api_key()
     if not api_key:
-        return "System Error: GEMINI_API_KEY is missing from environment variables."
+        return None
+    
+    prompt = f"""Current summary:
+{previous_summary or "(none yet)"}
 
-    # Using Gemini 2.5 Flash on v1beta
-    model_name = "gemini-2.5-flash"
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={api_key}"
+New messages:
+{format_for_summary(messages)}"""
+    
+    payload = {
+        "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+        "systemInstruction": {"parts": [{"text": SUMMARY_PROMPT}]},
+        "generationConfig": {"temperature": 0.2, "maxOutputTokens": 300}
+    }
+    
+    try:
+        client = get_client("gemini")
+        response = await client.post(
+            f"/v1beta/models/{MODEL_NAME}:generateContent?key={api_key}",
+            headers={"Content-Type": "application/json"},
+            json=payload
+        )
+        if response.status_code != 200:
+            print(f"Summary API Error: Status {response.status_code}")
+            return None
+        candidates = response.json().get("candidates")
+        if not candidates:
+            return None
+        return candidates[0]["content"]["parts"][0]["text"].strip()
+    except Exception as e:
+        print(f"Summary exception: {e}")
+        return None
+
+MODEL_NAME = "gemini-2.5-flash"
+
+def _get_api_key() -> str:
+    # Securely fetch and clean the API key for deployment environments
+    raw_key = os.getenv("GEMINI_API_KEY", "")
+    return raw_key.strip().replace('"', '').replace("'", "")
 
+def build_gemini_payload(
+    user_message: str,
+    image_base64: Optional[str] = None,
+    session_id: str = "default",
+    use_history: bool = True
+) -> Dict:
+    """Build the generateContent payload (history + current message + image)."""
     # Build the current message parts
     current_parts = [{"text": user_message}]
 
     if image_base64:
         try:
-            if "," in image_base64:
-                header, image_data = image_base64.split(",", 1)
-                mime_type = header.split(":")[1].split(";")[0] if ":" in header else "image/jpeg"
-            else:
-                image_data = image_base64
-                mime_type = "image/jpeg"
+            mime_type, image_data = parse_image_data(image_base64)
             current_parts.append({
                 "inlineData": {
                     "mimeType": mime_type,
@@ -106,10 +198,14 @@ async def get_gemini_response(
         except Exception as e:
             print(f"Image parse error: {e}")
 
-    # Build contents array with history
+    # Build contents array with (token-budgeted) history
     contents = []
+    system_parts = [{"text": CODEKIVY_SYSTEM_PROMPT}]
     if use_history:
         contents.extend(get_chat_history(session_id))
+        summary = get_chat_summary(session_id)
+        if summary:
+            system_parts.append({"text": f"<CONVERSATION_SUMMARY>\n{summary}\n</CONVERSATION_SUMMARY>"})
     
     contents.append({
         "role": "user",
@@ -117,56 +213,245 @@ async def get_gemini_response(
     })
 
     # Construct the Payload
-    payload = {
+    return {
         "contents": contents,
         "systemInstruction": {
-            "parts": [{"text": CODEKIVY_SYSTEM_PROMPT}]
+            "parts": system_parts
         },
-        "generationConfig": {
-            "temperature": 0.3, # Strict adherence to CodeKivy rules
-            "topK": 40,
-            "topP": 0.95,
-            "maxOutputTokens": 1024,
-        }
+        "generationConfig": GENERATION_CONFIG
     }
 
+GENERATION_CONFIG = {
+    "temperature": 0.3, # Strict adherence to CodeKivy rules
+    "topK": 40,
+    "topP": 0.95,
+    "maxOutputTokens": 1024,
+}
+
+# Changes whenever the model, persona prompt or generation settings change,
+# so cached answers from an older configuration are never reused
+PROMPT_VERSION = fingerprint([MODEL_NAME, CODEKIVY_SYSTEM_PROMPT, GENERATION_CONFIG])
+
+def response_cache_key(
+    user_message: str,
+    image_base64: Optional[str] = None,
+    session_id: str = "default",
+    use_history: bool = True
+) -> Optional[str]:
+    """Response-cache key for a request, or None if it must not be cached (images)."""
+    if image_base64:
+        return None
+    history_context = None
+    if use_history:
+        history = get_chat_history(session_id)
+        summary = get_chat_summary(session_id)
+        if history or summary:
+            history_context = [summary, history]
+    return make_key("gemini", user_message, PROMPT_VERSION, history_context)
+
+def _http_error_message(status_code: int) -> str:
+    """Clean error text for the frontend."""
+    if status_code == 429:
+        return "KivyBot is a bit busy right now. Please wait a few seconds and try again! (Rate Limit)"
+    elif status_code == 400:
+        return "Sorry, there is an issue with the AI payload configuration. (Error 400)"
+    return f"Sorry, I'm having trouble connecting to the AI (HTTP {status_code})."
+
+async def _generate_text(url: str, payload: Dict) -> str:
+    """
+    One generateContent call. Returns the answer text or raises
+    ProviderFailed carrying the user-facing error message.
+    """
     try:
-        # 60s timeout allows for slow Vercel cold-starts
-        async with httpx.AsyncClient(timeout=60.0) as client:
-            response = await client.post(
+        # Shared pooled client (60s timeout allows for slow Vercel cold-starts).
+        # Identical concurrent payloads share one upstream call.
+        client = get_client("gemini")
+        # Rate limiting, retries with backoff and circuit breaking via the provider guard.
+        response = await gemini_flight.do(fingerprint(payload), lambda: get_guard("gemini").call(
+            lambda: client.post(
                 url,
                 headers={"Content-Type": "application/json"},
                 json=payload
             )
+        ))
+    except UpstreamUnavailable as e:
+        print(f"Gemini short-circuited: {e.reason}")
+        raise ProviderFailed(_http_error_message(429))
+    except httpx.ConnectTimeout:
+        raise ProviderFailed("Connection Timeout: The server took too long to reach the AI.")
+    except httpx.ConnectError:
+        raise ProviderFailed("Connection Error: Unable to reach the AI servers from the backend.")
 
-            # Clean error handling for the frontend
-            if response.status_code != 200:
-                print(f"API Error Log: Status {response.status_code} - {response.text[:200]}")
-                if response.status_code == 429:
-                    return "KivyBot is a bit busy right now. Please wait a few seconds and try again! (Rate Limit)"
-                elif response.status_code == 400:
-                    return "Sorry, there is an issue with the AI payload configuration. (Error 400)"
-                return f"Sorry, I'm having trouble connecting to the AI (HTTP {response.status_code})."
-
-            result = response.json()
-            
-            # Guard against safety filter blocking
-            if not result.get('candidates'):
-                return "Sorry, I couldn't generate a response to that request."
-                
-            text = result['candidates'][0]['content']['parts'][0]['text']
-
-            # Store in history
+    # Clean error handling for the frontend
+    if response.status_code != 200:
+        print(f"API Error Log: Status {response.status_code} - {response.text[:200]}")
+        raise ProviderFailed(_http_error_message(response.status_code))
+
+    result = response.json()
+    
+    # Guard against safety filter blocking (not something to fail over on)
+    if not result.get('candidates'):
+        raise ProviderFailed("Sorry, I couldn't generate a response to that request.", failover=False)
+        
+    return result['candidates'][0]['content']['parts'][0]['text']
+
+async def get_gemini_response(
+    user_message: str, 
+    image_base64: Optional[str] = None,
+    session_id: str = "default",
+    use_history: bool = True,
+    hedge: bool = False
+):
+    """
+    Get response from Gemini with chat history and deployment safety.
+    
+    With hedge=True (and CHAT_HEDGING=1), a slow or failing Gemini call is
+    raced against Groq answering the same conversation; image requests are
+    never hedged.
+    """
+    
+    api_key = _get_api_key()
+
+    if not api_key:
+        return "System Error: GEMINI_API_KEY is missing from environment variables."
+
+    # Repeated questions (same prompt + history) are answered from cache
+    cache_key = response_cache_key(user_message, image_base64, session_id, use_history)
+    if cache_key:
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            print("⚡ Response cache hit")
             if use_history:
                 add_to_history(session_id, "user", user_message)
-                add_to_history(session_id, "model", text)
+                add_to_history(session_id, "model", cached)
+            return cached
 
-            return text
+    # Downscaled/recompressed in the worker pool (cached by content hash)
+    if image_base64:
+        image_base64 = await prepare_image(image_base64)
 
-    except httpx.ConnectTimeout:
-        return "Connection Timeout: The server took too long to reach the AI."
-    except httpx.ConnectError:
-        return "Connection Error: Unable to reach the AI servers from the backend."
+    # Using Gemini 2.5 Flash on v1beta
+    url = f"/v1beta/models/{MODEL_NAME}:generateContent?key={api_key}"
+
+    payload = build_gemini_payload(user_message, image_base64, session_id, use_history)
+
+    try:
+        if hedge and HEDGING_ENABLED and not image_base64 and os.getenv("GROQ_API_KEY"):
+            text, winner = await hedged_call(
+                lambda: _generate_text(url, payload),
+                lambda: get_groq_failover_response(payload)
+            )
+        else:
+            text, winner = await _generate_text(url, payload), "gemini"
+
+        # A Groq answer that won the hedge is not cached as Gemini's, so the
+        # next hit goes back to Gemini
+        if cache_key and winner == "gemini":
+            store_response(cache_key, text)
+
+        # Store in history
+        if use_history:
+            add_to_history(session_id, "user", user_message)
+            add_to_history(session_id, "model", text)
+
+        return text
+
+    except ProviderFailed as e:
+        return e.message
     except Exception as e:
         print(f"System Exception: {e}") 
         return "Sorry, something went wrong on my end."
+
+async def stream_gemini_response(
+    user_message: str,
+    image_base64: Optional[str] = None,
+    session_id: str = "default",
+    use_history: bool = True
+) -> AsyncIterator[str]:
+    """
+    Stream a Gemini answer token-by-token via streamGenerateContent (SSE).
+    
+    Whatever text was produced is appended to the session history when the
+    stream completes, fails or is closed early (client disconnect).
+    """
+    api_key = _get_api_key()
+
+    if not api_key:
+        yield "System Error: GEMINI_API_KEY is missing from environment variables."
+        return
+
+    text_parts: List[str] = []
+    completed = False
+    cache_key = response_cache_key(user_message, image_base64, session_id, use_history)
+    if cache_key:
+        cached = get_cached_response(cache_key)
+        if cached is not None:
+            print("⚡ Response cache hit")
+            if use_history:
+                add_to_history(session_id, "user", user_message)
+                add_to_history(session_id, "model", cached)
+            yield cached
+            return
+
+    if image_base64:
+        image_base64 = await prepare_image(image_base64)
+
+    url = f"/v1beta/models/{MODEL_NAME}:streamGenerateContent?alt=sse&key={api_key}"
+    payload = build_gemini_payload(user_message, image_base64, session_id, use_history)
+
+    try:
+        client = get_client("gemini")
+        response = await get_guard("gemini").open_stream(
+            client,
+            "POST",
+            url,
+            headers={"Content-Type": "application/json"},
+            json=payload
+        )
+        try:
+            if response.status_code != 200:
+                body = await response.aread()
+                print(f"API Error Log: Status {response.status_code} - {body[:200]!r}")
+                yield _http_error_message(response.status_code)
+                return
+
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                try:
+                    chunk = json.loads(line[5:].strip())
+                except json.JSONDecodeError:
+                    continue
+                candidates = chunk.get("candidates") or []
+                if not candidates:
+                    continue
+                for part in candidates[0].get("content", {}).get("parts", []):
+                    token = part.get("text")
+                    if token:
+                        text_parts.append(token)
+                        yield token
+            completed = True
+        finally:
+            await response.aclose()
+
+        if not text_parts:
+            yield "Sorry, I couldn't generate a response to that request."
+
+    except UpstreamUnavailable as e:
+        print(f"Gemini short-circuited: {e.reason}")
+        yield _http_error_message(429)
+    except httpx.ConnectTimeout:
+        yield "Connection Timeout: The server took too long to reach the AI."
+    except httpx.ConnectError:
+        yield "Connection Error: Unable to reach the AI servers from the backend."
+    except Exception as e:
+        print(f"System Exception: {e}")
+        yield "Sorry, something went wrong on my end."
+    finally:
+        # Only complete answers are cached; partial ones still go to history
+        if cache_key and completed and text_parts:
+            store_response(cache_key, "".join(text_parts))
+        # Store whatever was generated, even if the client went away mid-stream
+        if use_history and text_parts:
+            add_to_history(session_id, "user", user_message)
+            add_to_history(session_id, "model", "".join(text_parts))
@@ -1,9 +1,12 @@
 import httpx
 import json
 import os
-from dotenv import load_dotenv
-
-load_dotenv()
+import re
+from typing import AsyncIterator, List, Optional
+from services.http_client import get_client
+from services.single_flight import groq_flight
+from services.resilience import get_guard, UpstreamUnavailable
+from services.response_cache import make_key, fingerprint, get_cached_response, store_response
 
 # System prompt for general chat
 CODEKIVY_CHAT_PROMPT = """You are "KivyBot," the official assistant for CodeKivy.
@@ -58,25 +61,14 @@ If user wants to know anything about codekiwi, here are the details that you hav
 Keep it brief and clear for voice."""
 
 
-async def get_groq_response(user_message: str, document_context: str = None) -> str:
-    """
-    Get ultra-fast response from Groq API.
-    Supports both regular chat and document-based questions.
-    
-    Args:
-        user_message: The user's question
-        document_context: Optional document text for context
-    
-    Returns:
-        AI response text
-    """
-    api_key = os.getenv("GROQ_API_KEY", "")
-    
-    if not api_key:
-        return "Sorry, Groq API key is not configured."
-    
-    url = "https://api.groq.com/openai/v1/chat/completions"
-    
+GROQ_CHAT_URL = "/openai/v1/chat/completions"
+GROQ_MODEL = "llama-3.3-70b-versatile"
+
+# Response-cache namespace for the chat/document prompts and model
+PROMPT_VERSION = fingerprint([GROQ_MODEL, CODEKIVY_CHAT_PROMPT, CODEKIVY_DOCUMENT_PROMPT])
+
+def build_groq_payload(user_message: str, document_context: str = None, stream: bool = False) -> dict:
+    """Build the chat-completions payload for regular chat or document Q&A."""
     # Choose system prompt based on context
     if document_context:
         system_prompt = CODEKIVY_DOCUMENT_PROMPT
@@ -93,8 +85,8 @@ Please answer based ONLY on the document content above."""
         enhanced_message = user_message
         max_tokens = 300
     
-    payload = {
-        "model": "llama-3.3-70b-versatile",  # Fast and accurate
+    return {
+        "model": GROQ_MODEL,  # Fast and accurate
         "messages": [
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": enhanced_message}
@@ -102,8 +94,63 @@ Please answer based ONLY on the document content above."""
         "temperature": 0.3,  # Lower temperature for more accurate document analysis
         "max_tokens": max_tokens,
         "top_p": 0.9,
-        "stream": False
+        "stream": stream
     }
+
+def _http_error_message(status_code: int) -> str:
+    if status_code == 401:
+        return "Sorry, there's an issue with the API key."
+    elif status_code == 429:
+        return "Sorry, too many requests. Please wait a moment and try again."
+    return f"Sorry, I'm having trouble connecting (Error: {status_code})."
+
+async def complete_chat(payload: dict, headers: dict, timeout: Optional[float] = None) -> str:
+    """
+    POST a non-streaming chat completion and return the answer text.
+    
+    Raises httpx.HTTPStatusError / UpstreamUnavailable / transport errors;
+    callers turn those into user-facing messages.
+    """
+    request_kwargs = {"headers": headers, "json": payload}
+    if timeout is not None:
+        request_kwargs["timeout"] = timeout
+    
+    # Identical concurrent payloads share one upstream call; the guard adds
+    # rate limiting, retries with backoff and circuit breaking
+    client = get_client("groq")
+    response = await groq_flight.do(fingerprint(payload), lambda: get_guard("groq").call(
+        lambda: client.post(GROQ_CHAT_URL, **request_kwargs)
+    ))
+    
+    response.raise_for_status()
+    result = response.json()
+    return result["choices"][0]["message"]["content"].strip()
+
+async def get_groq_response(user_message: str, document_context: str = None) -> str:
+    """
+    Get ultra-fast response from Groq API.
+    Supports both regular chat and document-based questions.
+    
+    Args:
+        user_message: The user's question
+        document_context: Optional document text for context
+    
+    Returns:
+        AI response text
+    """
+    api_key = os.getenv("GROQ_API_KEY", "")
+    
+    if not api_key:
+        return "Sorry, Groq API key is not configured."
+    
+    # Repeated questions about the same document context are answered from cache
+    cache_key = make_key("groq", user_message, PROMPT_VERSION, document_context)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        print("⚡ Response cache hit")
+        return cached
+    
+    payload = build_groq_payload(user_message, document_context)
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -111,59 +158,182 @@ Please answer based ONLY on the document content above."""
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=15.0  # Groq is fast, but allow extra time for document analysis
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            text = result["choices"][0]["message"]["content"]
-            return text.strip()
-            
+        text = await complete_chat(payload, headers)
+        store_response(cache_key, text)
+        return text
+        
+    except UpstreamUnavailable as e:
+        print(f"Groq {e.reason}")
+        return _http_error_message(429)
     except httpx.HTTPStatusError as e:
         print(f"Groq HTTP error: {e}")
-        if e.response.status_code == 401:
-            return "Sorry, there's an issue with the API key."
-        elif e.response.status_code == 429:
-            return "Sorry, too many requests. Please wait a moment and try again."
-        return f"Sorry, I'm having trouble connecting (Error: {e.response.status_code})."
+        return _http_error_message(e.response.status_code)
     except Exception as e:
         print(f"Groq error: {e}")
         return "Sorry, something went wrong on my end."
 
-async def get_groq_voice_response(messages_list: list) -> str:
+async def stream_chat_completion(payload: dict, timeout: Optional[float] = None) -> AsyncIterator[str]:
     """
-    Optimized for voice - shorter responses.
-    Now accepts a full message history list.
+    Stream content deltas from Groq's chat-completions endpoint ("stream": true).
+    
+    Yields text tokens as they arrive. Errors are yielded as a single
+    apology string, matching the non-streaming functions.
     """
     api_key = os.getenv("GROQ_API_KEY", "")
     
     if not api_key:
-        return "Sorry, Groq API key is not configured."
+        yield "Sorry, Groq API key is not configured."
+        return
+    
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    request_kwargs = {"headers": headers, "json": dict(payload, stream=True)}
+    if timeout is not None:
+        request_kwargs["timeout"] = timeout
+    
+    try:
+        client = get_client("groq")
+        response = await get_guard("groq").open_stream(client, "POST", GROQ_CHAT_URL, **request_kwargs)
+        try:
+            if response.status_code != 200:
+                body = await response.aread()
+                print(f"Groq HTTP error: {response.status_code} - {body[:200]!r}")
+                yield _http_error_message(response.status_code)
+                return
+            
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    chunk = json.loads(data)
+                except json.JSONDecodeError:
+                    continue
+                choices = chunk.get("choices") or []
+                if not choices:
+                    continue
+                token = choices[0].get("delta", {}).get("content")
+                if token:
+                    yield token
+        finally:
+            await response.aclose()
+    
+    except UpstreamUnavailable as e:
+        print(f"Groq {e.reason}")
+        yield _http_error_message(429)
+    except Exception as e:
+        print(f"Groq stream error: {e}")
+        yield "Sorry, something went wrong on my end."
+
+async def stream_groq_response(user_message: str, document_context: str = None) -> AsyncIterator[str]:
+    """Streaming variant of get_groq_response."""
+    payload = build_groq_payload(user_message, document_context, stream=True)
+    async for token in stream_chat_completion(payload):
+        yield token
+
+# --- SEVERAL DOCUMENT QUESTIONS IN ONE CALL ---
+
+# Each answer starts on its own line with this label
+ANSWER_LABEL = re.compile(r"^\s*\[Answer (\d+)\]\s*", re.MULTILINE)
+
+def build_groq_multi_payload(questions: List[str], document_context: str) -> dict:
+    """Document Q&A payload asking several questions against one shared context."""
+    numbered = "\n".join(f"{i}. {question}" for i, question in enumerate(questions, 1))
+    labels = ", ".join(f"[Answer {i}]" for i in range(1, len(questions) + 1))
+    payload = build_groq_payload(f"""{numbered}
+
+Answer each numbered question separately. Start each answer on its own line with its label ({labels}) and nothing before the first label.""", document_context)
+    payload["max_tokens"] = min(400 * len(questions), 2000)
+    return payload
+
+def split_multi_answers(text: str, count: int) -> Optional[List[str]]:
+    """Answers in question order, or None if the reply doesn't follow the labels."""
+    matches = list(ANSWER_LABEL.finditer(text))
+    answers = {}
+    for match, following in zip(matches, matches[1:] + [None]):
+        end = following.start() if following else len(text)
+        answers[int(match.group(1))] = text[match.end():end].strip()
+    if sorted(answers) != list(range(1, count + 1)) or not all(answers.values()):
+        return None
+    return [answers[i] for i in range(1, count + 1)]
+
+async def get_groq_multi_response(questions: List[str], document_context: str) -> Optional[List[str]]:
+    """
+    Answer several questions about the same document context in one Groq call.
+    
+    Returns one answer per question (the same apology for all of them if the
+    call fails), or None if the reply couldn't be split into answers and the
+    questions should be asked one by one instead.
+    """
+    api_key = os.getenv("GROQ_API_KEY", "")
+    
+    if not api_key:
+        return ["Sorry, Groq API key is not configured."] * len(questions)
     
-    url = "https://api.groq.com/openai/v1/chat/completions"
+    cache_key = make_key("groq-multi", "\n".join(questions), PROMPT_VERSION, document_context)
+    cached = get_cached_response(cache_key)
+    if cached is not None:
+        print("⚡ Response cache hit")
+        return split_multi_answers(cached, len(questions))
     
-    # --- MODIFIED PART ---
-    # We now prepend the system prompt to the incoming message list
+    payload = build_groq_multi_payload(questions, document_context)
+    
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    
+    try:
+        text = await complete_chat(payload, headers)
+    except UpstreamUnavailable as e:
+        print(f"Groq {e.reason}")
+        return [_http_error_message(429)] * len(questions)
+    except httpx.HTTPStatusError as e:
+        print(f"Groq HTTP error: {e}")
+        return [_http_error_message(e.response.status_code)] * len(questions)
+    except Exception as e:
+        print(f"Groq error: {e}")
+        return ["Sorry, something went wrong on my end."] * len(questions)
+    
+    answers = split_multi_answers(text, len(questions))
+    if answers is None:
+        print(f"⚠️ Groq multi-answer reply not in the expected format ({len(questions)} questions)")
+        return None
+    store_response(cache_key, text)
+    return answers
+
+def build_groq_voice_payload(messages_list: list, stream: bool = False) -> dict:
+    """Voice payload: system prompt followed by the caller's message history."""
+    # We prepend the system prompt to the incoming message list
     # to create the final payload for the API.
     all_messages = [
         {"role": "system", "content": CODEKIVY_VOICE_PROMPT}
     ] + messages_list  # Add the entire history after the system prompt
-    # --- END MODIFIED PART ---
 
-    payload = {
-        "model": "llama-3.3-70b-versatile",
+    return {
+        "model": GROQ_MODEL,
         "messages": all_messages,  # Pass the combined list
         "temperature": 0.7,
         "max_tokens": 150,  # Very short for voice
         "top_p": 1,
-        "stream": False
+        "stream": stream
     }
+
+async def get_groq_voice_response(messages_list: list) -> str:
+    """
+    Optimized for voice - shorter responses.
+    Now accepts a full message history list.
+    """
+    api_key = os.getenv("GROQ_API_KEY", "")
+    
+    if not api_key:
+        return "Sorry, Groq API key is not configured."
+    
+    payload = build_groq_voice_payload(messages_list)
     
     headers = {
         "Authorization": f"Bearer {api_key}",
@@ -171,20 +341,61 @@ async def get_groq_voice_response(messages_list: list) -> str:
     }
     
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=10.0
-            )
-            
-            response.raise_for_status()
-            result = response.json()
-            
-            text = result["choices"][0]["message"]["content"]
-            return text.strip()
-            
+        # Tighter than the pool default for voice turns
+        return await complete_chat(payload, headers, timeout=10.0)
+        
+    except UpstreamUnavailable as e:
+        print(f"Groq {e.reason}")
+        return _http_error_message(429)
     except Exception as e:
         print(f"Groq voice error: {e}")
         return "Sorry, something went wrong."
+
+async def stream_groq_voice_response(messages_list: list) -> AsyncIterator[str]:
+    """Streaming variant of get_groq_voice_response for the pipelined voice mode."""
+    payload = build_groq_voice_payload(messages_list, stream=True)
+    async for token in stream_chat_completion(payload, timeout=10.0):
+        yield token
+
+def build_groq_payload_from_gemini(gemini_payload: dict) -> dict:
+    """
+    Translate a Gemini generateContent payload (systemInstruction + "parts"
+    history) into an OpenAI-style Groq payload, so Groq can answer the same
+    conversation. Only text parts are carried over.
+    """
+    system_parts = gemini_payload.get("systemInstruction", {}).get("parts", [])
+    system_text = "\n\n".join(part["text"] for part in system_parts if "text" in part)
+    messages = [{"role": "system", "content": system_text}] if system_text else []
+    
+    for message in gemini_payload.get("contents", []):
+        text = "\n".join(part["text"] for part in message.get("parts", []) if "text" in part)
+        if not text:
+            continue
+        role = "assistant" if message.get("role") == "model" else "user"
+        messages.append({"role": role, "content": text})
+    
+    config = gemini_payload.get("generationConfig", {})
+    return {
+        "model": GROQ_MODEL,
+        "messages": messages,
+        "temperature": config.get("temperature", 0.7),
+        "max_tokens": config.get("maxOutputTokens", 1024),
+        "top_p": config.get("topP", 1),
+        "stream": False
+    }
+
+async def get_groq_failover_response(gemini_payload: dict) -> str:
+    """
+    Answer a Gemini chat request with Groq (the hedge/failover leg).
+    Raises on any failure so the hedging policy can keep Gemini's error.
+    """
+    api_key = os.getenv("GROQ_API_KEY", "")
+    
+    if not api_key:
+        raise RuntimeError("GROQ_API_KEY is not configured")
+    
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json"
+    }
+    return await complete_chat(build_groq_payload_from_gemini(gemini_payload), headers)
@@ -0,0 +1,161 @@
+import os
+import time
+import asyncio
+from collections import deque
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+# --- HEDGED REQUESTS / CROSS-PROVIDER FAILOVER ---
+# Gemini's slow tail dominates chat p99. With hedging on, if Gemini hasn't
+# answered by a percentile of its own recent latencies, the same conversation
+# is sent to Groq as well; whichever answers first wins and the other request
+# is cancelled. A Gemini failure before the deadline fails over immediately.
+
+HEDGING_ENABLED = os.getenv("CHAT_HEDGING", "0") == "1"
+HEDGE_PERCENTILE = float(os.getenv("CHAT_HEDGE_PERCENTILE", "0.95"))
+HEDGE_DEFAULT_DELAY = float(os.getenv("CHAT_HEDGE_DEFAULT_DELAY", "3.0"))  # until we have samples
+HEDGE_MIN_DELAY = float(os.getenv("CHAT_HEDGE_MIN_DELAY", "1.0"))
+HEDGE_MAX_DELAY = float(os.getenv("CHAT_HEDGE_MAX_DELAY", "8.0"))
+
+LATENCY_WINDOW = 200
+MIN_SAMPLES = 20
+
+
+class ProviderFailed(Exception):
+    """A hedged leg finished without a usable answer.
+
+    `message` is the user-facing text to return if no other leg succeeds;
+    `failover` is False for answers another provider shouldn't override
+    (e.g. a safety block).
+    """
+
+    def __init__(self, message: str, failover: bool = True):
+        super().__init__(message)
+        self.message = message
+        self.failover = failover
+
+
+class LatencyTracker:
+    """Rolling window of recent primary-provider latencies."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def hedge_delay(self) -> float:
+        """How long to wait for the primary before launching the hedge."""
+        if len(self.samples) < MIN_SAMPLES:
+            return HEDGE_DEFAULT_DELAY
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, self.percentile(HEDGE_PERCENTILE)))
+
+
+gemini_latency = LatencyTracker()
+
+hedge_stats: Dict[str, int] = {
+    "requests": 0,
+    "hedged": 0,  # backup launched because the deadline passed
+    "failovers": 0,  # backup launched because the primary failed
+    "gemini_wins": 0,
+    "groq_wins": 0,
+    "both_failed": 0,
+}
+
+
+async def _cancel(task: Optional[asyncio.Task]):
+    if task is None or task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+
+async def hedged_call(
+    primary: Callable[[], Awaitable[str]],
+    backup: Callable[[], Awaitable[str]],
+    primary_name: str = "gemini",
+    backup_name: str = "groq"
+) -> Tuple[str, str]:
+    """
+    Race primary() against a delayed backup() and return (text, winner).
+
+    Both callables must return the answer text or raise ProviderFailed (any
+    other exception counts as a failed leg too). If every leg fails, the
+    primary's ProviderFailed is re-raised so callers keep its error message.
+    """
+    hedge_stats["requests"] += 1
+    started = time.monotonic()
+    primary_task = asyncio.ensure_future(primary())
+    backup_task: Optional[asyncio.Task] = None
+    primary_error: Optional[BaseException] = None
+
+    try:
+        done, _ = await asyncio.wait({primary_task}, timeout=gemini_latency.hedge_delay())
+        if done:
+            gemini_latency.record(time.monotonic() - started)
+            try:
+                text = primary_task.result()
+                hedge_stats[f"{primary_name}_wins"] += 1
+                return text, primary_name
+            except Exception as e:
+                primary_error = e
+                if isinstance(e, ProviderFailed) and not e.failover:
+                    raise
+            hedge_stats["failovers"] += 1
+            print(f"🔀 {primary_name} failed ({primary_error}); failing over to {backup_name}")
+        else:
+            hedge_stats["hedged"] += 1
+            print(f"🔀 {primary_name} slow (> {time.monotonic() - started:.2f}s); hedging with {backup_name}")
+
+        backup_task = asyncio.ensure_future(backup())
+        pending = {backup_task} if primary_task.done() else {primary_task, backup_task}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                name = primary_name if task is primary_task else backup_name
+                if task is primary_task:
+                    gemini_latency.record(time.monotonic() - started)
+                try:
+                    text = task.result()
+                except Exception as e:
+                    print(f"⚠️ Hedged {name} leg failed: {e}")
+                    if task is primary_task:
+                        primary_error = e
+                    continue
+                hedge_stats[f"{name}_wins"] += 1
+                print(f"🏁 {name} won after {time.monotonic() - started:.2f}s")
+                return text, name
+
+        hedge_stats["both_failed"] += 1
+        if isinstance(primary_error, ProviderFailed):
+            raise primary_error
+        raise ProviderFailed("Sorry, something went wrong on my end.")
+
+    finally:
+        # Cancel whichever leg lost (or both, if our caller went away)
+        if not primary_task.done():
+            # Censored sample: Gemini took at least this long
+            gemini_latency.record(time.monotonic() - started)
+        await _cancel(primary_task)
+        await _cancel(backup_task)
+
+
+def get_hedging_stats() -> Dict:
+    p50 = gemini_latency.percentile(0.5)
+    p95 = gemini_latency.percentile(0.95)
+    return {
+        "enabled": HEDGING_ENABLED,
+        **hedge_stats,
+        "hedge_delay": round(gemini_latency.hedge_delay(), 3),
+        "gemini_p50": round(p50, 3) if p50 is not None else None,
+        "gemini_p95": round(p95, 3) if p95 is not None else None,
+        "samples": len(gemini_latency.samples),
+    }
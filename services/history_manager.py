@@ -0,0 +1,77 @@
+import os
+from typing import Dict, List, Tuple
+
+# --- TOKEN-BUDGETED CHAT HISTORY ---
+# Recent turns are sent verbatim up to a token budget; anything older is folded
+# into a rolling summary (generated off the request path by gemini_service).
+# Overflowing turns stay in the history, and in the prompt, until a fold has
+# moved them into the summary.
+
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "2000"))
+
+# Only start a summarization once this many tokens have overflowed the budget,
+# so we don't pay an extra Gemini call for every single turn (the overflow is
+# sent verbatim meanwhile)
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("CHAT_SUMMARY_TRIGGER_TOKENS", "600"))
+
+CHARS_PER_TOKEN = 4  # rough estimate for English/code text
+IMAGE_TOKENS = 258  # Gemini's fixed cost per inline image
+
+history_stats: Dict[str, int] = {
+    "summaries": 0,
+    "summary_failures": 0,
+    "messages_folded": 0,
+    "tokens_folded": 0,
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (no tokenizer dependency)."""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def message_tokens(message: Dict) -> int:
+    """Estimated tokens for one Gemini "contents" message."""
+    tokens = 4  # role/turn framing
+    for part in message.get("parts", ()):
+        if "text" in part:
+            tokens += estimate_tokens(part["text"])
+        elif "inlineData" in part:
+            tokens += IMAGE_TOKENS
+    return tokens
+
+
+def split_history(history: List[Dict], budget: int = CHAT_HISTORY_TOKEN_BUDGET) -> Tuple[int, int]:
+    """
+    Find how much of the history fits in the token budget, newest first.
+
+    The verbatim window always starts on a "user" turn so Gemini sees whole
+    exchanges, and always includes at least the latest exchange.
+
+    Returns:
+        (split_index, overflow_tokens) - history[split_index:] is sent
+        verbatim; history[:split_index] (overflow_tokens in total) should be
+        folded into the summary.
+    """
+    used = 0
+    split = len(history)
+    for i in range(len(history) - 1, -1, -1):
+        used += message_tokens(history[i])
+        if used > budget and split < len(history):
+            break
+        if history[i].get("role") == "user":
+            split = i
+    if split == len(history):
+        split = 0  # no user turn found; keep everything
+    overflow = sum(message_tokens(m) for m in history[:split])
+    return split, overflow
+
+
+def format_for_summary(messages: List[Dict]) -> str:
+    """Render Gemini messages as a plain transcript for the summarizer."""
+    lines = []
+    for message in messages:
+        speaker = "Student" if message.get("role") == "user" else "KivyBot"
+        text = " ".join(part.get("text", "[image]") for part in message.get("parts", ()))
+        lines.append(f"{speaker}: {text}")
+    return "\n".join(lines)
@@ -0,0 +1,239 @@
+import os
+import time
+import httpx
+from typing import Callable, Dict
+
+from services.metrics import upstream_duration, upstream_in_flight, upstream_request_size, upstream_response_size
+
+# --- SHARED UPSTREAM HTTP CLIENTS ---
+# One pooled httpx.AsyncClient per provider for the whole app lifetime, so warm
+# requests reuse open keep-alive connections instead of paying DNS + TCP + TLS
+# on every call. Created in the FastAPI lifespan (main.py) and lazily on first
+# use for environments where lifespan events don't run.
+
+try:
+    import h2  # noqa: F401  (enables HTTP/2 in httpx when installed)
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+def _env_float(name: str, default: float) -> float:
+    try:
+        return float(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+def _env_int(name: str, default: int) -> int:
+    try:
+        return int(os.getenv(name, default))
+    except ValueError:
+        return default
+
+
+# Per-provider settings. Override with e.g. GEMINI_MAX_CONNECTIONS=50,
+# GROQ_TIMEOUT=20, DEEPGRAM_KEEPALIVE_EXPIRY=60.
+PROVIDERS: Dict[str, Dict] = {
+    "gemini": {
+        "base_url": "https://generativelanguage.googleapis.com",
+        "timeout": 60.0,  # allows for slow Vercel cold-starts
+        "max_connections": 20,
+        "max_keepalive": 10,
+        "http2": True,
+    },
+    "groq": {
+        "base_url": "https://api.groq.com",
+        "timeout": 15.0,
+        "max_connections": 20,
+        "max_keepalive": 10,
+        "http2": True,
+    },
+    "deepgram": {
+        "base_url": "https://api.deepgram.com",
+        "timeout": 20.0,
+        "max_connections": 20,
+        "max_keepalive": 10,
+        "http2": False,  # Deepgram streams large audio bodies; HTTP/1.1 is fine
+    },
+}
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_stats: Dict[str, Dict] = {}
+
+
+def get_provider_config(provider: str) -> Dict:
+    """Resolve a provider's pool settings, applying environment overrides."""
+    base = PROVIDERS[provider]
+    prefix = provider.upper()
+    return {
+        "base_url": os.getenv(f"{prefix}_BASE_URL", base["base_url"]),
+        "timeout": _env_float(f"{prefix}_TIMEOUT", base["timeout"]),
+        "connect_timeout": _env_float(f"{prefix}_CONNECT_TIMEOUT", 10.0),
+        "max_connections": _env_int(f"{prefix}_MAX_CONNECTIONS", base["max_connections"]),
+        "max_keepalive": _env_int(f"{prefix}_MAX_KEEPALIVE", base["max_keepalive"]),
+        "keepalive_expiry": _env_float(f"{prefix}_KEEPALIVE_EXPIRY", 30.0),
+        "http2": base["http2"] and HTTP2_AVAILABLE,
+    }
+
+
+def _operation(request: httpx.Request) -> str:
+    """Low-cardinality operation label: generateContent, completions, listen, speak..."""
+    last = request.url.path.rstrip("/").rsplit("/", 1)[-1]
+    return last.rsplit(":", 1)[-1]
+
+
+class _TimedStream(httpx.AsyncByteStream):
+    """Response body wrapper that reports size and total time once closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close: Callable[[int], None]):
+        self._stream = stream
+        self._on_close = on_close
+        self._bytes = 0
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._bytes += len(chunk)
+            yield chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close(self._bytes)
+
+
+class _CountingTransport(httpx.AsyncHTTPTransport):
+    """Pooled transport that records per-provider request statistics."""
+
+    def __init__(self, provider: str, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        stats = _stats[self.provider]
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        operation = _operation(request)
+        upstream_in_flight.inc(self.provider)
+        upstream_request_size.observe(int(request.headers.get("content-length", 0)), self.provider, operation)
+        started = time.perf_counter()
+        try:
+            response = await super().handle_async_request(request)
+        except Exception:
+            stats["errors"] += 1
+            upstream_in_flight.dec(self.provider)
+            upstream_duration.observe(time.perf_counter() - started, self.provider, operation, "error")
+            raise
+        finally:
+            stats["in_flight"] -= 1
+            stats["total_latency_ms"] += (time.perf_counter() - started) * 1000
+        stats["last_status"] = response.status_code
+        if response.status_code >= 400:
+            stats["errors"] += 1
+
+        status = str(response.status_code)
+
+        def on_close(body_bytes: int):
+            upstream_in_flight.dec(self.provider)
+            upstream_duration.observe(time.perf_counter() - started, self.provider, operation, status)
+            upstream_response_size.observe(body_bytes, self.provider, operation)
+
+        if response.is_closed:
+            on_close(len(response.content))  # body already in memory
+        else:
+            response.stream = _TimedStream(response.stream, on_close)
+        return response
+
+
+def _make_client(provider: str) -> httpx.AsyncClient:
+    config = get_provider_config(provider)
+    limits = httpx.Limits(
+        max_connections=config["max_connections"],
+        max_keepalive_connections=config["max_keepalive"],
+        keepalive_expiry=config["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(config["timeout"], connect=config["connect_timeout"])
+    _stats[provider] = {
+        "requests": 0,
+        "in_flight": 0,
+        "errors": 0,
+        "last_status": None,
+        "total_latency_ms": 0.0,
+        "created_at": time.time(),
+    }
+    transport = _CountingTransport(provider, limits=limits, http2=config["http2"])
+    return httpx.AsyncClient(
+        base_url=config["base_url"],
+        timeout=timeout,
+        transport=transport,
+    )
+
+
+def get_client(provider: str) -> httpx.AsyncClient:
+    """Return the shared client for a provider, creating it on first use."""
+    client = _clients.get(provider)
+    if client is None or client.is_closed:
+        client = _make_client(provider)
+        _clients[provider] = client
+    return client
+
+
+async def startup_clients():
+    """Open a pooled client for every provider (called from the app lifespan)."""
+    for provider in PROVIDERS:
+        get_client(provider)
+    print(f"✓ HTTP clients ready ({', '.join(PROVIDERS)}; http2={HTTP2_AVAILABLE})")
+
+
+async def shutdown_clients():
+    """Close all pooled clients and their connections."""
+    for provider, client in list(_clients.items()):
+        if not client.is_closed:
+            await client.aclose()
+    _clients.clear()
+    print("✓ HTTP clients closed")
+
+
+def _pool_connections(client: httpx.AsyncClient) -> Dict:
+    # httpx doesn't expose pool state publicly; read it from the transport's
+    # httpcore pool when available and degrade gracefully otherwise.
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = getattr(pool, "connections", None)
+    if connections is None:
+        return {}
+    idle = sum(1 for c in connections if c.is_idle())
+    return {
+        "open_connections": len(connections),
+        "idle_connections": idle,
+        "active_connections": len(connections) - idle,
+    }
+
+
+def get_pool_stats() -> Dict:
+    """Per-provider request counters and connection pool state for monitoring."""
+    result = {}
+    for provider in PROVIDERS:
+        config = get_provider_config(provider)
+        stats = dict(_stats.get(provider, {}))
+        completed = stats.get("requests", 0) - stats.get("in_flight", 0)
+        if completed:
+            stats["avg_latency_ms"] = round(stats["total_latency_ms"] / completed, 1)
+        stats.pop("total_latency_ms", None)
+        client = _clients.get(provider)
+        stats["open"] = client is not None and not client.is_closed
+        if stats["open"]:
+            stats.update(_pool_connections(client))
+        stats["limits"] = {
+            "max_connections": config["max_connections"],
+            "max_keepalive": config["max_keepalive"],
+            "keepalive_expiry": config["keepalive_expiry"],
+            "timeout": config["timeout"],
+            "http2": config["http2"],
+        }
+        result[provider] = stats
+    return result
@@ -0,0 +1,156 @@
+import io
+import os
+import base64
+import asyncio
+import hashlib
+import importlib.util
+from typing import Dict, Optional, Tuple
+
+from services.cache import LRUCache
+from services.document_service import get_extraction_pool
+from services.metrics import stage, payload_size
+from services.single_flight import image_flight
+
+# Pillow is only imported (in the worker) when the first image arrives
+PIL_AVAILABLE = importlib.util.find_spec("PIL") is not None
+
+# --- IMAGE PREPROCESSING FOR GEMINI VISION ---
+# Student screenshots arrive as full-resolution base64 PNGs. Gemini tiles
+# images at 768px, so anything far beyond that only adds upload time and
+# latency. Images are decoded in the worker pool, downscaled to
+# IMAGE_MAX_SIDE, re-encoded (WebP by default) and cached by content hash so
+# the same screenshot sent again is not processed twice.
+# Without Pillow installed, images are forwarded unchanged.
+
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1536"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "WEBP").upper()  # WEBP or JPEG
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_MAX_PIXELS = int(os.getenv("IMAGE_MAX_PIXELS", str(50_000_000)))  # decompression-bomb guard
+
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+IMAGE_CACHE_TTL = float(os.getenv("IMAGE_CACHE_TTL", "1800"))
+
+# Processed images as (mime_type, base64 data), keyed by a hash of the input
+image_cache = LRUCache(
+    IMAGE_CACHE_MAX_BYTES,
+    ttl=IMAGE_CACHE_TTL,
+    sizeof=lambda item: len(item[1]) + 100,
+    name="images"
+)
+
+image_stats: Dict[str, int] = {
+    "processed": 0,
+    "unchanged": 0,  # re-encoding wouldn't have made it smaller
+    "failed": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+}
+
+_MIME_TYPES = {"WEBP": "image/webp", "JPEG": "image/jpeg", "PNG": "image/png"}
+
+
+def parse_image_data(image_base64: str) -> Tuple[str, str]:
+    """Split a data URL (or bare base64) into (mime_type, base64 data)."""
+    if "," in image_base64:
+        header, image_data = image_base64.split(",", 1)
+        mime_type = header.split(":")[1].split(";")[0] if ":" in header else "image/jpeg"
+        return mime_type, image_data
+    return "image/jpeg", image_base64
+
+
+def _shrink_image(image_data: str, max_side: int, image_format: str, quality: int) -> Tuple[Optional[str], str, Tuple[int, int], int, int]:
+    """
+    Worker task: decode, downscale and re-encode one base64 image.
+    
+    Returns (new base64 data or None if it didn't get smaller, mime type of
+    the data to send, new size, bytes in, bytes out); raises if it can't be
+    decoded.
+    """
+    from PIL import Image, ImageOps
+
+    raw = base64.b64decode(image_data)
+    Image.MAX_IMAGE_PIXELS = IMAGE_MAX_PIXELS
+    with Image.open(io.BytesIO(raw)) as image:
+        original_mime = Image.MIME.get(image.format or "")
+        # JPEG can decode straight at a reduced scale, which is much cheaper
+        image.draft("RGB", (max_side, max_side))
+        image = ImageOps.exif_transpose(image)  # phone screenshots/photos may be rotated
+        image.thumbnail((max_side, max_side), Image.LANCZOS)
+
+        if image_format == "JPEG" or image.mode not in ("RGB", "RGBA", "L", "LA"):
+            has_alpha = image.mode in ("RGBA", "LA", "PA") or "transparency" in image.info
+            if image_format == "JPEG" and has_alpha:
+                rgba = image.convert("RGBA")
+                background = Image.new("RGB", image.size, "white")
+                background.paste(rgba, mask=rgba.split()[-1])
+                image = background
+            else:
+                image = image.convert("RGBA" if has_alpha else "RGB")
+
+        out = io.BytesIO()
+        if image_format == "WEBP":
+            image.save(out, "WEBP", quality=quality, method=4)
+        else:
+            image.save(out, image_format, quality=quality, optimize=True)
+        encoded = out.getvalue()
+
+    if len(encoded) >= len(raw):
+        # Keep the original bytes, but with their real type (bare base64 has none)
+        return None, original_mime, image.size, len(raw), len(raw)
+    return base64.b64encode(encoded).decode("ascii"), _MIME_TYPES.get(image_format, "image/jpeg"), image.size, len(raw), len(encoded)
+
+
+async def _process_image(key: str, mime_type: str, image_data: str) -> Tuple[str, str]:
+    """Shrink one image in the worker pool and cache the (mime_type, data) result."""
+    result = (mime_type, image_data)
+    try:
+        with stage("image_preprocess"):
+            loop = asyncio.get_running_loop()
+            shrunk, new_mime, size, bytes_in, bytes_out = await loop.run_in_executor(
+                get_extraction_pool(), _shrink_image, image_data, IMAGE_MAX_SIDE, IMAGE_FORMAT, IMAGE_QUALITY
+            )
+        image_stats["bytes_in"] += bytes_in
+        image_stats["bytes_out"] += bytes_out
+        if shrunk is not None:
+            result = (new_mime, shrunk)
+            image_stats["processed"] += 1
+            print(f"🖼️ Image {bytes_in} -> {bytes_out} bytes ({size[0]}x{size[1]} {new_mime})")
+        else:
+            result = (new_mime or mime_type, image_data)
+            image_stats["unchanged"] += 1
+        payload_size.observe(bytes_out, "image_processed")
+    except Exception as e:
+        # Unreadable/unsupported image: let Gemini decide what to do with it
+        image_stats["failed"] += 1
+        print(f"⚠️ Image preprocessing failed: {e}")
+
+    image_cache.set(key, result)
+    return result
+
+
+async def prepare_image(image_base64: str) -> str:
+    """
+    Return a data URL for the image as it should be sent to Gemini:
+    downscaled and recompressed when that makes it smaller, otherwise the
+    original. Results are cached by content hash, and the same image
+    arriving concurrently is only processed once.
+    """
+    mime_type, image_data = parse_image_data(image_base64)
+    if not PIL_AVAILABLE:
+        return f"data:{mime_type};base64,{image_data}"
+
+    key = hashlib.sha256(image_data.encode("ascii", "ignore")).hexdigest()
+    result = image_cache.get(key)
+    if result is None:
+        result = await image_flight.do(key, lambda: _process_image(key, mime_type, image_data))
+    return f"data:{result[0]};base64,{result[1]}"
+
+
+def get_image_stats() -> Dict:
+    return {
+        "enabled": PIL_AVAILABLE,
+        "max_side": IMAGE_MAX_SIDE,
+        "format": IMAGE_FORMAT,
+        **image_stats,
+        "cache": image_cache.stats(),
+    }
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import asyncio
+import importlib.util
+from typing import AsyncIterator, Dict, List, Optional
+from urllib.parse import urlencode
+
+from services.http_client import get_provider_config
+from services.resilience import get_guard
+
+# Imported on the first live connection rather than at startup
+WEBSOCKETS_AVAILABLE = importlib.util.find_spec("websockets") is not None
+
+# --- STREAMING SPEECH-TO-TEXT (DEEPGRAM LIVE) ---
+# Audio frames are relayed to Deepgram's live /v1/listen WebSocket while the
+# student is still talking. Deepgram endpoints the speech itself
+# (speech_final after VOICE_ENDPOINTING_MS of silence, or UtteranceEnd after
+# VOICE_UTTERANCE_END_MS without words), so the final transcript is ready
+# almost as soon as they stop - no upload or batch transcription.
+# The URL follows DEEPGRAM_BASE_URL, so the benchmark mock serves it too.
+
+LIVE_STT_MODEL = os.getenv("DEEPGRAM_LIVE_MODEL", "nova-2")
+ENDPOINTING_MS = int(os.getenv("VOICE_ENDPOINTING_MS", "300"))
+UTTERANCE_END_MS = int(os.getenv("VOICE_UTTERANCE_END_MS", "1000"))
+KEEPALIVE_INTERVAL = 5.0  # Deepgram closes idle streams after ~10s without audio
+
+# Audio format options a client may pass through (for raw PCM; containerized
+# audio such as webm/opus is detected automatically)
+AUDIO_PARAMS = ("encoding", "sample_rate", "channels", "language")
+
+
+def live_listen_url(audio_params: Optional[Dict[str, str]] = None) -> str:
+    base_url = get_provider_config("deepgram")["base_url"].rstrip("/")
+    if base_url.startswith("https://"):
+        ws_base = "wss://" + base_url[len("https://"):]
+    else:
+        ws_base = "ws://" + base_url[len("http://"):]
+    params = {
+        "model": LIVE_STT_MODEL,
+        "interim_results": "true",
+        "smart_format": "true",
+        "endpointing": ENDPOINTING_MS,
+        "utterance_end_ms": UTTERANCE_END_MS,
+        "vad_events": "true",
+    }
+    for name in AUDIO_PARAMS:
+        if audio_params and audio_params.get(name):
+            params[name] = audio_params[name]
+    return f"{ws_base}/v1/listen?{urlencode(params)}"
+
+
+class LiveTranscriber:
+    """
+    One live transcription stream.
+
+    send_audio() relays frames; events() yields
+        {"type": "partial", "text": ...}     interim text of the current utterance
+        {"type": "utterance", "text": ...}   end of utterance with its final text
+        {"type": "speech_started"}
+    until finish() closes the stream (or Deepgram does).
+    """
+
+    def __init__(self, audio_params: Optional[Dict[str, str]] = None):
+        self.url = live_listen_url(audio_params)
+        self._ws = None
+        self._keepalive: Optional[asyncio.Task] = None
+        self._last_sent = time.monotonic()
+        self._closing = False
+
+    async def connect(self):
+        if not WEBSOCKETS_AVAILABLE:
+            raise RuntimeError("websockets is not installed")
+        from websockets.asyncio.client import connect as ws_connect
+
+        api_key = os.getenv("DEEPGRAM_API_KEY")
+        if not api_key:
+            raise RuntimeError("DEEPGRAM_API_KEY not configured")
+
+        guard = get_guard("deepgram")
+        await guard.admit()
+        try:
+            self._ws = await ws_connect(
+                self.url,
+                additional_headers={"Authorization": f"Token {api_key}"},
+                max_size=None,
+                open_timeout=10
+            )
+        except Exception:
+            guard.record(None)
+            raise
+        guard.record(200)
+        self._keepalive = asyncio.create_task(self._keep_alive())
+
+    async def _keep_alive(self):
+        while True:
+            await asyncio.sleep(KEEPALIVE_INTERVAL)
+            if time.monotonic() - self._last_sent >= KEEPALIVE_INTERVAL:
+                await self._send_control("KeepAlive")
+
+    async def _send_control(self, message_type: str):
+        self._last_sent = time.monotonic()
+        await self._ws.send(json.dumps({"type": message_type}))
+
+    async def send_audio(self, chunk: bytes):
+        if chunk and not self._closing:
+            self._last_sent = time.monotonic()
+            await self._ws.send(chunk)
+
+    async def finalize(self):
+        """Flush the current utterance now (e.g. push-to-talk released)."""
+        if not self._closing:
+            await self._send_control("Finalize")
+
+    async def finish(self):
+        """Stop sending audio; Deepgram flushes its last results and closes."""
+        if self._closing or self._ws is None:
+            return
+        self._closing = True
+        if self._keepalive:
+            self._keepalive.cancel()
+        try:
+            await self._send_control("CloseStream")
+        except Exception:
+            pass
+
+    async def close(self):
+        await self.finish()
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def events(self) -> AsyncIterator[Dict]:
+        final_parts: List[str] = []
+
+        def utterance() -> Dict:
+            text = " ".join(final_parts)
+            final_parts.clear()
+            return {"type": "utterance", "text": text}
+
+        try:
+            async for message in self._ws:
+                if isinstance(message, bytes):
+                    continue
+                data = json.loads(message)
+                kind = data.get("type")
+
+                if kind == "Results":
+                    alternatives = data.get("channel", {}).get("alternatives") or [{}]
+                    text = alternatives[0].get("transcript", "").strip()
+                    if data.get("is_final"):
+                        if text:
+                            final_parts.append(text)
+                        if final_parts and (data.get("speech_final") or data.get("from_finalize")):
+                            yield utterance()
+                        elif text:
+                            yield {"type": "partial", "text": " ".join(final_parts)}
+                    elif text:
+                        yield {"type": "partial", "text": " ".join(final_parts + [text])}
+
+                elif kind == "UtteranceEnd":
+                    # Fallback end-of-utterance when noise kept speech_final from firing
+                    if final_parts:
+                        yield utterance()
+
+                elif kind == "SpeechStarted":
+                    yield {"type": "speech_started"}
+        except Exception as e:
+            if not self._closing:
+                print(f"❌ Live STT stream error: {e}")
+        finally:
+            if self._keepalive:
+                self._keepalive.cancel()
+
+        if final_parts:
+            yield utterance()
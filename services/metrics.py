@@ -0,0 +1,226 @@
+import time
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# --- PROMETHEUS METRICS ---
+# Minimal in-process registry rendered in the Prometheus text format at
+# /metrics (no client library needed). Observing is a dict lookup plus a
+# bisect, so it is cheap enough for every request and upstream call.
+#
+# Label values are passed positionally in the order of `labelnames`.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        _registry.append(self)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in list(self._values.items()):
+            lines.extend(self._render_series(labels, value))
+        return lines
+
+    def _render_series(self, labels: Tuple[str, ...], value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels: str):
+        self._values[labels] = value
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """Count the enclosed block as in flight."""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, *labels: str):
+        series = self._values.get(labels)
+        if series is None:
+            # [per-bucket counts..., +Inf count, sum]
+            series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        """Observe the enclosed block's wall time in seconds."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def _render_series(self, labels: Tuple[str, ...], series) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+            cumulative += count
+            le = f'le="{_format_value(float(bound))}"'
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+        label_text = _format_labels(self.labelnames, labels)
+        lines.append(f"{self.name}_sum{label_text} {_format_value(series[-1])}")
+        lines.append(f"{self.name}_count{label_text} {cumulative}")
+        return lines
+
+
+# --- REQUEST CONTEXT ---
+# The HTTP middleware opens a context per request; handlers and services fill
+# in labels (e.g. mode) and stage timings pick up the current endpoint.
+
+_request_labels: contextvars.ContextVar[Optional[Dict[str, str]]] = contextvars.ContextVar("request_labels", default=None)
+
+
+def start_request(endpoint: str) -> Dict[str, str]:
+    labels = {"endpoint": endpoint, "mode": "none"}
+    _request_labels.set(labels)
+    return labels
+
+
+def set_mode(mode: str):
+    """Label the current request's metrics with its mode (chat/image/document/...)."""
+    labels = _request_labels.get()
+    if labels is not None:
+        labels["mode"] = mode
+
+
+def current_endpoint() -> str:
+    labels = _request_labels.get()
+    return labels["endpoint"] if labels else "background"
+
+
+# --- METRICS ---
+
+http_request_duration = Histogram(
+    "kivybot_http_request_duration_seconds",
+    "Total request time including streamed bodies.",
+    ("endpoint", "mode", "status"),
+)
+http_requests_in_flight = Gauge(
+    "kivybot_http_requests_in_flight",
+    "Requests currently being handled.",
+    ("endpoint",),
+)
+http_request_size = Histogram(
+    "kivybot_http_request_size_bytes",
+    "Request body size (Content-Length).",
+    ("endpoint",),
+    buckets=SIZE_BUCKETS,
+)
+http_response_size = Histogram(
+    "kivybot_http_response_size_bytes",
+    "Response body size.",
+    ("endpoint", "mode"),
+    buckets=SIZE_BUCKETS,
+)
+stage_duration = Histogram(
+    "kivybot_stage_duration_seconds",
+    "Time spent in one processing stage of a request.",
+    ("stage", "endpoint"),
+)
+upstream_duration = Histogram(
+    "kivybot_upstream_request_duration_seconds",
+    "Upstream provider call time until the response body is fully read.",
+    ("provider", "operation", "status"),
+)
+upstream_in_flight = Gauge(
+    "kivybot_upstream_requests_in_flight",
+    "Upstream provider calls currently open.",
+    ("provider",),
+)
+upstream_request_size = Histogram(
+    "kivybot_upstream_request_size_bytes",
+    "Upstream request body size.",
+    ("provider", "operation"),
+    buckets=SIZE_BUCKETS,
+)
+upstream_response_size = Histogram(
+    "kivybot_upstream_response_size_bytes",
+    "Upstream response body size.",
+    ("provider", "operation"),
+    buckets=SIZE_BUCKETS,
+)
+payload_size = Histogram(
+    "kivybot_payload_size_bytes",
+    "Size of payloads moving through the pipeline (audio, documents, images).",
+    ("kind",),
+    buckets=SIZE_BUCKETS,
+)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    """Time one stage (stt, llm, tts, extract, ...) under the current endpoint."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe(time.perf_counter() - started, name, current_endpoint())
+
+
+def observe_stage(name: str, seconds: float):
+    stage_duration.observe(seconds, name, current_endpoint())
+
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
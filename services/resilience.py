@@ -0,0 +1,312 @@
+import os
+import time
+import random
+import asyncio
+import email.utils
+from typing import Awaitable, Callable, Dict, Optional
+
+import httpx
+
+# --- CLIENT-SIDE RATE LIMITING, RETRIES AND CIRCUIT BREAKING ---
+# Every upstream call goes through its provider's guard:
+#   1. token bucket sized to our quota, with a bounded waiting queue
+#   2. circuit breaker that fails fast while the provider is unhealthy
+#   3. retry with exponential backoff + full jitter, honoring Retry-After,
+#      with no new attempt starting past a deadline shared by all attempts
+# Shared by gemini_service, groq_service and voice_service.
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Read timeouts are not retried: the request reached a provider that is now
+# hanging, and another attempt would mostly pay the full timeout again
+RETRYABLE_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class UpstreamUnavailable(Exception):
+    """The call was rejected locally (queue full or circuit open)."""
+
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"{provider} unavailable: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+def _env(provider: str, name: str, default: float) -> float:
+    try:
+        return float(os.getenv(f"{provider.upper()}_{name}", default))
+    except ValueError:
+        return default
+
+
+class TokenBucket:
+    """Token bucket (rate tokens/sec, up to burst) with a bounded FIFO wait queue."""
+
+    def __init__(self, provider: str, rate: float, burst: float, max_waiters: int, max_wait: float):
+        self.provider = provider
+        self.rate = rate
+        self.burst = burst
+        self.max_waiters = max_waiters
+        self.max_wait = max_wait
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.waiters = 0
+        self.throttled = 0
+        self.rejected = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        self._refill()
+        if self.tokens >= 1 and not self._lock.locked():
+            self.tokens -= 1
+            return
+        if self.waiters >= self.max_waiters:
+            self.rejected += 1
+            raise UpstreamUnavailable(self.provider, "rate limit queue full")
+
+        self.waiters += 1
+        self.throttled += 1
+        deadline = time.monotonic() + self.max_wait
+        try:
+            async with self._lock:  # FIFO among waiters
+                while True:
+                    self._refill()
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    delay = (1 - self.tokens) / self.rate
+                    if time.monotonic() + delay > deadline:
+                        self.rejected += 1
+                        raise UpstreamUnavailable(self.provider, "rate limit wait too long")
+                    await asyncio.sleep(delay)
+        finally:
+            self.waiters -= 1
+
+
+class CircuitBreaker:
+    """Opens after consecutive failures; lets one trial call through after a cool-down."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, provider: str, failure_threshold: int, recovery_timeout: float):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.short_circuited = 0
+        self.trips = 0
+        self._trial_in_flight = False
+
+    def before_call(self):
+        if self.state == self.OPEN:
+            if time.monotonic() - self.opened_at < self.recovery_timeout:
+                self.short_circuited += 1
+                raise UpstreamUnavailable(self.provider, "circuit open")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._trial_in_flight:
+                self.short_circuited += 1
+                raise UpstreamUnavailable(self.provider, "circuit half-open")
+            self._trial_in_flight = True
+
+    def release_trial(self):
+        """The half-open trial call was abandoned without an outcome."""
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self._trial_in_flight = False
+        self.failures = 0
+        self.state = self.CLOSED
+
+    def record_failure(self):
+        self._trial_in_flight = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.trips += 1
+                print(f"⚠️ Circuit opened for {self.provider} after {self.failures} failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+def parse_retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds to wait from a Retry-After header (delta-seconds or HTTP date)."""
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+        return max(0.0, when.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ProviderGuard:
+    """Rate limiter + circuit breaker + retry policy for one provider."""
+
+    def __init__(
+        self,
+        provider: str,
+        rate: float,
+        burst: float,
+        max_waiters: int = 50,
+        max_wait: float = 10.0,
+        max_retries: int = 2,
+        base_delay: float = 0.5,
+        max_delay: float = 8.0,
+        failure_threshold: int = 5,
+        recovery_timeout: float = 30.0,
+        retry_deadline: float = 20.0
+    ):
+        self.provider = provider
+        self.bucket = TokenBucket(provider, rate, burst, max_waiters, max_wait)
+        self.breaker = CircuitBreaker(provider, failure_threshold, recovery_timeout)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retry_deadline = retry_deadline  # no new attempt this long after the first
+        self.retries = 0
+        self.retries_abandoned = 0
+
+    @classmethod
+    def from_env(cls, provider: str, rate: float, burst: float) -> "ProviderGuard":
+        """Defaults overridable with e.g. GROQ_RATE_LIMIT, GROQ_RATE_BURST, GROQ_MAX_RETRIES, GROQ_RETRY_DEADLINE."""
+        return cls(
+            provider,
+            rate=_env(provider, "RATE_LIMIT", rate),
+            burst=_env(provider, "RATE_BURST", burst),
+            max_waiters=int(_env(provider, "MAX_QUEUE", 50)),
+            max_wait=_env(provider, "MAX_QUEUE_WAIT", 10.0),
+            max_retries=int(_env(provider, "MAX_RETRIES", 2)),
+            failure_threshold=int(_env(provider, "BREAKER_FAILURES", 5)),
+            recovery_timeout=_env(provider, "BREAKER_RECOVERY", 30.0),
+            retry_deadline=_env(provider, "RETRY_DEADLINE", 20.0),
+        )
+
+    def _backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def admit(self):
+        """Breaker and rate-limit check for one upstream attempt (used by streams)."""
+        self.breaker.before_call()  # fail fast before queueing for a token
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self.breaker.release_trial()
+            raise
+
+    def record(self, status_code: Optional[int] = None):
+        """Report an attempt's outcome: an HTTP status, or None for a transport error."""
+        if status_code is None or status_code in RETRYABLE_STATUS:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    async def call(self, send: Callable[[], Awaitable[httpx.Response]]) -> httpx.Response:
+        """
+        Send a request through the guard, retrying 429/5xx and connection
+        errors. The last response is returned (or error raised) when retries
+        run out, or when the next attempt would start more than
+        retry_deadline seconds after the first, so callers keep their
+        existing error handling.
+        """
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            await self.admit()
+            try:
+                response = await send()
+            except RETRYABLE_ERRORS:
+                self.record(None)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff(attempt)
+                if self._past_deadline(started, delay):
+                    raise
+            except asyncio.CancelledError:
+                self.breaker.release_trial()
+                raise
+            except Exception:
+                self.record(None)
+                raise
+            else:
+                self.record(response.status_code)
+                if response.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    return response
+                retry_after = parse_retry_after(response)
+                if retry_after is not None and retry_after > self.max_delay:
+                    return response  # provider wants us gone for longer; fail now
+                delay = retry_after if retry_after is not None else self._backoff(attempt)
+                if self._past_deadline(started, delay):
+                    return response
+
+            attempt += 1
+            self.retries += 1
+            print(f"🔁 Retrying {self.provider} in {delay:.2f}s (attempt {attempt + 1})")
+            await asyncio.sleep(delay)
+
+    def _past_deadline(self, started: float, delay: float) -> bool:
+        if time.monotonic() + delay - started <= self.retry_deadline:
+            return False
+        self.retries_abandoned += 1
+        print(f"⏱️ Not retrying {self.provider}: next attempt would start after the {self.retry_deadline:.0f}s deadline")
+        return True
+
+    async def open_stream(self, client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+        """
+        Open a streaming response through the guard (rate limit + breaker, no
+        retries once tokens may have been sent). The caller must aclose() it.
+        """
+        await self.admit()
+        request = client.build_request(method, url, **kwargs)
+        try:
+            response = await client.send(request, stream=True)
+        except asyncio.CancelledError:
+            self.breaker.release_trial()
+            raise
+        except Exception:
+            self.record(None)
+            raise
+        self.record(response.status_code)
+        return response
+
+    def stats(self) -> Dict:
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "circuit_trips": self.breaker.trips,
+            "short_circuited": self.breaker.short_circuited,
+            "retries": self.retries,
+            "retries_abandoned": self.retries_abandoned,
+            "throttled": self.bucket.throttled,
+            "rejected": self.bucket.rejected,
+            "queued": self.bucket.waiters,
+            "tokens": round(self.bucket.tokens, 2),
+            "rate_per_sec": self.bucket.rate,
+        }
+
+
+# Defaults sized for our plans; tune per deployment with the env overrides
+guards: Dict[str, ProviderGuard] = {
+    "gemini": ProviderGuard.from_env("gemini", rate=5.0, burst=10),
+    "groq": ProviderGuard.from_env("groq", rate=5.0, burst=10),
+    "deepgram": ProviderGuard.from_env("deepgram", rate=10.0, burst=20),
+}
+
+
+def get_guard(provider: str) -> ProviderGuard:
+    return guards[provider]
+
+
+def get_resilience_stats() -> Dict:
+    return {provider: guard.stats() for provider, guard in guards.items()}
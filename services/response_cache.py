@@ -0,0 +1,60 @@
+import os
+import re
+import json
+import hashlib
+from typing import Any, Dict, Optional
+
+from services.cache import LRUCache
+
+# --- EXACT-MATCH RESPONSE CACHE ---
+# Greetings and common CodeKivy questions repeat constantly. Answers are cached
+# under a key built from the normalized message, the system prompt version,
+# a fingerprint of the history the model saw and (for document Q&A) the
+# document context, so a repeat is answered without an upstream call.
+# Image requests are never cached.
+
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "600"))
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "1") != "0"
+
+response_cache = LRUCache(RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL, name="responses")
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s.!?,;:]+$")
+
+
+def normalize_message(text: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a message."""
+    text = _WHITESPACE.sub(" ", text.strip().lower())
+    return _TRAILING_PUNCTUATION.sub("", text)
+
+
+def fingerprint(value: Any) -> str:
+    """Stable short hash of any JSON-serializable value (prompt, history, context)."""
+    if not isinstance(value, str):
+        value = json.dumps(value, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(value.encode("utf-8")).hexdigest()[:16]
+
+
+def make_key(provider: str, message: str, prompt_version: str, context: Any = None) -> str:
+    """Cache key for one upstream request."""
+    context_fp = fingerprint(context) if context else "-"
+    return f"{provider}:{prompt_version}:{context_fp}:{normalize_message(message)}"
+
+
+def get_cached_response(key: str) -> Optional[str]:
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    return response_cache.get(key)
+
+
+def store_response(key: str, text: str):
+    """Cache a successful answer (never call this with error/apology text)."""
+    if RESPONSE_CACHE_ENABLED and text:
+        response_cache.set(key, text)
+
+
+def get_response_cache_stats() -> Dict:
+    stats = response_cache.stats()
+    stats["enabled"] = RESPONSE_CACHE_ENABLED
+    return stats
@@ -0,0 +1,287 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# --- BM25 RETRIEVAL FOR DOCUMENT Q&A ---
+# Long documents are split into overlapping chunks and indexed once at upload.
+# Each question then sends only the most relevant chunks to the LLM instead of
+# a fixed head/middle/tail preview. A session with several documents searches
+# all of them through a MultiDocumentIndex.
+
+CHUNK_SIZE = int(os.getenv("DOC_CHUNK_SIZE", "800"))  # characters
+CHUNK_OVERLAP = int(os.getenv("DOC_CHUNK_OVERLAP", "150"))  # characters
+DEFAULT_TOP_K = int(os.getenv("DOC_TOP_K", "8"))
+DEFAULT_CONTEXT_CHARS = int(os.getenv("DOC_CONTEXT_CHARS", "6000"))
+CHARS_PER_TOKEN = 4  # rough estimate for English/code text
+
+# BM25 parameters (standard defaults)
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+TOKEN_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+STOPWORDS = frozenset("""
+a an and are as at be but by can do does for from has have how i if in is it
+its me my of on or so that the their there this to was what when where which
+who why will with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase word tokens without common stopwords."""
+    return [t for t in TOKEN_PATTERN.findall(text.lower()) if t not in STOPWORDS]
+
+
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Tuple[int, str]]:
+    """
+    Split text into overlapping chunks, preferring paragraph/line/word breaks.
+
+    Returns:
+        List of (start_offset, chunk_text)
+    """
+    chunks = []
+    length = len(text)
+    start = 0
+    while start < length:
+        end = min(start + chunk_size, length)
+        if end < length:
+            # Cut at the last natural break in the second half of the window
+            window = text[start + chunk_size // 2:end]
+            for sep in ("\n\n", "\n", ". ", " "):
+                cut = window.rfind(sep)
+                if cut != -1:
+                    end = start + chunk_size // 2 + cut + len(sep)
+                    break
+        piece = text[start:end].strip()
+        if piece:
+            chunks.append((start, piece))
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+class DocumentIndex:
+    """Inverted index with BM25 scoring over the chunks of one document."""
+
+    def __init__(self, text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP):
+        self.text_length = len(text)
+        self.chunks: List[Tuple[int, str]] = chunk_text(text, chunk_size, overlap)
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}  # term -> [(chunk_id, tf)]
+        self.chunk_lengths: List[int] = []
+
+        for chunk_id, (_, chunk) in enumerate(self.chunks):
+            terms = Counter(tokenize(chunk))
+            self.chunk_lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((chunk_id, tf))
+
+        total = sum(self.chunk_lengths)
+        self.avg_chunk_length = total / len(self.chunk_lengths) if self.chunk_lengths else 0.0
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def approx_bytes(self) -> int:
+        """Rough memory footprint, used for cache byte budgets."""
+        chunk_bytes = sum(len(chunk) for _, chunk in self.chunks)
+        posting_count = sum(len(p) for p in self.postings.values())
+        # ~100 bytes per term entry and ~72 per (chunk_id, tf) tuple
+        return chunk_bytes + 100 * len(self.postings) + 72 * posting_count
+
+    def search(self, query: str, top_k: int = DEFAULT_TOP_K) -> List[Tuple[int, float]]:
+        """Return the top_k (chunk_id, score) pairs for a query, best first."""
+        n = len(self.chunks)
+        if not n:
+            return []
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for chunk_id, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_lengths[chunk_id] / self.avg_chunk_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def select_chunks(
+        self,
+        query: str,
+        max_chars: int = DEFAULT_CONTEXT_CHARS,
+        top_k: int = DEFAULT_TOP_K
+    ) -> List[int]:
+        """
+        Chunk ids to answer a question from, best first, within max_chars.
+
+        If nothing matches, the opening chunks are used so the model still
+        sees the document.
+        """
+        ranked = [chunk_id for chunk_id, _ in self.search(query, top_k)]
+        if not ranked:
+            ranked = list(range(min(top_k, len(self.chunks))))
+        return _fit_budget(ranked, self.chunk_chars, max_chars)
+
+    def chunk_chars(self, chunk_id: int) -> int:
+        return len(self.chunks[chunk_id][1])
+
+    def format_chunks(self, chunk_ids: Iterable[int], max_chars: Optional[int] = None) -> str:
+        """Render chunks in document order, each labelled with its position."""
+        parts = []
+        for chunk_id in sorted(set(chunk_ids)):
+            offset, chunk = self.chunks[chunk_id]
+            if max_chars is not None:
+                chunk = chunk[:max_chars]
+            position = round(100 * offset / self.text_length) if self.text_length else 0
+            parts.append(f"[Excerpt at ~{position}% of document]\n{chunk}")
+        return "\n\n".join(parts)
+
+    def build_context(
+        self,
+        query: str,
+        max_chars: int = DEFAULT_CONTEXT_CHARS,
+        max_tokens: Optional[int] = None,
+        top_k: int = DEFAULT_TOP_K
+    ) -> str:
+        """
+        Assemble the most relevant chunks for a question within a size budget.
+
+        Chunks are picked by BM25 score and then emitted in document order so
+        the LLM reads them in their original sequence.
+        """
+        if max_tokens is not None:
+            max_chars = min(max_chars, max_tokens * CHARS_PER_TOKEN)
+        return self.format_chunks(self.select_chunks(query, max_chars, top_k), max_chars)
+
+
+def _fit_budget(ranked: list, chunk_chars, max_chars: int) -> list:
+    """Take ranked chunks while they fit in max_chars (the best one always)."""
+    selected = []
+    used = 0
+    for key in ranked:
+        size = chunk_chars(key)
+        if used + size > max_chars:
+            if not selected:
+                # Oversized best chunk: format_chunks truncates it
+                selected.append(key)
+                used = max_chars
+            continue
+        selected.append(key)
+        used += size
+    return selected
+
+
+class MultiDocumentIndex:
+    """
+    BM25 across several documents' indexes at once.
+
+    Term statistics (chunk count, document frequency, average chunk length)
+    are pooled so scores are comparable between documents, and every excerpt
+    is labelled with the document it came from. Chunks are addressed as
+    (document position, chunk_id).
+    """
+
+    def __init__(self, documents: List[Tuple[str, DocumentIndex]]):
+        self.names = [name for name, _ in documents]
+        self.indexes = [index for _, index in documents]
+        self.chunk_count = sum(len(index) for index in self.indexes)
+        total_length = sum(sum(index.chunk_lengths) for index in self.indexes)
+        self.avg_chunk_length = total_length / self.chunk_count if self.chunk_count else 0.0
+        self.doc_freq: Dict[str, int] = Counter()
+        for index in self.indexes:
+            for term, postings in index.postings.items():
+                self.doc_freq[term] += len(postings)
+
+    def __len__(self) -> int:
+        return self.chunk_count
+
+    @property
+    def approx_bytes(self) -> int:
+        """Only the pooled statistics; the per-document indexes are counted separately."""
+        return 100 * len(self.doc_freq)
+
+    def search(self, query: str, top_k: int = DEFAULT_TOP_K) -> List[Tuple[Tuple[int, int], float]]:
+        """Return the top_k ((document, chunk_id), score) pairs, best first."""
+        n = self.chunk_count
+        if not n:
+            return []
+
+        scores: Dict[Tuple[int, int], float] = {}
+        for term in set(tokenize(query)):
+            df = self.doc_freq.get(term)
+            if not df:
+                continue
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for position, index in enumerate(self.indexes):
+                for chunk_id, tf in index.postings.get(term, ()):
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * index.chunk_lengths[chunk_id] / self.avg_chunk_length)
+                    key = (position, chunk_id)
+                    scores[key] = scores.get(key, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return ranked[:top_k]
+
+    def chunk_chars(self, key: Tuple[int, int]) -> int:
+        return self.indexes[key[0]].chunk_chars(key[1])
+
+    def select_chunks(
+        self,
+        query: str,
+        max_chars: int = DEFAULT_CONTEXT_CHARS,
+        top_k: int = DEFAULT_TOP_K
+    ) -> List[Tuple[int, int]]:
+        """
+        Chunks to answer a question from within max_chars. The best match of
+        every document that matches at all comes first, so questions that
+        compare documents see each of them; then the rest by score.
+        """
+        ranked = [key for key, _ in self.search(query, top_k)]
+        if not ranked:
+            # Nothing matches: the opening chunk of each document
+            ranked = [(position, 0) for position, index in enumerate(self.indexes) if len(index)]
+        seen = set()
+        firsts = [key for key in ranked if key[0] not in seen and not seen.add(key[0])]
+        ranked = firsts + [key for key in ranked if key not in firsts]
+        return _fit_budget(ranked, self.chunk_chars, max_chars)
+
+    def sources(self, keys: Iterable[Tuple[int, int]]) -> List[str]:
+        """Names of the documents the given chunks come from, in upload order."""
+        return [self.names[position] for position in sorted({key[0] for key in keys})]
+
+    def format_chunks(self, keys: Iterable[Tuple[int, int]], max_chars: Optional[int] = None) -> str:
+        """Render chunks grouped by document, each in document order."""
+        parts = []
+        for position, chunk_id in sorted(set(keys)):
+            index = self.indexes[position]
+            offset, chunk = index.chunks[chunk_id]
+            if max_chars is not None:
+                chunk = chunk[:max_chars]
+            where = round(100 * offset / index.text_length) if index.text_length else 0
+            parts.append(f"[From \"{self.names[position]}\", excerpt at ~{where}%]\n{chunk}")
+        return "\n\n".join(parts)
+
+    def build_context(
+        self,
+        query: str,
+        max_chars: int = DEFAULT_CONTEXT_CHARS,
+        max_tokens: Optional[int] = None,
+        top_k: int = DEFAULT_TOP_K
+    ) -> str:
+        """Most relevant chunks across all documents within one size budget."""
+        if max_tokens is not None:
+            max_chars = min(max_chars, max_tokens * CHARS_PER_TOKEN)
+        return self.format_chunks(self.select_chunks(query, max_chars, top_k), max_chars)
+
+
+def build_index(text: str) -> DocumentIndex:
+    """Build a retrieval index for a document's extracted text."""
+    index = DocumentIndex(text)
+    print(f"✓ Indexed {len(index)} chunks, {len(index.postings)} terms")
+    return index
@@ -0,0 +1,701 @@
+import os
+import sys
+import time
+import asyncio
+import hashlib
+import threading
+import contextvars
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from services.retrieval_service import MultiDocumentIndex, build_index
+from services.state_backend import StateBackend, create_state_backend, encode_value, decode_value, STATE_KEY_PREFIX
+
+# --- UNIFIED SESSION STORE ---
+# All per-user state (documents + retrieval indexes, Gemini chat history,
+# voice history) lives in one Session object keyed by session_id. Idle
+# sessions expire, each session and the whole store are held to a memory
+# budget, and a background task sweeps expired sessions.
+
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))  # seconds
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(16 * 1024 * 1024)))
+SESSION_STORE_MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+# Documents kept per session; the oldest is dropped beyond this (or when the
+# session is over its memory budget even after trimming history)
+SESSION_MAX_DOCUMENTS = int(os.getenv("SESSION_MAX_DOCUMENTS", "10"))
+
+# --- SHARED STATE (STATE_BACKEND=sqlite/redis) ---
+# With a shared backend the in-process sessions become a cache. Each session
+# is stored as three parts - chat (history + summary), voice history and the
+# document list - plus the document texts under content keys. A session is
+# re-read at most once per request (one batched read, and a second one only
+# for document texts this worker hasn't seen), and update() writes only the
+# parts that changed, together with TTL refreshes, in one round trip.
+# Round trips run on the backend's state I/O thread: async code awaits
+# load() / load_or_create() before using a session, and update() queues its
+# write there without waiting.
+# Concurrent writes to the same part from two workers: last writer wins.
+SESSION_PARTS = ("chat", "voice", "docs")
+
+# Refresh the TTL of a session that is only being read at most this often
+STATE_TOUCH_INTERVAL = float(os.getenv("STATE_TOUCH_INTERVAL", "60"))
+
+# Sessions already re-read in the current request (see begin_request)
+_synced_sessions: contextvars.ContextVar[Optional[set]] = contextvars.ContextVar("synced_sessions", default=None)
+
+# Keep only last 10 exchanges (20 messages) of voice history to avoid token limits
+MAX_HISTORY_MESSAGES = 20
+
+# Chat history is token-budgeted and summarized (history_manager); this is
+# only a hard safety cap in case summarization keeps failing
+MAX_CHAT_HISTORY_MESSAGES = 100
+
+
+def _history_bytes(messages: List[Dict]) -> int:
+    total = 0
+    for message in messages:
+        if "content" in message:
+            total += sys.getsizeof(message["content"])
+        for part in message.get("parts", ()):
+            total += sys.getsizeof(part.get("text", ""))
+            inline = part.get("inlineData")
+            if inline:
+                total += sys.getsizeof(inline.get("data", ""))
+        total += 200  # dict/list overhead per message
+    return total
+
+
+class SessionDocument:
+    """One uploaded document and its retrieval index."""
+
+    def __init__(self, name: str, text: str, index, pages_ready: Optional[int] = None, pages_total: Optional[int] = None):
+        self.document_id = self.content_id(text)
+        self.name = name
+        self.text = text
+        self.index = index  # retrieval_service.DocumentIndex
+        self.uploaded_at = time.time()
+        # Progressively ingested PDFs: pages extracted so far / to extract
+        self.pages_ready = pages_ready
+        self.pages_total = pages_total
+        self._text_key = ""
+        self._text_key_for = None
+
+    @staticmethod
+    def content_id(text: str) -> str:
+        return hashlib.sha1(text.encode("utf-8", "ignore")).hexdigest()[:12]
+
+    @classmethod
+    def from_state(cls, state: Dict, text: str) -> "SessionDocument":
+        """Rebuild a document (and its index) saved by another worker."""
+        document = cls(state["name"], text, build_index(text), state.get("pages_ready"), state.get("pages_total"))
+        document.document_id = state["id"]
+        document.uploaded_at = state["uploaded_at"]
+        return document
+
+    @property
+    def text_key(self) -> str:
+        """Content hash of the current text (its key in the shared state)."""
+        if self._text_key_for is not self.text:
+            self._text_key = hashlib.sha1(self.text.encode("utf-8", "ignore")).hexdigest()[:20]
+            self._text_key_for = self.text
+        return self._text_key
+
+    def state(self) -> Dict:
+        return {
+            "id": self.document_id,
+            "name": self.name,
+            "text": self.text_key,
+            "uploaded_at": self.uploaded_at,
+            "pages_ready": self.pages_ready,
+            "pages_total": self.pages_total,
+        }
+
+    @property
+    def extracting(self) -> bool:
+        return self.pages_total is not None and self.pages_ready < self.pages_total
+
+    @property
+    def bytes(self) -> int:
+        size = sys.getsizeof(self.text)
+        if self.index is not None:
+            size += self.index.approx_bytes
+        return size
+
+    def info(self) -> Dict:
+        return {
+            "document_id": self.document_id,
+            "name": self.name,
+            "chars": len(self.text),
+            "chunks": len(self.index) if self.index is not None else 0,
+            "uploaded_at": self.uploaded_at,
+            "extracting": self.extracting,
+            "pages_ready": self.pages_ready,
+            "pages_total": self.pages_total,
+        }
+
+
+class Session:
+    """All server-side state for one session_id."""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.created_at = time.time()
+        self.last_access = time.monotonic()
+        self.documents: "OrderedDict[str, SessionDocument]" = OrderedDict()  # oldest first
+        self._merged_index = None  # cached retrieval_service.MultiDocumentIndex
+        self.chat_history: List[Dict] = []  # Gemini "contents" format
+        self.voice_history: List[Dict] = []  # OpenAI/Groq messages format
+        self.chat_summary = ""  # rolling summary of folded chat turns
+        self.summary_task: Optional[asyncio.Task] = None
+        self.bytes = 0
+        # Shared state bookkeeping: digest of each part as last read/written,
+        # document texts known to be stored, last TTL refresh
+        self._synced: Dict[str, bytes] = {}
+        self._stored_texts: set = set()
+        self._touched = 0.0
+
+    # --- Documents ---
+
+    def add_document(
+        self,
+        name: str,
+        text: str,
+        index,
+        pages_ready: Optional[int] = None,
+        pages_total: Optional[int] = None,
+        replace: Optional[str] = None
+    ) -> SessionDocument:
+        """
+        Add a document. Re-uploading the same content replaces the earlier
+        copy; different files with the same name are kept side by side.
+        replace names a document_id to swap out (e.g. a revised version).
+        Beyond SESSION_MAX_DOCUMENTS the oldest document is dropped.
+        """
+        document = SessionDocument(name, text, index, pages_ready, pages_total)
+        self.documents.pop(document.document_id, None)
+        if replace is not None:
+            self.documents.pop(replace, None)
+        self.documents[document.document_id] = document
+        while len(self.documents) > SESSION_MAX_DOCUMENTS:
+            self.documents.popitem(last=False)
+        self._merged_index = None
+        return document
+
+    def update_document(self, document: SessionDocument, text: str, index, pages_ready: int) -> bool:
+        """
+        Swap in a longer text and its index as more pages of a document are
+        extracted. Once every page is in, the document_id becomes that of
+        the full text, so a later upload of the same file (served from the
+        cache) replaces it instead of adding a second copy. Returns False
+        if the document has since been removed or replaced.
+        """
+        if self.documents.get(document.document_id) is not document:
+            return False
+        document.text = text
+        document.index = index
+        document.pages_ready = pages_ready
+        if not document.extracting:
+            document_id = SessionDocument.content_id(text)
+            if document_id != document.document_id:
+                # Keep the document's place in the upload order
+                self.documents = OrderedDict(
+                    (document_id if key == document.document_id else key, value)
+                    for key, value in self.documents.items() if key != document_id
+                )
+                document.document_id = document_id
+        self._merged_index = None
+        return True
+
+    def remove_document(self, document_id: Optional[str] = None) -> bool:
+        """Remove one document, or all of them when document_id is None."""
+        if document_id is None:
+            removed = bool(self.documents)
+            self.documents.clear()
+        else:
+            removed = self.documents.pop(document_id, None) is not None
+        self._merged_index = None
+        return removed
+
+    @property
+    def has_documents(self) -> bool:
+        return bool(self.documents)
+
+    @property
+    def document_chars(self) -> int:
+        return sum(len(document.text) for document in self.documents.values())
+
+    @property
+    def document_names(self) -> List[str]:
+        return [document.name for document in self.documents.values()]
+
+    @property
+    def document_text(self) -> Optional[str]:
+        """All document text; with several documents each is headed by its name."""
+        if not self.documents:
+            return None
+        if len(self.documents) == 1:
+            return next(iter(self.documents.values())).text
+        return "\n\n".join(f"=== Document: {document.name} ===\n{document.text}" for document in self.documents.values())
+
+    @property
+    def document_index(self):
+        """The single document's index, or a merged index across all of them."""
+        if not self.documents:
+            return None
+        if len(self.documents) == 1:
+            return next(iter(self.documents.values())).index
+        if self._merged_index is None:
+            self._merged_index = MultiDocumentIndex([
+                (document.name, document.index) for document in self.documents.values() if document.index is not None
+            ])
+        return self._merged_index
+
+    def state_parts(self) -> Dict[str, bytes]:
+        """The session serialized as its shared-state parts."""
+        return {
+            "chat": encode_value({"history": self.chat_history, "summary": self.chat_summary}),
+            "voice": encode_value(self.voice_history),
+            "docs": encode_value([document.state() for document in self.documents.values()]),
+        }
+
+    def measure(self) -> int:
+        """Recompute this session's approximate memory footprint."""
+        size = 500
+        for document in self.documents.values():
+            size += document.bytes
+        if self._merged_index is not None:
+            size += self._merged_index.approx_bytes
+        size += _history_bytes(self.chat_history)
+        size += sys.getsizeof(self.chat_summary)
+        size += _history_bytes(self.voice_history)
+        self.bytes = size
+        return size
+
+    def trim_history(self):
+        """Apply the hard message caps to both histories."""
+        if len(self.chat_history) > MAX_CHAT_HISTORY_MESSAGES:
+            del self.chat_history[:-MAX_CHAT_HISTORY_MESSAGES]
+        if len(self.voice_history) > MAX_HISTORY_MESSAGES:
+            del self.voice_history[:-MAX_HISTORY_MESSAGES]
+
+
+class SessionStore:
+    """Sessions in LRU order with idle TTL and per-session/global memory caps."""
+
+    def __init__(
+        self,
+        idle_ttl: float = SESSION_IDLE_TTL,
+        session_max_bytes: int = SESSION_MAX_BYTES,
+        max_bytes: int = SESSION_STORE_MAX_BYTES,
+        backend: Optional[StateBackend] = None
+    ):
+        self.idle_ttl = idle_ttl
+        self.session_max_bytes = session_max_bytes
+        self.max_bytes = max_bytes
+        self.backend = backend  # None: sessions live only in this process
+        self.loaded = 0  # sessions/parts picked up from the shared state
+        self.backend_errors = 0
+        self._sessions: "OrderedDict[str, Session]" = OrderedDict()
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+        self.trimmed = 0
+        self.documents_dropped = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+    def _is_idle(self, session: Session) -> bool:
+        return session.last_access + self.idle_ttl < time.monotonic()
+
+    def _live(self, session_id: str) -> Optional[Session]:
+        session = self._sessions.get(session_id)
+        if session is not None and self._is_idle(session):
+            self._drop(session_id)
+            self.expired += 1
+            session = None
+        return session
+
+    def _accessed(self, session_id: str, session: Optional[Session]) -> Optional[Session]:
+        if session is None:
+            return None
+        session.last_access = time.monotonic()
+        self._sessions.move_to_end(session_id)
+        return session
+
+    def get(self, session_id: str) -> Optional[Session]:
+        """
+        Return a live session (refreshing its idle timer), or None.
+        With a shared backend the first get() of a request waits for a
+        round trip; async code calls load() first, so get() stays local.
+        """
+        with self._lock:
+            session = self._live(session_id)
+            if self.backend is not None and self._needs_sync(session_id):
+                snapshot = self._snapshot(session)
+                try:
+                    fetched = self.backend.submit(self._fetch, session_id, *snapshot).result()
+                except Exception as e:
+                    self._read_failed(e)
+                    fetched = None
+                session = self._sync(session_id, session, fetched, snapshot[0])
+            return self._accessed(session_id, session)
+
+    async def load(self, session_id: str) -> Optional[Session]:
+        """
+        get() for async code: the shared-state read, and rebuilding the
+        indexes of documents added on another worker, run on the state I/O
+        thread instead of the event loop.
+        """
+        if self.backend is None or not self._needs_sync(session_id):
+            return self.get(session_id)
+        with self._lock:
+            snapshot = self._snapshot(self._live(session_id))
+        try:
+            fetched = await self.backend.run(self._fetch, session_id, *snapshot)
+        except Exception as e:
+            self._read_failed(e)
+            fetched = None
+        with self._lock:
+            session = self._sync(session_id, self._live(session_id), fetched, snapshot[0])
+            return self._accessed(session_id, session)
+
+    async def load_or_create(self, session_id: str) -> Session:
+        await self.load(session_id)
+        return self.get_or_create(session_id)
+
+    def get_or_create(self, session_id: str) -> Session:
+        with self._lock:
+            session = self.get(session_id)
+            if session is None:
+                session = Session(session_id)
+                session.measure()
+                self._sessions[session_id] = session
+                self.bytes += session.bytes
+                self.created += 1
+            return session
+
+    def update(self, session: Session):
+        """
+        Re-account a session after it changed and enforce the memory caps.
+        Oversized sessions lose their oldest documents first (keeping the
+        newest), then their oldest history; if the store is over budget,
+        least-recently-used sessions are evicted.
+        """
+        with self._lock:
+            if self._sessions.get(session.session_id) is not session:
+                return  # evicted/reset while the caller held it
+            previous = session.bytes
+            session.trim_history()
+            session.measure()
+            while session.bytes > self.session_max_bytes and len(session.documents) > 1:
+                dropped = session.documents.popitem(last=False)[1]
+                session._merged_index = None
+                session.measure()
+                self.documents_dropped += 1
+                print(f"⚠️ Session {session.session_id} over its memory budget, dropped document '{dropped.name}'")
+            while session.bytes > self.session_max_bytes and (session.chat_history or session.voice_history):
+                for history in (session.chat_history, session.voice_history):
+                    if history:
+                        del history[:2]
+                session.measure()
+                self.trimmed += 1
+            self.bytes += session.bytes - previous
+
+            while self.bytes > self.max_bytes and len(self._sessions) > 1:
+                oldest_id = next(iter(self._sessions))
+                if oldest_id == session.session_id:
+                    break
+                self._drop(oldest_id)
+                self.evicted += 1
+
+            if self.backend is not None:
+                self._save(session)
+
+    # --- Shared state ---
+
+    def begin_request(self):
+        """Start a new request scope: each session is re-read at most once in it."""
+        _synced_sessions.set(set())
+
+    def _needs_sync(self, session_id: str) -> bool:
+        synced = _synced_sessions.get()
+        if synced is None:
+            return True  # outside a request scope (WebSocket, background): always re-read
+        if session_id in synced:
+            return False
+        synced.add(session_id)
+        return True
+
+    def _keys(self, session_id: str) -> Dict[str, str]:
+        return {part: f"{STATE_KEY_PREFIX}s:{session_id}:{part}" for part in SESSION_PARTS}
+
+    @staticmethod
+    def _text_key(key: str) -> str:
+        return f"{STATE_KEY_PREFIX}t:{key}"
+
+    @staticmethod
+    def _snapshot(session: Optional[Session]) -> Tuple[Dict[str, bytes], set]:
+        """What the local copy already has: part digests and document text keys."""
+        if session is None:
+            return {}, set()
+        return dict(session._synced), {document.text_key for document in session.documents.values()}
+
+    def _fetch(self, session_id: str, synced: Dict[str, bytes], known_texts: set):
+        """
+        State I/O thread: read the session's parts and, if its document list
+        changed, the texts of documents not held locally (their indexes are
+        built here too). Returns (blobs by key, documents by text key).
+        """
+        keys = self._keys(session_id)
+        blobs = self.backend.read(list(keys.values()))
+        documents = {}
+        blob = blobs.get(keys["docs"])
+        if blob is not None and synced.get("docs") != _digest(blob):
+            documents = self._fetch_documents(decode_value(blob), known_texts)
+        return blobs, documents
+
+    def _fetch_documents(self, states: List[Dict], known_texts: set) -> Dict[str, SessionDocument]:
+        missing = [state for state in states if state["text"] not in known_texts]
+        if not missing:
+            return {}
+        try:
+            texts = self.backend.read([self._text_key(state["text"]) for state in missing])
+        except Exception as e:
+            self.backend_errors += 1
+            print(f"⚠️ State backend read error (documents): {e}")
+            return {}
+        documents = {}
+        for state in missing:
+            blob = texts.get(self._text_key(state["text"]))
+            if blob is not None:  # else the text expired
+                documents[state["text"]] = SessionDocument.from_state(state, decode_value(blob))
+        return documents
+
+    def _read_failed(self, error: Exception):
+        self.backend_errors += 1
+        print(f"⚠️ State backend read error (using local copy): {error}")
+
+    def _sync(self, session_id: str, session: Optional[Session], fetched, synced_before: Dict[str, bytes]) -> Optional[Session]:
+        """Bring the local copy up to date with what _fetch read (None: read failed)."""
+        if fetched is None:
+            return session
+        blobs, documents = fetched
+        keys = self._keys(session_id)
+
+        if not blobs:
+            if session is not None and session._synced:
+                # Reset or expired in the shared state
+                self._drop(session_id)
+                return None
+            return session  # new here and not saved yet
+
+        if session is None:
+            session = Session(session_id)
+            self._sessions[session_id] = session
+            self.created += 1
+        previous = session.bytes
+        for part, key in keys.items():
+            blob = blobs.get(key)
+            if blob is None or session._synced.get(part) == _digest(blob):
+                continue
+            if session._synced.get(part) != synced_before.get(part):
+                continue  # saved here while the read was in flight: the local copy is newer
+            self._apply(session, part, decode_value(blob), documents)
+            session._synced[part] = _digest(blob)
+            self.loaded += 1
+        session.measure()
+        self.bytes += session.bytes - previous
+
+        if time.monotonic() - session._touched > STATE_TOUCH_INTERVAL:
+            self._touch(session)
+        return session
+
+    def _apply(self, session: Session, part: str, value, documents: Dict[str, SessionDocument]):
+        if part == "chat":
+            session.chat_history = value["history"]
+            session.chat_summary = value["summary"]
+        elif part == "voice":
+            session.voice_history = value
+        else:
+            session.documents = self._load_documents(session, value, documents)
+            session._merged_index = None
+
+    def _load_documents(
+        self, session: Session, states: List[Dict], fetched: Dict[str, SessionDocument]
+    ) -> "OrderedDict[str, SessionDocument]":
+        """Reuse documents already here and add the ones _fetch loaded."""
+        current = {document.text_key: document for document in session.documents.values()}
+        documents: "OrderedDict[str, SessionDocument]" = OrderedDict()
+        for state in states:
+            document = current.get(state["text"])
+            if document is None:
+                document = fetched.get(state["text"])
+                if document is None:
+                    continue  # text expired, or its read failed
+                session._stored_texts.add(state["text"])
+                print(f"✓ Loaded document '{document.name}' from shared state")
+            else:
+                document.name = state["name"]
+                document.pages_ready = state.get("pages_ready")
+                document.pages_total = state.get("pages_total")
+            documents[document.document_id] = document
+        return documents
+
+    def _dispatch(self, fn, *args):
+        """Queue a backend write on the state I/O thread; only wait for it outside the event loop."""
+        future = self.backend.submit(fn, *args)
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            future.result()
+
+    def _save(self, session: Session):
+        """Write the parts that changed (and new document texts) in one round trip."""
+        keys = self._keys(session.session_id)
+        items: Dict[str, bytes] = {}
+        digests: Dict[str, bytes] = {}
+        for part, blob in session.state_parts().items():
+            digest = _digest(blob)
+            if session._synced.get(part) != digest:
+                items[keys[part]] = blob
+                digests[part] = digest
+        texts = {
+            document.text_key: document.text
+            for document in session.documents.values() if document.text_key not in session._stored_texts
+        }
+        if not items and not texts:
+            return
+        touch = self._touch_keys(session, exclude=set(items) | {self._text_key(key) for key in texts})
+        # Marked saved now (the write is queued behind any earlier round trip); undone if it fails
+        session._synced.update(digests)
+        session._stored_texts.update(texts)
+        session._touched = time.monotonic()
+        self._dispatch(self._write_session, session, items, texts, touch, digests)
+
+    def _write_session(self, session: Session, items: Dict[str, bytes], texts: Dict[str, str], touch: List[str], digests: Dict[str, bytes]):
+        """State I/O thread: encode new document texts and write everything at once."""
+        for key, text in texts.items():
+            items[self._text_key(key)] = encode_value(text)
+        try:
+            self.backend.write(items, touch, self.idle_ttl)
+        except Exception as e:
+            self.backend_errors += 1
+            print(f"⚠️ State backend write error (kept locally): {e}")
+            for part, digest in digests.items():
+                if session._synced.get(part) == digest:
+                    session._synced.pop(part, None)  # re-sent by the next update()
+            session._stored_texts.difference_update(texts)
+
+    def _touch_keys(self, session: Session, exclude=()) -> List[str]:
+        keys = list(self._keys(session.session_id).values())
+        keys += [self._text_key(document.text_key) for document in session.documents.values()]
+        return [key for key in keys if key not in exclude]
+
+    def _touch(self, session: Session):
+        """Keep a session that is only being read from expiring in the shared state."""
+        session._touched = time.monotonic()
+        self._dispatch(self._write_quietly, {}, self._touch_keys(session), ())
+
+    def _write_quietly(self, items: Dict[str, bytes], touch: List[str], delete: List[str]):
+        try:
+            self.backend.write(items, touch, self.idle_ttl, delete)
+        except Exception as e:
+            self.backend_errors += 1
+            print(f"⚠️ State backend write error: {e}")
+
+    def _drop(self, session_id: str):
+        session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self.bytes -= session.bytes
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            existed = session_id in self._sessions
+            self._drop(session_id)
+            if self.backend is not None:
+                # Document texts are shared by content and simply expire
+                self._dispatch(self._write_quietly, {}, (), list(self._keys(session_id).values()))
+            return existed
+
+    def sweep(self) -> int:
+        """Remove every idle session; returns how many were removed."""
+        with self._lock:
+            idle = [sid for sid, session in self._sessions.items() if self._is_idle(session)]
+            for session_id in idle:
+                self._drop(session_id)
+            self.expired += len(idle)
+        if idle:
+            print(f"🧹 Swept {len(idle)} idle sessions")
+        if self.backend is not None:
+            self._dispatch(self._sweep_backend)
+        return len(idle)
+
+    def _sweep_backend(self):
+        try:
+            self.backend.sweep()
+        except Exception as e:
+            print(f"⚠️ State backend sweep error: {e}")
+
+    async def _sweep_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"❌ Session sweep error: {e}")
+
+    def start_sweeper(self, interval: float = SESSION_SWEEP_INTERVAL):
+        """Start the background sweeper (called from the app lifespan)."""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self._sweep_forever(interval))
+
+    async def stop_sweeper(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            with_documents = sum(1 for s in self._sessions.values() if s.has_documents)
+            return {
+                "sessions": len(self._sessions),
+                "sessions_with_documents": with_documents,
+                "documents": sum(len(s.documents) for s in self._sessions.values()),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "session_max_bytes": self.session_max_bytes,
+                "idle_ttl": self.idle_ttl,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+                "history_trims": self.trimmed,
+                "documents_dropped": self.documents_dropped,
+                "state": self.backend.stats() if self.backend is not None else {"backend": "memory"},
+                "state_loaded": self.loaded,
+                "state_errors": self.backend_errors,
+            }
+
+
+def _digest(blob: bytes) -> bytes:
+    return hashlib.blake2b(blob, digest_size=16).digest()
+
+
+# Process-wide store shared by main.py and the services
+session_store = SessionStore(backend=create_state_backend())
@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+# --- REQUEST COALESCING (SINGLE-FLIGHT) ---
+# When many users send an identical upstream request at the same moment (e.g.
+# a whole class asking the same question), only the first one - the leader -
+# calls the provider. Everyone else with the same payload fingerprint awaits
+# the leader's result.
+
+
+class SingleFlight:
+    """Deduplicates concurrent calls that share a key."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run fn() once per key among concurrent callers and share its result
+        (or exception) with all of them.
+
+        The upstream call runs as its own task, so one caller disconnecting
+        (being cancelled) doesn't cancel the request for the others. It is
+        only cancelled once every caller has gone (e.g. a losing hedge).
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        self._waiters[task] = self._waiters.get(task, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[task] -= 1
+            if not self._waiters[task]:
+                del self._waiters[task]
+                if not task.done():
+                    task.cancel()
+
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # mark retrieved even if every caller went away
+
+    def stats(self) -> Dict:
+        return {
+            "upstream_calls": self.calls,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._inflight),
+        }
+
+
+gemini_flight = SingleFlight("gemini")
+groq_flight = SingleFlight("groq")
+tts_flight = SingleFlight("tts")
+image_flight = SingleFlight("images")
+
+
+def get_single_flight_stats() -> Dict:
+    return {flight.name: flight.stats() for flight in (gemini_flight, groq_flight, tts_flight, image_flight)}
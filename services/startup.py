@@ -0,0 +1,38 @@
+import sys
+import time
+from typing import Dict, Optional
+
+# --- COLD START PROFILE ---
+# main.py marks each startup phase (imports, app setup, lifespan, first
+# request) so the cost of a cold serverless instance is visible at
+# /api/startup. For a per-module import breakdown run
+#     python -m benchmarks.import_profile
+
+# Heavy modules that should only be imported once they are actually needed
+LAZY_MODULES = ("PyPDF2", "docx", "PIL", "websockets")
+
+_origin: Optional[float] = None
+_phases: Dict[str, float] = {}  # phase -> perf_counter() when it finished
+
+
+def mark(phase: str, since: Optional[float] = None):
+    """Record the end of a startup phase (only the first time it's reached)."""
+    global _origin
+    now = time.perf_counter()
+    if _origin is None:
+        _origin = since if since is not None else now
+    _phases.setdefault(phase, now)
+
+
+def get_startup_profile() -> Dict:
+    phases = {}
+    previous = _origin
+    for phase, finished in _phases.items():
+        phases[phase] = round((finished - previous) * 1000, 1)
+        previous = finished
+    return {
+        "phases_ms": phases,
+        "total_ms": round((previous - _origin) * 1000, 1) if _phases else None,
+        "modules_loaded": len(sys.modules),
+        "lazy_modules_loaded": {name: name in sys.modules for name in LAZY_MODULES},
+    }
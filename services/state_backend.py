@@ -0,0 +1,364 @@
+import os
+import json
+import time
+import zlib
+import socket
+import sqlite3
+import tempfile
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional
+from urllib.parse import urlparse, unquote
+
+from services.metrics import observe_stage
+from services.resilience import CircuitBreaker
+
+# --- SHARED STATE BACKENDS ---
+# Where session state lives when several uvicorn workers (or instances) must
+# see the same sessions. STATE_BACKEND selects:
+#   memory  each process keeps its own sessions (default, single worker)
+#   sqlite  one WAL-mode SQLite file shared by all workers on this host
+#   redis   any Redis-protocol server (STATE_REDIS_URL), shared across hosts
+# Backends are plain key -> bytes stores with a TTL, used synchronously:
+# one read (a batch of keys) and one write (a batch of sets and TTL
+# refreshes) per round trip. Every round trip is timed against
+# STATE_LATENCY_BUDGET_MS.
+# Round trips never run on the event loop: each backend has one state I/O
+# thread, and run() / submit() hand work to it in order (so a read always
+# sees the writes submitted before it). After STATE_BREAKER_FAILURES failed
+# round trips in a row the breaker opens and calls fail fast for
+# STATE_BREAKER_RECOVERY seconds, leaving sessions on their local copies.
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory").lower()
+STATE_SQLITE_PATH = os.getenv(
+    "STATE_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "codekivy-cache", "state.sqlite3")
+)
+STATE_REDIS_URL = os.getenv("STATE_REDIS_URL", "redis://127.0.0.1:6379/0")
+STATE_KEY_PREFIX = os.getenv("STATE_KEY_PREFIX", "codekivy:")
+STATE_TIMEOUT = float(os.getenv("STATE_TIMEOUT", "2.0"))  # seconds per round trip
+STATE_LATENCY_BUDGET_MS = float(os.getenv("STATE_LATENCY_BUDGET_MS", "5"))
+STATE_BREAKER_FAILURES = int(os.getenv("STATE_BREAKER_FAILURES", "2"))
+STATE_BREAKER_RECOVERY = float(os.getenv("STATE_BREAKER_RECOVERY", "10"))
+
+# Values at least this large are zlib-compressed
+COMPRESS_MIN_BYTES = 512
+
+
+def encode_value(value) -> bytes:
+    """Compact JSON, zlib-compressed when large (1-byte format tag first)."""
+    data = json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    if len(data) >= COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(data, 6)
+    return b"j" + data
+
+
+def decode_value(blob: bytes):
+    if blob[:1] == b"z":
+        return json.loads(zlib.decompress(blob[1:]))
+    return json.loads(blob[1:])
+
+
+class StateBackend:
+    """Timing, counters, circuit breaker and the state I/O thread shared by the backends."""
+
+    name = "base"
+
+    def __init__(self, latency_budget_ms: float = STATE_LATENCY_BUDGET_MS):
+        self.latency_budget_ms = latency_budget_ms
+        self.breaker = CircuitBreaker(f"state {self.name}", STATE_BREAKER_FAILURES, STATE_BREAKER_RECOVERY)
+        self._io = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"state-{self.name}")
+        self.reads = 0
+        self.writes = 0
+        self.errors = 0
+        self.over_budget = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.max_ms = 0.0
+        self._total_ms = 0.0
+
+    def _timed(self, kind: str, started: float):
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self._total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        observe_stage(f"state_{kind}", elapsed_ms / 1000)
+        if elapsed_ms > self.latency_budget_ms:
+            self.over_budget += 1
+            if self.over_budget == 1 or self.over_budget % 100 == 0:
+                print(f"⚠️ State {kind} took {elapsed_ms:.1f} ms (budget {self.latency_budget_ms:.0f} ms, {self.over_budget} over)")
+
+    def submit(self, fn: Callable, *args) -> Future:
+        """Queue fn(*args) on the state I/O thread (after everything submitted before)."""
+        return self._io.submit(fn, *args)
+
+    async def run(self, fn: Callable, *args):
+        """Run fn(*args) on the state I/O thread and await its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args))
+
+    def read(self, keys: List[str]) -> Dict[str, bytes]:
+        """Values of the keys that exist (one round trip, blocking: call via run/submit)."""
+        self.breaker.before_call()  # fail fast while the server is unreachable
+        started = time.perf_counter()
+        try:
+            values = self._read(keys)
+        except Exception:
+            self.errors += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._timed("read", started)
+        self.breaker.record_success()
+        self.reads += 1
+        self.bytes_read += sum(len(value) for value in values.values())
+        return values
+
+    def write(self, items: Dict[str, bytes], touch: Iterable[str] = (), ttl: float = 0, delete: Iterable[str] = ()):
+        """Set items, refresh the TTL of `touch` keys and delete keys, in one round trip."""
+        self.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            self._write(items, list(touch), ttl, list(delete))
+        except Exception:
+            self.errors += 1
+            self.breaker.record_failure()
+            raise
+        finally:
+            self._timed("write", started)
+        self.breaker.record_success()
+        self.writes += 1
+        self.bytes_written += sum(len(value) for value in items.values())
+
+    def sweep(self) -> int:
+        """Remove expired keys where the store doesn't do it itself."""
+        return 0
+
+    def close(self):
+        """Finish queued round trips, then disconnect."""
+        self._io.shutdown(wait=True)
+        self._close()
+
+    def _close(self):
+        pass
+
+    def stats(self) -> Dict:
+        round_trips = self.reads + self.writes
+        return {
+            "backend": self.name,
+            "reads": self.reads,
+            "writes": self.writes,
+            "errors": self.errors,
+            "bytes_read": self.bytes_read,
+            "bytes_written": self.bytes_written,
+            "avg_ms": round(self._total_ms / round_trips, 3) if round_trips else 0.0,
+            "max_ms": round(self.max_ms, 3),
+            "latency_budget_ms": self.latency_budget_ms,
+            "over_budget": self.over_budget,
+            "breaker": self.breaker.state,
+            "short_circuited": self.breaker.short_circuited,
+        }
+
+    def _read(self, keys: List[str]) -> Dict[str, bytes]:
+        raise NotImplementedError
+
+    def _write(self, items: Dict[str, bytes], touch: List[str], ttl: float, delete: List[str]):
+        raise NotImplementedError
+
+
+class SQLiteStateBackend(StateBackend):
+    """Key/value rows with an expiry time in a WAL-mode SQLite file."""
+
+    name = "sqlite"
+
+    def __init__(self, path: str = STATE_SQLITE_PATH, latency_budget_ms: float = STATE_LATENCY_BUDGET_MS):
+        super().__init__(latency_budget_ms)
+        self.path = path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=STATE_TIMEOUT, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, expires REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS state_expires ON state (expires)")
+
+    def _read(self, keys: List[str]) -> Dict[str, bytes]:
+        if not keys:
+            return {}
+        placeholders = ",".join("?" * len(keys))
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT key, value FROM state WHERE key IN ({placeholders}) AND expires > ?",
+                (*keys, time.time())
+            ).fetchall()
+        return {key: bytes(value) for key, value in rows}
+
+    def _write(self, items: Dict[str, bytes], touch: List[str], ttl: float, delete: List[str]):
+        expires = time.time() + ttl
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                if items:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+                        [(key, value, expires) for key, value in items.items()]
+                    )
+                if touch:
+                    self._conn.executemany("UPDATE state SET expires = ? WHERE key = ?", [(expires, key) for key in touch])
+                if delete:
+                    self._conn.executemany("DELETE FROM state WHERE key = ?", [(key,) for key in delete])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def sweep(self) -> int:
+        with self._lock:
+            return self._conn.execute("DELETE FROM state WHERE expires <= ?", (time.time(),)).rowcount
+
+    def _close(self):
+        with self._lock:
+            self._conn.close()
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "path": self.path}
+
+
+class RedisError(Exception):
+    """Error reply from a Redis-protocol server."""
+
+
+class RedisStateBackend(StateBackend):
+    """
+    Minimal RESP2 client (GET/MGET/SET PX/PEXPIRE/DEL) over one socket.
+    Each read or write is sent as a single pipeline. Works with Redis,
+    Valkey, KeyDB and the like, and with benchmarks/mock_redis.py.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = STATE_REDIS_URL, latency_budget_ms: float = STATE_LATENCY_BUDGET_MS):
+        super().__init__(latency_budget_ms)
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        self._sock = socket.create_connection((self.host, self.port), timeout=STATE_TIMEOUT)
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile("rb")
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", str(self.db)))
+        if setup:
+            self._send(setup)
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._file.close()
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    @staticmethod
+    def _encode(command: tuple) -> bytes:
+        parts = [b"*%d\r\n" % len(command)]
+        for arg in command:
+            if isinstance(arg, str):
+                arg = arg.encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+        return b"".join(parts)
+
+    def _reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("state server closed the connection")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest.decode()
+        if kind == b"-":
+            return RedisError(rest.decode())
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            length = int(rest)
+            if length < 0:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if kind == b"*":
+            count = int(rest)
+            return None if count < 0 else [self._reply() for _ in range(count)]
+        raise ConnectionError(f"unexpected reply from state server: {line[:20]!r}")
+
+    def _send(self, commands: List[tuple]) -> list:
+        self._sock.sendall(b"".join(self._encode(command) for command in commands))
+        replies = [self._reply() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RedisError):
+                raise reply
+        return replies
+
+    def _pipeline(self, commands: List[tuple]) -> list:
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._connect()
+                    return self._send(commands)
+                except socket.timeout:
+                    # Unresponsive server: retrying would only double the wait
+                    self._disconnect()
+                    raise
+                except (OSError, ConnectionError):
+                    # Stale pooled connection (server restart, idle timeout): retry once
+                    self._disconnect()
+                    if attempt:
+                        raise
+
+    def _read(self, keys: List[str]) -> Dict[str, bytes]:
+        if not keys:
+            return {}
+        values = self._pipeline([("MGET", *keys)])[0]
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    def _write(self, items: Dict[str, bytes], touch: List[str], ttl: float, delete: List[str]):
+        ttl_ms = str(max(1, int(ttl * 1000)))
+        commands = [("SET", key, value, "PX", ttl_ms) for key, value in items.items()]
+        commands += [("PEXPIRE", key, ttl_ms) for key in touch]
+        if delete:
+            commands.append(("DEL", *delete))
+        if commands:
+            self._pipeline(commands)
+
+    def _close(self):
+        with self._lock:
+            self._disconnect()
+
+    def stats(self) -> Dict:
+        return {**super().stats(), "server": f"{self.host}:{self.port}/{self.db}"}
+
+
+def create_state_backend(kind: str = STATE_BACKEND) -> Optional[StateBackend]:
+    """The configured shared backend, or None for per-process memory."""
+    if kind == "sqlite":
+        backend = SQLiteStateBackend()
+    elif kind == "redis":
+        backend = RedisStateBackend()
+    else:
+        if kind != "memory":
+            print(f"⚠️ Unknown STATE_BACKEND '{kind}', keeping sessions in memory")
+        return None
+    print(f"✓ Shared session state: {backend.name}")
+    return backend
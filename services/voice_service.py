@@ -1,9 +1,16 @@
 import asyncio
 import os
+import re
+import time
+import hashlib
+from contextlib import aclosing
 import httpx
-from dotenv import load_dotenv
-
-load_dotenv()
+from typing import AsyncIterator, Callable, Dict, List, Optional
+from services.cache import LRUCache
+from services.http_client import get_client
+from services.single_flight import tts_flight
+from services.resilience import get_guard
+from services.metrics import stage, observe_stage, payload_size
 
 # --- OPTIMIZED TRANSCRIPTION ---
 
@@ -21,7 +28,7 @@ async def transcribe_audio(audio_data: bytes) -> str:
         print(f"✓ Audio: {len(audio_data)} bytes")
         
         # Use faster model and fewer features for lower latency
-        url = "https://api.deepgram.com/v1/listen?aura-2-luna-en&smart_format=false&punctuate=false&language=en"
+        url = "/v1/listen?aura-2-luna-en&smart_format=false&punctuate=false&language=en"
         
         headers = {
             "Authorization": f"Token {api_key}",
@@ -30,16 +37,15 @@ async def transcribe_audio(audio_data: bytes) -> str:
         
         print("✓ Transcribing...")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers=headers,
-                content=audio_data,
-                timeout=20.0  # Reduced timeout
-            )
-            
-            response.raise_for_status()
-            result = response.json()
+        client = get_client("deepgram")
+        response = await get_guard("deepgram").call(lambda: client.post(
+            url,
+            headers=headers,
+            content=audio_data
+        ))
+        
+        response.raise_for_status()
+        result = response.json()
         
         transcript = result.get('results', {}).get('channels', [{}])[0].get('alternatives', [{}])[0].get('transcript', '')
         
@@ -60,23 +66,58 @@ async def transcribe_audio(audio_data: bytes) -> str:
 
 # --- OPTIMIZED TTS WITH FASTER MODEL ---
 
-async def speak_text(text: str) -> bytes:
+# aura-luna-en is faster than asteria
+TTS_MODEL = os.getenv("DEEPGRAM_TTS_MODEL", "aura-2-luna-en")
+
+# Output formats: Deepgram /v1/speak options and the MIME type returned.
+# Compressed formats are a fraction of the size of 16 kHz linear16 WAV.
+TTS_FORMATS: Dict[str, tuple] = {
+    "wav": ("encoding=linear16&sample_rate=16000&container=wav", "audio/wav"),
+    "mp3": ("encoding=mp3", "audio/mpeg"),
+    "opus": ("encoding=opus&container=ogg", "audio/ogg"),
+    "flac": ("encoding=flac&sample_rate=16000", "audio/flac"),
+}
+DEFAULT_AUDIO_FORMAT = os.getenv("VOICE_AUDIO_FORMAT", "wav")
+
+# Synthesized audio keyed by (model, format, text): greetings, apologies and
+# common FAQ answers are spoken from memory instead of calling Deepgram again
+TTS_CACHE_MAX_BYTES = int(os.getenv("TTS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+TTS_CACHE_TTL = float(os.getenv("TTS_CACHE_TTL", "86400"))
+
+tts_cache = LRUCache(TTS_CACHE_MAX_BYTES, ttl=TTS_CACHE_TTL, sizeof=len, name="tts")
+
+
+def resolve_audio_format(audio_format: Optional[str] = None) -> str:
+    """Normalize a requested output format, falling back to the default."""
+    audio_format = (audio_format or DEFAULT_AUDIO_FORMAT).lower()
+    return audio_format if audio_format in TTS_FORMATS else "wav"
+
+
+def audio_mime_type(audio_format: str) -> str:
+    return TTS_FORMATS[resolve_audio_format(audio_format)][1]
+
+
+async def speak_text(text: str, audio_format: str = DEFAULT_AUDIO_FORMAT) -> bytes:
     """
     Convert text to speech using Deepgram's fastest voice.
-    Optimized for low latency.
+    Optimized for low latency; repeated text is served from tts_cache.
     """
     try:
         api_key = os.getenv("DEEPGRAM_API_KEY")
         if not api_key:
             print("❌ DEEPGRAM_API_KEY not found")
             return b"[Error: API key not configured]"
-        
-        print(f"✓ Generating speech: '{text[:50]}...'")
-        
-        # Using faster model and lower sample rate for reduced latency
-        # aura-luna-en is faster than asteria
-        url = "https://api.deepgram.com/v1/speak?model=aura-2-luna-en&encoding=linear16&sample_rate=16000&container=wav"
 
+        audio_format = resolve_audio_format(audio_format)
+        url = f"/v1/speak?model={TTS_MODEL}&{TTS_FORMATS[audio_format][0]}"
+        key = hashlib.sha256(f"{TTS_MODEL}\n{audio_format}\n{text}".encode()).hexdigest()
+
+        audio_data = tts_cache.get(key)
+        if audio_data is not None:
+            print(f"⚡ TTS cache hit: '{text[:50]}...'")
+            return audio_data
+
+        print(f"✓ Generating speech: '{text[:50]}...'")
         
         headers = {
             "Authorization": f"Token {api_key}",
@@ -87,23 +128,24 @@ async def speak_text(text: str) -> bytes:
         
         print("✓ Calling TTS...")
         
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                url,
-                headers=headers,
-                json=payload,
-                timeout=20.0  # Reduced timeout
-            )
-            
-            response.raise_for_status()
-            audio_data = response.content
+        # Identical text being synthesized concurrently shares one request
+        client = get_client("deepgram")
+        response = await tts_flight.do(key, lambda: get_guard("deepgram").call(lambda: client.post(
+            url,
+            headers=headers,
+            json=payload
+        )))
+        
+        response.raise_for_status()
+        audio_data = response.content
         
         print(f"✓ Generated {len(audio_data)} bytes")
         
         if len(audio_data) == 0:
             print("❌ No audio generated")
             return b"[Error: No audio generated]"
-            
+
+        tts_cache.set(key, audio_data)
         return audio_data
 
     except httpx.HTTPStatusError as e:
@@ -114,34 +156,151 @@ async def speak_text(text: str) -> bytes:
         return f"[Error: {str(e)}]".encode()
 
 
-# --- BONUS: PARALLEL PROCESSING FOR EVEN LOWER LATENCY ---
+def get_tts_stats() -> Dict:
+    return {
+        "model": TTS_MODEL,
+        "default_format": resolve_audio_format(),
+        "cache": tts_cache.stats(),
+    }
+
+
+# --- PIPELINED VOICE: STREAMED LLM TOKENS -> SENTENCE-LEVEL TTS ---
+
+# A sentence ends at . ! ? (or a newline) followed by whitespace
+SENTENCE_END = re.compile(r"[.!?\n]+[\"')\]]*\s")
 
-async def process_voice_fast(audio_data: bytes, llm_service) -> tuple:
+# Very short fragments ("Hi.") are merged with the next sentence so we don't
+# pay a TTS round-trip for a single word
+MIN_SENTENCE_CHARS = 20
+
+# Maximum concurrent Deepgram TTS requests per voice turn
+MAX_CONCURRENT_TTS = int(os.getenv("VOICE_MAX_CONCURRENT_TTS", "3"))
+
+
+async def split_sentences(tokens: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Cut a stream of LLM tokens into sentences as soon as each one is complete."""
+    buffer = ""
+    async for token in tokens:
+        buffer += token
+        search_from = 0
+        while True:
+            match = SENTENCE_END.search(buffer, search_from)
+            if not match:
+                break
+            if match.end() < MIN_SENTENCE_CHARS:
+                search_from = match.end()
+                continue
+            sentence = buffer[:match.end()].strip()
+            buffer = buffer[match.end():]
+            search_from = 0
+            if sentence:
+                yield sentence
+    if buffer.strip():
+        yield buffer.strip()
+
+
+async def process_voice_fast(
+    audio_data: bytes,
+    llm_stream: Callable[[str], AsyncIterator[str]],
+    max_concurrent_tts: int = MAX_CONCURRENT_TTS,
+    audio_format: str = DEFAULT_AUDIO_FORMAT
+) -> AsyncIterator[Dict]:
     """
-    Process voice with maximum speed using parallel operations where possible.
+    Staged voice pipeline: transcribe -> stream LLM tokens -> per-sentence TTS.
+    
+    Sentences are synthesized concurrently (bounded by max_concurrent_tts)
+    while the LLM is still generating, and audio is yielded strictly in
+    sentence order as soon as each chunk is ready.
     
     Args:
         audio_data: Raw audio bytes
-        llm_service: Function to call for LLM response (e.g., get_groq_response)
+        llm_stream: Function taking the transcript and returning an async
+            iterator of text tokens (e.g. a Groq streaming call)
+        audio_format: TTS output format (see TTS_FORMATS)
     
-    Returns:
-        tuple: (transcript, text_response, audio_response_bytes)
+    Yields event dicts:
+        {"type": "transcript", "text": ...}
+        {"type": "sentence", "index": i, "text": ...}
+        {"type": "audio", "index": i, "audio": audio_bytes}
+        {"type": "error", "index": i, "error": ...}
+        {"type": "done", "text": full_response}
     """
-    try:
-        # Step 1: Transcribe (must be first)
+    # Stage 1: Transcribe (must be first)
+    payload_size.observe(len(audio_data), "voice_input")
+    with stage("stt"):
         transcript = await transcribe_audio(audio_data)
-        
-        if transcript.startswith("[Error"):
-            return transcript, "", b""
-        
-        # Step 2: Get LLM response (Groq is fastest)
-        text_response = await llm_service(transcript)
-        
-        # Step 3: Generate TTS
-        audio_response = await speak_text(text_response)
-        
-        return transcript, text_response, audio_response
-        
-    except Exception as e:
-        print(f"❌ Processing error: {e}")
-        return f"[Error: {e}]", "", b""
+    if transcript.startswith("[Error"):
+        yield {"type": "error", "error": transcript}
+        return
+    yield {"type": "transcript", "text": transcript}
+
+    async with aclosing(speak_response(transcript, llm_stream, max_concurrent_tts, audio_format)) as events:
+        async for event in events:
+            yield event
+
+
+async def speak_response(
+    transcript: str,
+    llm_stream: Callable[[str], AsyncIterator[str]],
+    max_concurrent_tts: int = MAX_CONCURRENT_TTS,
+    audio_format: str = DEFAULT_AUDIO_FORMAT
+) -> AsyncIterator[Dict]:
+    """
+    Stages 2-3 of the voice pipeline for an already transcribed utterance
+    (used directly by the live WebSocket endpoint). Yields the sentence,
+    audio, error and done events of process_voice_fast.
+    """
+    semaphore = asyncio.Semaphore(max_concurrent_tts)
+    # Sentences in LLM order with their (already started) TTS tasks
+    pending: asyncio.Queue = asyncio.Queue()
+    sentences: List[str] = []
+
+    async def synthesize(sentence: str) -> bytes:
+        async with semaphore:
+            with stage("tts"):
+                return await speak_text(sentence, audio_format)
+
+    async def produce():
+        # Stage 2: stream tokens, cut at sentence boundaries, start TTS early
+        started = time.perf_counter()
+        try:
+            async for sentence in split_sentences(llm_stream(transcript)):
+                if not sentences:
+                    observe_stage("llm_first_sentence", time.perf_counter() - started)
+                sentences.append(sentence)
+                task = asyncio.create_task(synthesize(sentence))
+                pending.put_nowait((len(sentences) - 1, sentence, task))
+        finally:
+            observe_stage("llm", time.perf_counter() - started)
+            pending.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    in_flight: List[asyncio.Task] = []
+    try:
+        # Stage 3: emit audio in order as each sentence's TTS completes
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            index, sentence, task = item
+            in_flight.append(task)
+            yield {"type": "sentence", "index": index, "text": sentence}
+            audio = await task
+            in_flight.remove(task)
+            if not audio or audio.startswith(b"[Error"):
+                yield {"type": "error", "index": index, "error": audio.decode(errors="replace")}
+                continue
+            yield {"type": "audio", "index": index, "audio": audio}
+
+        await producer
+        yield {"type": "done", "text": " ".join(sentences)}
+
+    finally:
+        # Client went away or something failed: stop generating and synthesizing
+        producer.cancel()
+        for task in in_flight:
+            task.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if item is not None:
+                item[2].cancel()